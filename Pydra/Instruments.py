@@ -1,8 +1,119 @@
 __author__ = 'Hwaipy'
 
+import concurrent.futures
+import copy
+import functools
+import json
+import os
+import threading
+import time
 import pyvisa as visa
-from Utils import SingleThreadProcessor
-from SCPI import SCPI
+from Utils import FairLock, SingleThreadProcessor
+from SCPI import SCPI, readBlock
+
+_resourceManager = None
+_resourceManagerLock = threading.Lock()
+
+
+# The ResourceManager shared by all instruments of this process.
+def resourceManager():
+    global _resourceManager
+    with _resourceManagerLock:
+        if _resourceManager is None:
+            _resourceManager = visa.ResourceManager()
+        return _resourceManager
+
+
+# Transports other than VISA, by prefix of the resource ID: prefix -> (opener(resourceID), lister()). Resources are
+# opened with the first matching transport, otherwise with the shared ResourceManager. A transport opens objects with
+# the pyvisa resource methods used by VISAInstrument (query, write, write_raw, read_bytes, close, timeout, ...).
+Transports = {}
+
+
+def registerTransport(prefix, opener, lister):
+    Transports[prefix] = (opener, lister)
+
+
+def openResource(resourceID):
+    for prefix, (opener, lister) in Transports.items():
+        if resourceID.startswith(prefix):
+            return opener(resourceID)
+    return resourceManager().open_resource(resourceID)
+
+
+# Resources of VISA and of the registered transports. VISA may be missing if there are other transports.
+def listResourceIDs():
+    resources = []
+    try:
+        resources += list(resourceManager().list_resources())
+    except ValueError as e:
+        if len(Transports) == 0:
+            raise e
+    for prefix, (opener, lister) in Transports.items():
+        resources += lister()
+    return resources
+
+
+# Identities (the 4 fields of *IDN?) of VISA resources, valid for ttl seconds. If path is given, the cache is loaded
+# from and saved to that JSON file, so that it persists between processes. put with save=False only updates the
+# memory, for callers that put many identities and save once.
+class IdentityCache:
+    def __init__(self, ttl=3600, path=None):
+        self.ttl = ttl
+        self.path = path
+        self.__identities = {}
+        self.__lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path) as file:
+                    self.__identities = {resource: (entry[0], entry[1]) for resource, entry in json.load(file).items()}
+            except (ValueError, OSError):
+                pass
+
+    def get(self, resource):
+        with self.__lock:
+            entry = self.__identities.get(resource)
+        if entry is None or time.time() - entry[1] > self.ttl:
+            return None
+        return list(entry[0])
+
+    def put(self, resource, idns, save=True):
+        with self.__lock:
+            self.__identities[resource] = (list(idns), time.time())
+        if save:
+            self.save()
+
+    def invalidate(self, resource=None):
+        with self.__lock:
+            if resource is None:
+                self.__identities.clear()
+            else:
+                self.__identities.pop(resource, None)
+        self.save()
+
+    # Written under the lock to a temporary file that replaces the JSON file, so that concurrent saves neither
+    # interleave nor overwrite a newer snapshot, and a reader never sees a partial file.
+    def save(self):
+        if self.path is None:
+            return
+        with self.__lock:
+            content = json.dumps({resource: list(entry) for resource, entry in self.__identities.items()})
+            temporaryPath = '{}.{}.tmp'.format(self.path, os.getpid())
+            with open(temporaryPath, 'w') as file:
+                file.write(content)
+            os.replace(temporaryPath, self.path)
+
+
+DefaultIdentityCache = IdentityCache()
+
+
+def parseIdentity(idn):
+    if idn is None:
+        return [''] * 4
+    idns = [i.strip() for i in idn.strip().split(',')] if len(idn.strip()) > 0 else []
+    while len(idns) < 4:
+        idns.append('')
+    return idns[:4]
 
 
 class Instrument:
@@ -12,55 +123,87 @@ class Instrument:
 class VISAInstrument(Instrument):
     manufacturer = 'USTC'
     model = 'VISAInstrument'
+    # Read-mostly state for InstrumentsServer: results of cachedQueries are reused until a call of stateSetters
+    # (name -> number of leading args that select the state, e.g. a channel) changes the state.
+    cachedQueries = ('getIdentity', 'getSerialNumber', 'getManufacturer', 'getModel')
+    stateSetters = {}
 
     def __init__(self, resourceID, channel=1):
         self.resourceID = resourceID
         self.channelCount = channel
+        self.identity = None
         try:
-            self.resource = visa.ResourceManager().open_resource(resourceID)
+            self.resource = openResource(resourceID)
             self.resource.timeout = 30000
         except BaseException as e:
             raise DeviceException('Error in open device ID: {}'.format(id), e)
         stp = SingleThreadProcessor()
+        self.processor = stp
 
         def stpQuery(*args):
             return stp.invokeAndWait(self.resource.query, *args)
 
-        def stpWrite(*args):
-            stp.invokeLater(self.resource.write, *args)
+        # Writes queued while the resource is busy are coalesced into one message.
+        def stpWrite(cmd):
+            stp.writeLater(self.resource.write, cmd, SCPI.joinCommands, SCPI.MaxLineLength)
+
+        def queryBlock(cmd):
+            self.resource.write(cmd)
+            return readBlock(self.resource.read_bytes)
+
+        def stpQueryRaw(cmd):
+            return stp.invokeAndWait(queryBlock, cmd)
 
-        self.scpi = SCPI(stpQuery, stpWrite)
+        def stpWriteRaw(message):
+            termination = (self.resource.write_termination or '').encode('ascii')
+            stp.invokeLater(self.resource.write_raw, message + termination)
+
+        self.scpi = SCPI(stpQuery, stpWrite, queryRaw=stpQueryRaw, writeRaw=stpWriteRaw)
         self.verifyIdentity()
 
+    # Returns a Future of the response (without the trailing newline). Queries of PriorityBulk are taken after the
+    # interactive I/O queued on the instrument.
+    def submitQuery(self, cmd, priority=SingleThreadProcessor.PriorityInteractive):
+        self.scpi.flush()
+        return self.processor.submit(priority, lambda: self.resource.query(cmd).rstrip('\n'))
+
+    # The identity is read once when the instrument is opened; refreshIdentity() reads it again from the instrument.
     def getIdentity(self):
-        idn = self.scpi._IDN.query()
-        if idn is None:
-            return [''] * 4
-        if len(idn) is 0:
-            return [''] * 4
-        idns = idn.split(',')
-        while len(idns) < 4:
-            idns.append('')
-        return idns[:4]
+        return list(self.identity)
+
+    def refreshIdentity(self):
+        self.identity = parseIdentity(self.scpi._IDN.query())
+        DefaultIdentityCache.put(self.resourceID, self.identity)
+        return self.getIdentity()
 
     def getSerialNumber(self):
-        return self.getIdentity()[2]
+        return self.identity[2]
 
     def getManufacturer(self):
-        return self.getIdentity()[0]
+        return self.identity[0]
 
     def getModel(self):
-        return self.getIdentity()[1]
+        return self.identity[1]
 
+    # A fresh identity in DefaultIdentityCache (e.g. from listResources) is used without probing the resource, unless
+    # it does not match this class.
     def verifyIdentity(self):
-        idns = self.getIdentity()
-        if ((idns[0].strip() == self.__class__.manufacturer)) and ((idns[1].strip() == self.__class__.model)):
+        if self.identity is None:
+            self.identity = DefaultIdentityCache.get(self.resourceID)
+            if self.identity is None or not self.__class__.matchIdentity(self.identity):
+                self.refreshIdentity()
+        idns = self.identity
+        if self.__class__.matchIdentity(idns):
             self.serialNumber = idns[2]
             self.version = idns[3]
             self.maxChannelNum = 1
         else:
             raise DeviceException('Identity {} not recognized.'.format(idns))
 
+    @classmethod
+    def matchIdentity(cls, idns):
+        return idns[0] == cls.manufacturer and idns[1] == cls.model
+
     def checkChannel(self, channel):
         if channel >= 0 and channel < self.channelCount:
             return
@@ -69,51 +212,84 @@ class VISAInstrument(Instrument):
     def getVersion(self):
         return self.scpi.System.Version.query()
 
+    # Whether the result of the query name can be reused, see cachedQueries. Overridden by instruments with queries
+    # that are only stable in some states.
+    def isCachedQuery(self, name):
+        return name in self.cachedQueries
+
     def close(self):
         self.resource.close()
 
     @classmethod
     def connect(cls, resourceID):
-        wrapper = VISAInstrumentWrapper(cls(resourceID))
-        wrapper.verifyIdentity()
-        return wrapper
+        return VISAInstrumentWrapper(cls(resourceID))
 
+    # Resources are probed concurrently with *IDN?, each with its own timeout (in ms). Identities in the cache are
+    # used without probing.
     @classmethod
-    def listResources(cls):
-        resources = visa.ResourceManager().list_resources()
-        valid = []
-        for resource in resources:
+    def listResources(cls, timeout=100, maxWorkers=16, cache=DefaultIdentityCache):
+        resources = listResourceIDs()
+
+        def probe(resource):
+            idns = None if cache is None else cache.get(resource)
+            if idns is not None:
+                return idns
             try:
-                r = visa.ResourceManager().open_resource(resource)
-                r.timeout = 100
-                idn = r.query('*IDN?')[:-1]
-                idns = [i.strip(' ') for i in idn.split(',')]
-                if (idns[0] == cls.manufacturer) and (idns[1] == cls.model):
-                    valid.append(resource)
-                r.close()
+                r = openResource(resource)
+                try:
+                    r.timeout = timeout
+                    idns = parseIdentity(r.query('*IDN?'))
+                finally:
+                    r.close()
             except BaseException as e:
-                pass
-        return valid
+                return None
+            if cache is not None:
+                cache.put(resource, idns, save=False)
+                probed.append(resource)
+            return idns
 
+        if len(resources) == 0:
+            return []
+        probed = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(maxWorkers, len(resources))) as executor:
+            identities = list(executor.map(probe, resources))
+        if len(probed) > 0:
+            cache.save()
+        return [resource for resource, idns in zip(resources, identities) if
+                idns is not None and cls.matchIdentity(idns)]
 
+
+# Decorates an instrument method, so that its errors are raised as DeviceException('Error in name', error).
+def deviceMethod(method, name=None):
+    message = 'Error in {}'.format(method.__name__ if name is None else name)
+
+    @functools.wraps(method)
+    def instrumentInvoke(*args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        except DeviceException:
+            raise
+        except BaseException as e:
+            raise DeviceException(message, e)
+
+    return instrumentInvoke
+
+
+# Methods are wrapped on first access and interned as attributes, so that later calls do not reach __getattr__.
 class VISAInstrumentWrapper:
     def __init__(self, instrument):
         self.instrument = instrument
 
     def __getattr__(self, item):
+        if item.startswith('__'):
+            raise AttributeError(item)
         try:
             method = self.instrument.__getattribute__(item)
         except AttributeError as ae:
             raise AttributeError("'{}' object has no attribute '{}'".format(self.instrument.__class__, item))
-
-        def instrumentInvoke(*args, **kwargs):
-            try:
-                return method(*args, **kwargs)
-            except BaseException as e:
-                if isinstance(e, DeviceException):
-                    raise e
-                raise DeviceException('Error in {}'.format(item), e)
-
+        instrumentInvoke = deviceMethod(method, item)
+        if callable(method):
+            setattr(self, item, instrumentInvoke)
         return instrumentInvoke
 
 
@@ -123,10 +299,173 @@ class DeviceException(BaseException):
         self.exception = exception
 
 
+# An instrument shared by the clients of an InstrumentsServer. Calls are serialized in order of arrival (exclusive()
+# holds the instrument over several calls), and errors are raised as DeviceException. A state setter called with the
+# args already applied is skipped, and cached queries are answered without I/O until the state changes. Methods not
+# declared by the instrument class leave the cache as is.
+class SharedInstrument:
+    def __init__(self, instrument):
+        self.instrument = instrument
+        self.__lock = FairLock()
+        self.__methods = {}
+        self.__queries = {}
+        self.__states = {}
+        self.__statistics = {'Calls': 0, 'CachedQueries': 0, 'SkippedSetters': 0}
+
+    def exclusive(self):
+        return self.__lock
+
+    def invalidate(self):
+        with self.__lock:
+            self.__queries.clear()
+            self.__states.clear()
+
+    def statistics(self):
+        with self.__lock:
+            return dict(self.__statistics)
+
+    def invoke(self, name, *args, **kwargs):
+        cls = self.instrument.__class__
+        key = (name, args, tuple(sorted(kwargs.items())))
+        with self.__lock:
+            self.__statistics['Calls'] += 1
+            cached = self.instrument.isCachedQuery(name)
+            if cached and key in self.__queries:
+                self.__statistics['CachedQueries'] += 1
+                return copy.copy(self.__queries[key])
+            if name in cls.stateSetters:
+                slot = (name, args[:cls.stateSetters[name]])
+                if self.__states.get(slot) == key:
+                    self.__statistics['SkippedSetters'] += 1
+                    return None
+                # Cleared before the call, as a setter that fails may still have changed the state.
+                self.__states.pop(slot, None)
+                self.__queries.clear()
+            method = self.__methods.get(name)
+            if method is None:
+                method = deviceMethod(getattr(self.instrument, name), name)
+                self.__methods[name] = method
+            result = method(*args, **kwargs)
+            if cached:
+                self.__queries[key] = copy.copy(result)
+            elif name in cls.stateSetters:
+                self.__states[slot] = key
+            return result
+
+    def __getattr__(self, item):
+        if item.startswith('__'):
+            raise AttributeError(item)
+        if not callable(getattr(self.instrument, item)):
+            return getattr(self.instrument, item)
+        invoke = functools.partial(self.invoke, item)
+        setattr(self, item, invoke)
+        return invoke
+
+
+# Owns one session of each instrument and shares it between local clients (open) and Pydra clients (serve). A Pydra
+# service calls the methods of wrapper(sharedInstrument) (e.g. MultiMeterServiceWrap), or of the shared instrument.
 class InstrumentsServer:
-    def __init__(self):
-        pass
+    def __init__(self, address=None, sessionFactory=None):
+        self.address = address
+        self.sessionFactory = sessionFactory
+        self.__instruments = {}
+        self.__sessions = {}
+        self.__lock = threading.Lock()
+
+    # Returns the SharedInstrument of resourceID, opened by instrumentClass(resourceID) on first use.
+    def open(self, instrumentClass, resourceID):
+        with self.__lock:
+            shared = self.__instruments.get(resourceID)
+            if shared is None:
+                shared = SharedInstrument(instrumentClass(resourceID))
+                self.__instruments[resourceID] = shared
+            elif not isinstance(shared.instrument, instrumentClass):
+                raise DeviceException('{} is opened as {}.'.format(resourceID, shared.instrument.__class__.__name__))
+            return shared
+
+    def serve(self, resourceID, name, wrapper=None):
+        with self.__lock:
+            if not self.__instruments.__contains__(resourceID):
+                raise DeviceException('{} is not opened.'.format(resourceID))
+            if self.__sessions.__contains__(name):
+                raise DeviceException('Service {} exists.'.format(name))
+            shared = self.__instruments[resourceID]
+            sessionFactory = self.sessionFactory
+            if sessionFactory is None:
+                import Pydra
+                sessionFactory = Pydra.Session.newSession
+            session = sessionFactory(self.address, shared if wrapper is None else wrapper(shared), name)
+            self.__sessions[name] = (resourceID, session)
+            return session
+
+    def instruments(self):
+        with self.__lock:
+            return {resourceID: shared.instrument.getModel() for resourceID, shared in self.__instruments.items()}
+
+    def services(self):
+        with self.__lock:
+            return {name: resourceID for name, (resourceID, session) in self.__sessions.items()}
+
+    # Stops the services of resourceID (or of all) and closes the instrument.
+    def close(self, resourceID=None):
+        with self.__lock:
+            resourceIDs = list(self.__instruments.keys()) if resourceID is None else [resourceID]
+            for name, (rID, session) in list(self.__sessions.items()):
+                if rID in resourceIDs:
+                    session.stop()
+                    del self.__sessions[name]
+            for rID in resourceIDs:
+                shared = self.__instruments.pop(rID, None)
+                if shared is not None:
+                    with shared.exclusive():
+                        shared.instrument.close()
+
+
+# Calls per second of getSerialNumber (no I/O) and getVersion (a query) of a simulated instrument: directly, through
+# a wrapper that builds the exception translating closure per call (as VISAInstrumentWrapper did before the methods
+# were interned), and through VISAInstrumentWrapper.
+def benchmark(count=200000):
+    # The transport is registered on the module Instruments, which differs from __main__ when run as a script.
+    import Instruments
+    import SimulatedVISA
+
+    SimulatedVISA.simulate('SIM::BENCHMARK', SimulatedVISA.SimulatedScript())
+    instrument = Instruments.VISAInstrument('SIM::BENCHMARK')
+    wrapper = Instruments.VISAInstrumentWrapper(instrument)
+
+    class UncachedWrapper:
+        def __getattr__(self, item):
+            method = instrument.__getattribute__(item)
+
+            def instrumentInvoke(*args, **kwargs):
+                try:
+                    return method(*args, **kwargs)
+                except BaseException as e:
+                    if isinstance(e, Instruments.DeviceException):
+                        raise e
+                    raise Instruments.DeviceException('Error in {}'.format(item), e)
+
+            return instrumentInvoke
+
+    uncached = UncachedWrapper()
+    rates = {}
+    for method, calls in [('getSerialNumber', count), ('getVersion', count // 20)]:
+        for name, target in [('Direct', instrument), ('Uncached', uncached), ('Cached', wrapper)]:
+            start = time.time()
+            for i in range(0, calls):
+                getattr(target, method)()
+            rates[(method, name)] = calls / (time.time() - start)
+            print('{:>15} {:>8}: {:.0f} calls/s, {:.3f} us/call'.format(method, name, rates[(method, name)],
+                                                                        1e6 / rates[(method, name)]))
+    instrument.close()
+    SimulatedVISA.remove('SIM::BENCHMARK')
+    return rates
 
 
 if __name__ == '__main__':
+    import sys
+
+    if sys.argv[1:] == ['benchmark']:
+        benchmark()
+        sys.exit(0)
     print('Instrument')
@@ -1,13 +1,90 @@
 __author__ = 'Hwaipy'
 
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
 
-class SCPI:
-    def __init__(self, query, write):
-        self.query = query
-        self.write = write
 
+class SCPI:
+    # Maximum length of a ';' joined message sent by batch().
+    MaxLineLength = 4096
+
+    # queryRaw(cmd) returns the IEEE 488.2 block of the response as bytes, and writeRaw(message) sends bytes. They are
+    # needed by the binary transfers only.
+    def __init__(self, query, write, maxLineLength=None, queryRaw=None, writeRaw=None):
+        self.__query = query
+        self.__write = write
+        self.__queryRaw = queryRaw
+        self.__writeRaw = writeRaw
+        self.maxLineLength = SCPI.MaxLineLength if maxLineLength is None else maxLineLength
+        self.__batches = threading.local()
+
+    # Pending writes of a batch are sent before the query, so that the query sees their effect.
+    def query(self, cmd):
+        self.flush()
+        return self.__query(cmd)
+
+    def write(self, cmd):
+        pending = getattr(self.__batches, 'pending', None)
+        if pending is None:
+            self.__write(cmd)
+            return
+        if len(pending) > 0 and self.__batches.length + len(cmd) > self.maxLineLength:
+            self.flush()
+        self.__batches.pending.append(cmd)
+        self.__batches.length += len(cmd) + 2
+
+    # Writes in the context (of this thread) are joined with ';' into as few messages as maxLineLength allows. The
+    # messages are sent at the end of the outermost batch, or before a query.
+    @contextmanager
+    def batch(self):
+        outermost = getattr(self.__batches, 'pending', None) is None
+        if outermost:
+            self.__batches.pending = []
+            self.__batches.length = 0
+        try:
+            yield self
+        finally:
+            if outermost:
+                try:
+                    self.flush()
+                finally:
+                    self.__batches.pending = None
+
+    def queryBinary(self, cmd, dtype):
+        if self.__queryRaw is None:
+            raise RuntimeError('Binary transfer is not supported.')
+        self.flush()
+        return parseBlock(self.__queryRaw(cmd), dtype)
+
+    def writeBinary(self, message):
+        if self.__writeRaw is None:
+            raise RuntimeError('Binary transfer is not supported.')
+        self.flush()
+        self.__writeRaw(message)
+
+    def flush(self):
+        pending = getattr(self.__batches, 'pending', None)
+        if pending is None or len(pending) == 0:
+            return
+        self.__batches.pending = []
+        self.__batches.length = 0
+        self.__write(SCPI.joinCommands(pending))
+
+    # A ':' restarts each command from the root of the command tree, while common commands (*XXX) are left as is.
+    @classmethod
+    def joinCommands(cls, commands):
+        return commands[0] + ''.join([(';' if c.startswith('*') or c.startswith(':') else ';:') + c
+                                      for c in commands[1:]])
+
+    # The command is interned as an attribute, so that later accesses of the same path do not reach __getattr__.
     def __getattr__(self, item):
-        return SCPICommand(self, item)
+        if item.startswith('__'):
+            raise AttributeError(item)
+        command = SCPICommand(self, item)
+        setattr(self, item, command)
+        return command
 
 
 class SCPICommand:
@@ -21,35 +98,113 @@ class SCPICommand:
             self.fullCmd = parent.fullCmd + ":" + self.cmd
         else:
             self.fullCmd = self.cmd
+        # (isQuery, number of args) -> format template of the command.
+        self.templates = {(False, 0): self.fullCmd, (True, 0): self.fullCmd + '?'}
 
     def query(self, *args):
-        re = self.scpi.query(self.createCommand(True, [arg for arg in args]))
+        re = self.scpi.query(self.createCommand(True, args))
         if re is not None:
             if (len(re)>0) and (re[-1]=='\n'):
                 re = re[:-1]
         return re
 
     def write(self, *args):
-        self.scpi.write(self.createCommand(False, [arg for arg in args]))
-
-    def createCommand(self, isQuery, args=[]):
-        cmd = self.fullCmd
-        if isQuery:
-            cmd += '?'
-        if len(args) > 0:
-            cmd += ' {}'.format(args[0])
-            for i in range(1, len(args)):
-                cmd += ',{}'.format(args[i])
-        return cmd
+        self.scpi.write(self.createCommand(False, args))
+
+    # The response is an IEEE 488.2 definite-length block, decoded as a NumPy array of dtype (e.g. '>f8').
+    def queryBinary(self, dtype, *args):
+        return self.scpi.queryBinary(self.createCommand(True, args), dtype)
+
+    # The array is sent as an IEEE 488.2 definite-length block after the args.
+    def writeBinary(self, array, *args):
+        header = self.createCommand(False, args + ('',)) if len(args) > 0 else self.fullCmd + ' '
+        self.scpi.writeBinary(header.encode('ascii') + encodeBlock(array))
+
+    def createCommand(self, isQuery, args=()):
+        key = (isQuery, len(args))
+        template = self.templates.get(key)
+        if template is None:
+            template = '{}{} {}'.format(self.fullCmd, '?' if isQuery else '', ','.join(['{}'] * len(args)))
+            self.templates[key] = template
+        return template.format(*args) if len(args) > 0 else template
 
     def __getattr__(self, item):
-        return SCPICommand(self.scpi, item, self)
+        if item.startswith('__'):
+            raise AttributeError(item)
+        command = SCPICommand(self.scpi, item, self)
+        setattr(self, item, command)
+        return command
 
     def __str__(self):
         return '[SCPI]' + self.fullCmd
 
 
+# IEEE 488.2 definite-length arbitrary block: '#', the number of digits of the length, the length, and the data.
+def encodeBlock(array):
+    data = np.ascontiguousarray(array).tobytes()
+    length = str(len(data))
+    return '#{}{}'.format(len(length), length).encode('ascii') + data
+
+
+# Decodes a block (leading whitespace and trailing terminator allowed). '#0' is the indefinite-length form, where the
+# data extend to the terminating newline.
+def parseBlock(block, dtype):
+    block = bytes(block).lstrip()
+    if len(block) < 2 or block[0:1] != b'#' or not block[1:2].isdigit():
+        raise RuntimeError('Not an IEEE 488.2 block: {}'.format(block[:20]))
+    digits = int(block[1:2])
+    if digits == 0:
+        data = block[2:-1] if block.endswith(b'\n') else block[2:]
+    else:
+        length = int(block[2:2 + digits])
+        data = block[2 + digits:2 + digits + length]
+        if len(data) != length:
+            raise RuntimeError('Block truncated: {} of {} bytes.'.format(len(data), length))
+    return np.frombuffer(data, dtype=dtype)
+
+
+# Reads a definite-length block and its terminator with read(count), e.g. the read_bytes of a VISA resource.
+def readBlock(read):
+    head = read(2)
+    while head[0:1].isspace():
+        head = head[1:] + read(1)
+    if head[0:1] != b'#' or not head[1:2].isdigit() or head[1:2] == b'0':
+        raise RuntimeError('Not an IEEE 488.2 definite-length block: {}'.format(head))
+    length = read(int(head[1:2]))
+    data = read(int(length))
+    read(1)
+    return head + length + data
+
+
+# Commands built per second, with a fresh command path per call (as SCPI did before the commands were interned) and
+# with the interned path.
+def benchmark(count=200000):
+    scpi = SCPI(lambda cmd: '', lambda cmd: None)
+
+    def uncached():
+        conf = SCPICommand(scpi, 'CONF')
+        SCPICommand(scpi, 'DC', SCPICommand(scpi, 'VOLT', conf)).createCommand(False, ('AUTO',))
+
+    def cached():
+        scpi.CONF.VOLT.DC.createCommand(False, ('AUTO',))
+
+    rates = {}
+    for name, build in [('Uncached', uncached), ('Cached', cached)]:
+        start = time.time()
+        for i in range(0, count):
+            build()
+        rates[name] = count / (time.time() - start)
+        print('{:>8}: {:.0f} commands/s'.format(name, rates[name]))
+    return rates
+
+
 if __name__ == "__main__":
+    import sys
+
+    if sys.argv[1:] == ['benchmark']:
+        benchmark()
+        sys.exit(0)
+
     def query(cmd):
         print('[Qeury]' + cmd)
 
@@ -0,0 +1,152 @@
+__author__ = 'Hwaipy'
+
+import os
+import struct
+import numpy as np
+
+
+class HBTFile:
+    BYTE = 'Byte'
+    SHORT = 'Short'
+    INT = 'Int'
+    LONG = 'Long'
+    FLOAT = 'Float'
+    DOUBLE = 'Double'
+
+    # HBT layout, same as HydraBinaryTableStorageElementExtension in StorageService:
+    # b'HBT\0', big-endian Int32 of head length, UTF-8 head of lines 'DataType:Title' joined by '\n',
+    # then rows packed big-endian without padding.
+    Magic = b'HBT\0'
+    DataTypes = {BYTE: '>i1', SHORT: '>i2', INT: '>i4', LONG: '>i8', FLOAT: '>f4', DOUBLE: '>f8'}
+
+    def __init__(self, path):
+        self.path = path
+        self.__heads = None
+        self.__dtype = None
+        self.__headLength = 0
+        self.__rows = None
+        if not self.path.lower().endswith('.hbt'):
+            raise IOError('Invalid HBT file. Should be .hbt file.')
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            self.__load()
+
+    @classmethod
+    def fetch(cls, storageElement, path, blockSize=10000000):
+        size = storageElement.metaData()['Size']
+        with open(path, 'wb') as file:
+            position = 0
+            while position < size:
+                length = min(blockSize, size - position)
+                file.write(storageElement.read(position, length))
+                position += length
+        return HBTFile(path)
+
+    def initialize(self, heads):
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            raise IOError('Can not initialize an non-empty HBT file.')
+        for head in heads:
+            if not HBTFile.DataTypes.__contains__(head[1]):
+                raise IOError('Data type {} is not acceptable.'.format(head[1]))
+        headBytes = '\n'.join(['{}:{}'.format(head[1], head[0]) for head in heads]).encode('UTF-8')
+        with open(self.path, 'wb') as file:
+            file.write(HBTFile.Magic + struct.pack('>i', len(headBytes)) + headBytes)
+        self.__load()
+
+    def appendRows(self, rows):
+        self.__checkInitialized()
+        for row in rows:
+            if len(row) != len(self.__heads):
+                raise IOError('Row Data size not match. Should be {}.'.format(len(self.__heads)))
+        buffer = np.empty(len(rows), dtype=self.__dtype)
+        for i in range(0, len(self.__heads)):
+            buffer[self.__dtype.names[i]] = [row[i] for row in rows]
+        self.__rows = None
+        with open(self.path, 'ab') as file:
+            file.write(buffer.tobytes())
+
+    def appendRow(self, row):
+        return self.appendRows([row])
+
+    def readRows(self, start, count):
+        rows = self.rows()
+        if start < 0 or start + count > len(rows):
+            raise IOError('Out of row count: {} > {}.'.format(start + count, len(rows)))
+        return [list(row) for row in rows[start:start + count].tolist()]
+
+    def readRow(self, rowNum):
+        return self.readRows(rowNum, 1)[0]
+
+    def readAllRows(self):
+        return self.readRows(0, self.getRowCount())
+
+    def readMetaData(self):
+        self.__checkInitialized()
+        return {'ColumnCount': len(self.__heads), 'RowDataLength': self.__dtype.itemsize,
+                'RowCount': self.getRowCount(), 'Heads': [[h[0], h[1]] for h in self.__heads]}
+
+    def getColumnCount(self):
+        self.__checkInitialized()
+        return len(self.__heads)
+
+    def getRowCount(self):
+        self.__checkInitialized()
+        return int((os.path.getsize(self.path) - self.__headLength) / self.__dtype.itemsize)
+
+    def getHeads(self):
+        self.__checkInitialized()
+        return [[h[0], h[1]] for h in self.__heads]
+
+    def getHeadNames(self):
+        return [h[0] for h in self.getHeads()]
+
+    # Rows as a read-only structured numpy.memmap. Nothing is read from disk until the view is sliced.
+    def rows(self):
+        self.__checkInitialized()
+        rowCount = self.getRowCount()
+        if self.__rows is None or len(self.__rows) != rowCount:
+            if rowCount == 0:
+                self.__rows = np.zeros(0, dtype=self.__dtype)
+            else:
+                self.__rows = np.memmap(self.path, dtype=self.__dtype, mode='r', offset=self.__headLength,
+                                        shape=(rowCount,))
+        return self.__rows
+
+    # Column by title or by index, as a strided view over the memmap.
+    def column(self, column):
+        self.__checkInitialized()
+        if isinstance(column, int):
+            index = column
+        else:
+            names = self.getHeadNames()
+            if not names.__contains__(column):
+                raise IOError('Column {} not exists.'.format(column))
+            index = names.index(column)
+        return self.rows()[self.__dtype.names[index]]
+
+    def columns(self):
+        return [self.column(i) for i in range(0, self.getColumnCount())]
+
+    def close(self):
+        self.__rows = None
+
+    def __checkInitialized(self):
+        if self.__heads is None:
+            raise IOError('HBT file {} not initialized.'.format(self.path))
+
+    def __load(self):
+        with open(self.path, 'rb') as file:
+            headMeta = file.read(8)
+            if len(headMeta) < 8 or headMeta[:4] != HBTFile.Magic:
+                raise IOError('Invalid HBT file: {}.'.format(self.path))
+            headSize = struct.unpack('>i', headMeta[4:])[0]
+            headString = str(file.read(headSize), encoding='UTF-8')
+        heads = []
+        for line in headString.split('\n'):
+            s = line.split(':', 1)
+            if not HBTFile.DataTypes.__contains__(s[0]):
+                raise IOError('Data type {} is not acceptable.'.format(s[0]))
+            heads.append([s[1], s[0]])
+        self.__heads = heads
+        self.__headLength = 8 + headSize
+        self.__dtype = np.dtype([('c{}'.format(i), HBTFile.DataTypes[heads[i][1]]) for i in range(0, len(heads))])
+        self.__rows = None
@@ -2,48 +2,95 @@ __author__ = 'Hwaipy'
 
 from Instruments import DeviceException, VISAInstrument
 import enum
+import threading
+import time
+import numpy as np
 
 
 class KeySight_MultiMeter_34465A(VISAInstrument):
     manufacturer = 'Keysight Technologies'
     model = '34465A'
+    cachedQueries = VISAInstrument.cachedQueries + ('getVersion', 'getRange', 'getAperture')
+    stateSetters = {'setMeasureQuantity': 0}
 
     def __init__(self, resourceID):
         super().__init__(resourceID)
+        # Readings are fetched as big endian float64 blocks.
+        self.scpi.FORM.DATA.write('REAL', 64)
+        self.stream = None
+        # Unknown until setMeasureQuantity, so assumed on.
+        self.autoRange = True
 
     def setMeasureQuantity(self, mq, range=0, autoRange=True, aperture=0.001):
-        if mq is MeasureQuantity.VoltageDC:
-            self.scpi.CONF.VOLT.DC.write('AUTO' if autoRange else range)
-            self.scpi.VOLT.APER.write(aperture)
-        elif mq is MeasureQuantity.CurrentDC:
-            self.scpi.CONF.CURR.DC.write('AUTO' if autoRange else range)
-            self.scpi.CURR.APER.write(aperture)
-        elif mq is MeasureQuantity.Resistance:
-            self.scpi.CONF.RES.write('AUTO' if autoRange else range)
-            self.scpi.RES.APER.write(aperture)
-        else:
-            raise DeviceException('MeasureQuantity {} can not be recognized.'.format(mq))
+        # Unknown if the writes fail partway.
+        self.autoRange = True
+        with self.scpi.batch():
+            if mq is MeasureQuantity.VoltageDC:
+                self.scpi.CONF.VOLT.DC.write('AUTO' if autoRange else range)
+                self.scpi.VOLT.APER.write(aperture)
+            elif mq is MeasureQuantity.CurrentDC:
+                self.scpi.CONF.CURR.DC.write('AUTO' if autoRange else range)
+                self.scpi.CURR.APER.write(aperture)
+            elif mq is MeasureQuantity.Resistance:
+                self.scpi.CONF.RES.write('AUTO' if autoRange else range)
+                self.scpi.RES.APER.write(aperture)
+            else:
+                raise DeviceException('MeasureQuantity {} can not be recognized.'.format(mq))
+        self.autoRange = autoRange
+
+    # Under autorange, the range follows the readings, so that getRange is only cached for a fixed range.
+    def isCachedQuery(self, name):
+        if name == 'getRange' and self.autoRange:
+            return False
+        return super().isCachedQuery(name)
+
+    def getRange(self):
+        return float(self.__sense().RANG.query())
+
+    def getAperture(self):
+        return float(self.__sense().APER.query())
+
+    # The SCPI node (VOLT, CURR or RES) of the configured function.
+    def __sense(self):
+        return getattr(self.scpi, self.scpi.FUNC.query().strip('"').split(':')[0])
 
     def directMeasure(self, count=1):
-        self.scpi.TRIG.SOURCE.write('BUS')
-        self.scpi.SAMP.COUN.write(count)
-        self.scpi.INIT.write()
-        self.scpi._TRG.write()
-        values = self.scpi.FETC.query()
-        return [float(v) for v in values.split(',')]
+        self.__checkNotStreaming()
+        with self.scpi.batch():
+            self.scpi.TRIG.SOURCE.write('BUS')
+            self.scpi.SAMP.COUN.write(count)
+            self.scpi.INIT.write()
+            self.scpi._TRG.write()
+        return self.scpi.FETC.queryBinary('>f8').tolist()
 
     def directMeasureAndFetchLater(self, count=1):
-        self.scpi.TRIG.SOURCE.write('BUS')
-        self.scpi.SAMP.COUN.write(count)
-        self.scpi.INIT.write()
-        self.scpi._TRG.write()
+        self.__checkNotStreaming()
+        with self.scpi.batch():
+            self.scpi.TRIG.SOURCE.write('BUS')
+            self.scpi.SAMP.COUN.write(count)
+            self.scpi.INIT.write()
+            self.scpi._TRG.write()
 
         def fetch():
-            values = self.scpi.FETC.query()
-            return [float(v) for v in values.split(',')]
+            return self.scpi.FETC.queryBinary('>f8').tolist()
 
         return fetch
 
+    # Starts a continuous acquisition with a reading every interval s, see ReadingStream.
+    def startStream(self, interval=0.001, bufferSize=1000000, pollInterval=0.05):
+        self.__checkNotStreaming()
+        self.stream = ReadingStream(self, interval, bufferSize, pollInterval)
+        self.stream.start()
+        return self.stream
+
+    def stopStream(self):
+        if self.stream is not None:
+            self.stream.stop()
+
+    def __checkNotStreaming(self):
+        if self.stream is not None and self.stream.isRunning():
+            raise DeviceException('The MultiMeter is streaming.')
+
 
 class KeySight_MultiMeter_34470A(KeySight_MultiMeter_34465A):
     manufacturer = 'Keysight Technologies'
@@ -53,6 +100,162 @@ class KeySight_MultiMeter_34470A(KeySight_MultiMeter_34465A):
         super().__init__(resourceID)
 
 
+# Continuous acquisition into the reading memory of the meter, which is emptied by a background thread with R? every
+# pollInterval s. Readings are timed by the sample timer and timestamped from the host time at INIT, and the last
+# bufferSize of them are kept in a ring buffer for the subscriptions. An overflow of the reading memory (the reader
+# is too slow) is counted as an overrun, and the timestamps are realigned to the host time after it.
+class ReadingStream:
+    QuestionableMemoryOverflow = 1 << 14
+    SampleCount = 1000000
+    MaxChunk = 50000
+
+    def __init__(self, dev, interval, bufferSize, pollInterval):
+        self.dev = dev
+        self.interval = interval
+        self.bufferSize = bufferSize
+        self.pollInterval = pollInterval
+        self.__timestamps = np.zeros(bufferSize)
+        self.__values = np.zeros(bufferSize)
+        self.__count = 0
+        self.__index = 0
+        self.__start = 0
+        self.__running = False
+        self.__stopping = False
+        self.__thread = None
+        self.__error = None
+        self.__condition = threading.Condition()
+        self.__statistics = {'Readings': 0, 'Overruns': 0, 'LostReadings': 0, 'Polls': 0}
+
+    def start(self):
+        scpi = self.dev.scpi
+        with scpi.batch():
+            scpi.ABOR.write()
+            scpi.TRIG.SOUR.write('IMM')
+            scpi.TRIG.COUN.write('INF')
+            scpi.SAMP.SOUR.write('TIM')
+            scpi.SAMP.TIM.write(self.interval)
+            scpi.SAMP.COUN.write(ReadingStream.SampleCount)
+        scpi.STAT.QUES.query()
+        scpi.INIT.write()
+        scpi.DATA.POIN.query()
+        self.__start = time.time()
+        self.__running = True
+        self.__stopping = False
+        self.__thread = threading.Thread(target=self.__loop, name='ReadingStream-{}'.format(self.dev.resourceID),
+                                         daemon=True)
+        self.__thread.start()
+
+    # The acquisition is aborted, and the readings left in the reading memory are read before the stream ends. The
+    # triggering is then restored for directMeasure.
+    def stop(self):
+        if self.__thread is None or self.__stopping:
+            return
+        self.__stopping = True
+        self.__thread.join()
+        scpi = self.dev.scpi
+        try:
+            scpi.ABOR.write()
+            if self.__error is None:
+                self.__poll()
+            with scpi.batch():
+                scpi.TRIG.COUN.write(1)
+                scpi.SAMP.SOUR.write('IMM')
+        except BaseException as e:
+            self.__error = e
+        with self.__condition:
+            self.__running = False
+            self.__condition.notify_all()
+
+    def isRunning(self):
+        return self.__running
+
+    def statistics(self):
+        with self.__condition:
+            return dict(self.__statistics)
+
+    # Readings of the stream from now on, or from the oldest reading in the buffer if fromStart.
+    def subscribe(self, fromStart=False):
+        with self.__condition:
+            return ReadingSubscription(self, max(0, self.__count - self.bufferSize) if fromStart else self.__count)
+
+    def __loop(self):
+        try:
+            while not self.__stopping:
+                time.sleep(self.pollInterval)
+                if not self.__stopping:
+                    self.__poll()
+        except BaseException as e:
+            self.__error = e
+            with self.__condition:
+                self.__running = False
+                self.__condition.notify_all()
+
+    def __poll(self):
+        values = self.dev.scpi.R.queryBinary('>f8', ReadingStream.MaxChunk)
+        overflow = int(float(self.dev.scpi.STAT.QUES.query())) & ReadingStream.QuestionableMemoryOverflow
+        count = len(values)
+        if overflow:
+            index = max(self.__index, int((time.time() - self.__start) / self.interval) - count + 1)
+            lost = index - self.__index
+            self.__index = index
+        timestamps = self.__start + (self.__index + np.arange(count)) * self.interval
+        self.__index += count
+        with self.__condition:
+            self.__statistics['Polls'] += 1
+            self.__statistics['Readings'] += count
+            if overflow:
+                self.__statistics['Overruns'] += 1
+                self.__statistics['LostReadings'] += lost
+            if count > self.bufferSize:
+                timestamps, values = timestamps[-self.bufferSize:], values[-self.bufferSize:]
+                self.__count += count - self.bufferSize
+            positions = (self.__count + np.arange(len(values))) % self.bufferSize
+            self.__timestamps[positions] = timestamps
+            self.__values[positions] = values
+            self.__count += len(values)
+            self.__condition.notify_all()
+
+    # Returns (next index, readings lost from the buffer, timestamps, values) of the readings from index, waiting up
+    # to timeout s for one if there is none.
+    def read(self, index, maxCount=None, timeout=None):
+        with self.__condition:
+            self.__condition.wait_for(lambda: self.__count > index or not self.__running, timeout)
+            if self.__error is not None:
+                raise DeviceException('Error in ReadingStream.', self.__error)
+            oldest = max(0, self.__count - self.bufferSize)
+            lost = max(0, oldest - index)
+            index = max(index, oldest)
+            count = self.__count - index if maxCount is None else min(maxCount, self.__count - index)
+            positions = (index + np.arange(count)) % self.bufferSize
+            return index + count, lost, self.__timestamps[positions], self.__values[positions]
+
+
+# Iterates the (timestamp, value) of the readings until the stream stops. Readings overwritten in the ring buffer
+# before they are read are counted in lost.
+class ReadingSubscription:
+    def __init__(self, stream, index):
+        self.stream = stream
+        self.index = index
+        self.lost = 0
+
+    def read(self, maxCount=None, timeout=None):
+        self.index, lost, timestamps, values = self.stream.read(self.index, maxCount, timeout)
+        self.lost += lost
+        return timestamps, values
+
+    # The index advances with each reading yielded, so that the iteration can be left and resumed without a gap.
+    def __iter__(self):
+        while True:
+            index, lost, timestamps, values = self.stream.read(self.index)
+            if len(values) == 0:
+                return
+            self.lost += lost
+            self.index = index - len(values)
+            for timestamp, value in zip(timestamps.tolist(), values.tolist()):
+                self.index += 1
+                yield timestamp, value
+
+
 class MeasureQuantity(enum.Enum):
     VoltageDC = 1
     CurrentDC = 2
@@ -75,11 +278,39 @@ class MultiMeterServiceWrap:
     def directMeasure(self, count=1):
         return self.dev.directMeasure(count)
 
+    def getRange(self):
+        return self.dev.getRange()
+
+    def getAperture(self):
+        return self.dev.getAperture()
+
+    # The readings of the stream are read by readStream as [timestamps, values, readings lost since the last read].
+    def startStream(self, interval=0.001):
+        self.subscription = self.dev.startStream(interval).subscribe()
+
+    def readStream(self, timeout=1):
+        lost = self.subscription.lost
+        timestamps, values = self.subscription.read(timeout=timeout)
+        return [timestamps.tolist(), values.tolist(), self.subscription.lost - lost]
+
+    def stopStream(self):
+        self.dev.stopStream()
+
+    # Identity read when the meter was opened, without a query.
+    def getIdentity(self):
+        return self.dev.getIdentity()
+
+    def getSerialNumber(self):
+        return self.dev.getSerialNumber()
+
+    def getModel(self):
+        return self.dev.getModel()
+
 
 if __name__ == '__main__':
     import argparse
     import sys
-    import Pydra
+    from Instruments import InstrumentsServer
 
     parser = argparse.ArgumentParser()
     parser.add_argument('--model', '-m', help="Model of MultiMeter, should be 34465A or 34470A", type=str)
@@ -98,16 +329,17 @@ if __name__ == '__main__':
     name = args.service_name
 
     if model == '34470A':
-        dev = KeySight_MultiMeter_34470A(visaResource)
+        instrumentClass = KeySight_MultiMeter_34470A
     elif model == '34465A':
-        dev = KeySight_MultiMeter_34465A(visaResource)
+        instrumentClass = KeySight_MultiMeter_34465A
     else:
         raise RuntimeError(f'Model {model} not valid.')
 
-    session = Pydra.Session.newSession((hydraAddress, hydraPort), MultiMeterServiceWrap(dev), name)
+    server = InstrumentsServer((hydraAddress, hydraPort))
+    server.open(instrumentClass, visaResource)
+    server.serve(visaResource, name, MultiMeterServiceWrap)
     print(f'KeySight MultiMeter started as MultiMeter Service [{name}]')
     for line in sys.stdin:
         if line == 'q\n':
             break
-    session.stop()
-    dev.close()
+    server.close()
@@ -2,7 +2,6 @@ __author__ = 'Hwaipy'
 __version__ = 'v1.0.20180618'
 
 from Instruments import DeviceException, Instrument
-import visa
 from SCPI import SCPI
 from Instruments import DeviceException, VISAInstrument
 from Utils import SingleThreadProcessor
@@ -54,8 +53,9 @@ class IT6322(VISAInstrument):
         self.__checkChannel(channel)
         voltage = self.__trimVoltage(channel, voltage)
         self.voltageSetpoints[channel] = voltage
-        self.scpi.INST.NSEL.write(channel + 1)
-        self.scpi.VOLT.write('{}V'.format(voltage))
+        with self.scpi.batch():
+            self.scpi.INST.NSEL.write(channel + 1)
+            self.scpi.VOLT.write('{}V'.format(voltage))
 
     def setVoltages(self, voltages):
         if len(voltages) is not self.channelCount:
@@ -81,8 +81,9 @@ class IT6322(VISAInstrument):
         self.__checkChannel(channel)
         current = self.__trimCurrent(channel, current)
         self.currentLimitSetpoints[channel] = current
-        self.scpi.INST.NSEL.write(channel + 1)
-        self.scpi.CURR.write('{}A'.format(current))
+        with self.scpi.batch():
+            self.scpi.INST.NSEL.write(channel + 1)
+            self.scpi.CURR.write('{}A'.format(current))
 
     def setCurrents(self, currents):
         if len(currents) is not self.channelCount:
@@ -99,8 +100,9 @@ class IT6322(VISAInstrument):
 
     def setOutputStatus(self, channel, status):
         self.__checkChannel(channel)
-        self.scpi.INST.NSEL.write(channel + 1)
-        self.scpi.OUTP.write(1 if status else 0)
+        with self.scpi.batch():
+            self.scpi.INST.NSEL.write(channel + 1)
+            self.scpi.OUTP.write(1 if status else 0)
 
     def setOutputStatuses(self, outputStatuses):
         if len(outputStatuses) != self.getChannelNumber():
@@ -138,7 +140,7 @@ class IT6322(VISAInstrument):
 
     def beeper(self):
         self.scpi.SYSTem.BEEPer.write()
-        self.getIdentity()
+        self.refreshIdentity()
 
 
 if __name__ == '__main_213123':
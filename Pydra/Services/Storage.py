@@ -1,20 +1,68 @@
 __author__ = 'Hwaipy'
 
+import struct
+import threading
+import time
+import msgpack
+
 
 class StorageService:
-    def __init__(self, session):
+    # Results of listElements and walk are cached for listingCacheTTL seconds (0 disables the cache). Any
+    # modification made through this StorageService clears the cache, and a listing fetched across such a
+    # modification is not cached. Callers get their own copies of the metadata dicts.
+    def __init__(self, session, listingCacheTTL=0, pageSize=1000):
         self.session = session
         self.blockingInvoker = self.session.blockingInvoker(u'StorageService')
+        self.listingCacheTTL = listingCacheTTL
+        self.pageSize = pageSize
+        self.__listingCache = {}
+        self.__listingCacheGeneration = 0
+        self.__listingCacheLock = threading.Lock()
 
     def getElement(self, path):
         return StorageElement(self, path)
 
     def listElements(self, path, withMetaData=False):
-        return self.blockingInvoker.listElements(u"", path, withMetaData)
+        key = (u'listElements', path, withMetaData)
+        cached = self.__getCachedListing(key)
+        if cached is not None:
+            return [dict(e) for e in cached] if withMetaData else list(cached)
+        generation = self.__listingCacheGeneration
+        elements = self.blockingInvoker.listElements(u"", path, withMetaData)
+        self.__putCachedListing(key, elements, generation)
+        return [dict(e) for e in elements] if withMetaData else list(elements)
+
+    def walk(self, path, depth=-1, withMetaData=False):
+        key = (u'walk', path, depth, withMetaData)
+        cached = self.__getCachedListing(key)
+        if cached is not None:
+            yield from ([dict(e) for e in cached] if withMetaData else cached)
+            return
+        generation = self.__listingCacheGeneration
+        elements = []
+        hasMore = True
+        after = u""
+        while hasMore:
+            page = self.blockingInvoker.walk(u"", path, depth, withMetaData, after, self.pageSize)
+            hasMore = page[u'HasMore']
+            after = page[u'Next']
+            for element in page[u'Elements']:
+                elements.append(element)
+                yield dict(element) if withMetaData else element
+        self.__putCachedListing(key, elements, generation)
 
     def metaData(self, path, withTime=False):
         return self.blockingInvoker.metaData(u"", path, withTime)
 
+    def metaDataMany(self, paths, withTime=False):
+        metaData = []
+        for i in range(0, len(paths), self.pageSize):
+            metaData += self.blockingInvoker.metaDataMany(u"", paths[i:i + self.pageSize], withTime)
+        return metaData
+
+    def waitForUpdate(self, path, knownSize, timeout=10):
+        return self.blockingInvoker.waitForUpdate(u"", path, knownSize, int(timeout * 1000))
+
     def read(self, path, start, length):
         return self.blockingInvoker.read(u"", path, start, length)
 
@@ -28,36 +76,48 @@ class StorageService:
         return str(self.readAll(path), encoding="UTF-8")
 
     def append(self, path, data):
+        self.invalidateCache()
         return self.blockingInvoker.append(u"", path, data)
 
     def write(self, path, data, start):
+        self.invalidateCache()
         return self.blockingInvoker.write(u"", path, data, start)
 
     def clear(self, path):
+        self.invalidateCache()
         return self.blockingInvoker.clear(u"", path)
 
     def delete(self, path):
+        self.invalidateCache()
         return self.blockingInvoker.delete(u"", path)
 
     def readNote(self, path):
         return self.blockingInvoker.readNote(u"", path).get(u"Note")
 
     def writeNote(self, path, data):
+        self.invalidateCache()
         return self.blockingInvoker.writeNote(u"", path, data)
 
     def createFile(self, path):
+        self.invalidateCache()
         return self.blockingInvoker.createFile(u"", path)
 
     def createDirectory(self, path):
+        self.invalidateCache()
         return self.blockingInvoker.createDirectory(u"", path)
 
     def exists(self, path):
         return self.blockingInvoker.exists(u"", path)
 
+    def existsMany(self, paths):
+        return [m[u'Type'] in [u'Collection', u'Content'] for m in self.metaDataMany(paths)]
+
     def HBTFileInitialize(self, path, heads):
+        self.invalidateCache()
         return self.blockingInvoker.HBTFileInitialize(u"", path, heads)
 
     def HBTFileAppendRows(self, path, rows):
+        self.invalidateCache()
         return self.blockingInvoker.HBTFileAppendRows(u"", path, rows)
 
     def HBTFileReadRows(self, path, start, count):
@@ -69,6 +129,46 @@ class StorageService:
     def HBTFileMetaData(self, path):
         return self.blockingInvoker.HBTFileMetaData(u"", path)
 
+    def FSFileInitialize(self, path):
+        self.invalidateCache()
+        return self.blockingInvoker.FSFileInitialize(u"", path)
+
+    def FSFileAppendFrames(self, path, frames):
+        self.invalidateCache()
+        return self.blockingInvoker.FSFileAppendFrames(u"", path, frames)
+
+    def FSFileReadHeadFrames(self, path, start, count):
+        return self.blockingInvoker.FSFileReadHeadFrames(u"", path, start, count)
+
+    def FSFileReadTailFrames(self, path, start, count):
+        return self.blockingInvoker.FSFileReadTailFrames(u"", path, start, count)
+
+    def FSFileReadAllFrames(self, path):
+        return self.blockingInvoker.FSFileReadAllFrames(u"", path)
+
+    def invalidateCache(self):
+        with self.__listingCacheLock:
+            self.__listingCache.clear()
+            self.__listingCacheGeneration += 1
+
+    def __getCachedListing(self, key):
+        if self.listingCacheTTL <= 0:
+            return None
+        with self.__listingCacheLock:
+            if self.__listingCache.__contains__(key):
+                (cacheTime, elements) = self.__listingCache[key]
+                if time.time() - cacheTime <= self.listingCacheTTL:
+                    return elements
+                self.__listingCache.__delitem__(key)
+        return None
+
+    # Skipped if the cache is invalidated since generation, when the fetch of elements began.
+    def __putCachedListing(self, key, elements, generation):
+        if self.listingCacheTTL > 0:
+            with self.__listingCacheLock:
+                if self.__listingCacheGeneration == generation:
+                    self.__listingCache[key] = (time.time(), elements)
+
 
 class StorageElement:
     def __init__(self, storageService, path):
@@ -85,6 +185,9 @@ class StorageElement:
     def listElements(self, withMetaData=False):
         return self.storageService.listElements(self.path, withMetaData)
 
+    def walk(self, depth=-1, withMetaData=False):
+        return self.storageService.walk(self.path, depth, withMetaData)
+
     def metaData(self, withTime=False):
         return self.storageService.metaData(self.path, withTime)
 
@@ -103,6 +206,34 @@ class StorageElement:
     def append(self, data):
         return self.storageService.append(self.path, data)
 
+    def waitForUpdate(self, knownSize, timeout=10):
+        return self.storageService.waitForUpdate(self.path, knownSize, timeout)
+
+    # Yield data appended to this element from position start (current end of file by default). The server is
+    # long-polled with waitForUpdate, so new data arrives as soon as it is appended. Stops when nothing is
+    # appended within timeout seconds (never if timeout is None), or when the element is deleted. Restarts from 0 if the
+    # element is cleared.
+    def follow(self, start=None, timeout=None, pollTimeout=10):
+        position = self.metaData()[u'Size'] if start is None else start
+        lastUpdate = time.time()
+        while True:
+            waitTime = pollTimeout
+            if timeout is not None:
+                waitTime = min(waitTime, timeout - (time.time() - lastUpdate))
+                if waitTime <= 0:
+                    return
+            metaData = self.waitForUpdate(position, waitTime)
+            if metaData[u'Type'] != u'Content':
+                return
+            size = metaData[u'Size']
+            if size < position:
+                position = 0
+            if size > position:
+                data = self.read(position, size - position)
+                position = size
+                lastUpdate = time.time()
+                yield data
+
     def write(self, data, start):
         return self.storageService.write(self.path, data, start)
 
@@ -130,6 +261,9 @@ class StorageElement:
     def toHBTFileElement(self):
         return HBTFileElement(self)
 
+    def toFSFileElement(self):
+        return FSFileElement(self)
+
 
 class HBTFileElement:
     BYTE = 'Byte'
@@ -139,14 +273,32 @@ class HBTFileElement:
     FLOAT = 'Float'
     DOUBLE = 'Double'
 
-    def __init__(self, storageElement):
+    # Heads of a HBT file never change after initialize, so they are cached permanently. RowCount is tracked
+    # locally on append and refreshed from the server at most once per metaDataTTL seconds, to catch rows
+    # appended by other clients. readRow is served from a window of prefetchRows rows fetched in one request.
+    def __init__(self, storageElement, metaDataTTL=5.0, prefetchRows=100):
         self.storageElement = storageElement
+        self.metaDataTTL = metaDataTTL
+        self.prefetchRows = prefetchRows
+        self.__heads = None
+        self.__rowCount = None
+        self.__metaDataTime = 0
+        self.__windowStart = 0
+        self.__windowRows = []
 
     def initialize(self, heads):
-        return self.storageElement.storageService.HBTFileInitialize(self.storageElement.path, heads)
+        result = self.storageElement.storageService.HBTFileInitialize(self.storageElement.path, heads)
+        self.__heads = [[h[0], h[1]] for h in heads]
+        self.__rowCount = 0
+        self.__metaDataTime = time.time()
+        self.__windowRows = []
+        return result
 
     def appendRows(self, rows):
-        return self.storageElement.storageService.HBTFileAppendRows(self.storageElement.path, rows)
+        result = self.storageElement.storageService.HBTFileAppendRows(self.storageElement.path, rows)
+        if self.__rowCount is not None:
+            self.__rowCount += len(rows)
+        return result
 
     def appendRow(self, row):
         return self.appendRows([row])
@@ -155,22 +307,177 @@ class HBTFileElement:
         return self.storageElement.storageService.HBTFileReadRows(self.storageElement.path, start, count)
 
     def readRow(self, rowNum):
-        return self.readRows(rowNum, 1)[0]
+        offset = rowNum - self.__windowStart
+        if 0 <= offset < len(self.__windowRows):
+            return self.__windowRows[offset]
+        rowCount = self.getRowCount()
+        if rowNum >= rowCount:
+            rowCount = self.__cachedMetaData(True)['RowCount']
+        count = min(max(self.prefetchRows, 1), rowCount - rowNum)
+        if rowNum < 0 or count <= 0:
+            return self.readRows(rowNum, 1)[0]
+        self.__windowRows = self.readRows(rowNum, count)
+        self.__windowStart = rowNum
+        return self.__windowRows[0]
 
     def readAllRows(self):
         return self.storageElement.storageService.HBTFileReadAllRows(self.storageElement.path)
 
     def readMetaData(self):
-        return self.storageElement.storageService.HBTFileMetaData(self.storageElement.path)
+        metaData = self.storageElement.storageService.HBTFileMetaData(self.storageElement.path)
+        self.__heads = metaData['Heads']
+        self.__rowCount = metaData['RowCount']
+        self.__metaDataTime = time.time()
+        return metaData
+
+    def invalidate(self):
+        self.__rowCount = None
+        self.__windowRows = []
+
+    def __cachedMetaData(self, forceRefresh=False):
+        if forceRefresh or self.__heads is None or self.__rowCount is None or (
+                time.time() - self.__metaDataTime > self.metaDataTTL):
+            self.readMetaData()
+        return {'ColumnCount': len(self.__heads), 'RowCount': self.__rowCount, 'Heads': self.__heads}
 
     def getColumnCount(self):
-        return self.readMetaData()['ColumnCount']
+        return self.__cachedMetaData()['ColumnCount']
 
     def getRowCount(self):
-        return self.readMetaData()['RowCount']
+        return self.__cachedMetaData()['RowCount']
 
     def getHeads(self):
-        return self.readMetaData()['Heads']
+        return self.__cachedMetaData()['Heads']
 
     def getHeadNames(self):
-        return [h[0] for h in self.readMetaData()['Heads']]
+        return [h[0] for h in self.getHeads()]
+
+
+class FSFileElement:
+    # A frame in FS file is [Int32 index, Int32 size, data, Int32 index, Int32 size], big-endian.
+    # Offsets of frames are indexed on the client, so reading any frame range costs a single read request. The index
+    # is rebuilt if the file shrinks (e.g. cleared, or deleted and recreated). Call invalidate() if the file may have
+    # been rewritten otherwise.
+    def __init__(self, storageElement, indexBlockSize=1000000, pageSize=100):
+        self.storageElement = storageElement
+        self.indexBlockSize = indexBlockSize
+        self.pageSize = pageSize
+        self.__offsets = [0]
+        self.__indexLock = threading.Lock()
+
+    def initialize(self):
+        return self.storageElement.storageService.FSFileInitialize(self.storageElement.path)
+
+    def appendFrames(self, frames):
+        return self.storageElement.storageService.FSFileAppendFrames(self.storageElement.path, frames)
+
+    def appendFrame(self, frame):
+        return self.appendFrames([frame])
+
+    def size(self):
+        return self.storageElement.metaData()[u'Size']
+
+    def frameCount(self):
+        size = self.size()
+        if size < 16:
+            return 0
+        (index, frameSize) = struct.unpack('>ii', self.storageElement.read(size - 8, 8))
+        return index + 1
+
+    def invalidate(self):
+        with self.__indexLock:
+            self.__offsets = [0]
+
+    def readFrames(self, start, count):
+        if start < 0 or count <= 0:
+            return []
+        with self.__indexLock:
+            size = self.size()
+            if size < self.__offsets[-1]:
+                self.__offsets = [0]
+            if len(self.__offsets) <= start + count:
+                self.__extendIndex(start + count, size)
+            end = min(start + count, len(self.__offsets) - 1)
+            if end <= start:
+                return []
+            offsets = self.__offsets[start:end + 1]
+        data = self.storageElement.read(offsets[0], offsets[-1] - offsets[0])
+        return [data[o - offsets[0] + 8:offsets[i + 1] - offsets[0] - 8] for i, o in enumerate(offsets[:-1])]
+
+    def readFrame(self, index):
+        frames = self.readFrames(index, 1)
+        if len(frames) == 0:
+            raise IndexError('Frame {} not exists.'.format(index))
+        return frames[0]
+
+    def readHeadFrames(self, start, count):
+        return self.readFrames(start, count)
+
+    def readTailFrames(self, start, count):
+        return self.storageElement.storageService.FSFileReadTailFrames(self.storageElement.path, start, count)
+
+    def readAllFrames(self):
+        return self.storageElement.storageService.FSFileReadAllFrames(self.storageElement.path)
+
+    def messages(self, start=0):
+        while True:
+            frames = self.readFrames(start, self.pageSize)
+            for frame in frames:
+                yield FSFrameDecoder.unpack(frame)
+            if len(frames) < self.pageSize:
+                return
+            start += len(frames)
+
+    def followFrames(self, timeout=None, pollTimeout=10):
+        decoder = FSFrameDecoder()
+        for data in self.storageElement.follow(None, timeout, pollTimeout):
+            decoder.feed(data)
+            for frame in decoder:
+                yield frame
+
+    def followMessages(self, timeout=None, pollTimeout=10):
+        for frame in self.followFrames(timeout, pollTimeout):
+            yield FSFrameDecoder.unpack(frame)
+
+    def __extendIndex(self, frameCount, size):
+        while len(self.__offsets) <= frameCount:
+            blockStart = self.__offsets[-1]
+            if blockStart + 16 > size:
+                return
+            block = self.storageElement.read(blockStart, min(self.indexBlockSize, size - blockStart))
+            position = blockStart
+            while len(self.__offsets) <= frameCount and position + 8 <= blockStart + len(block):
+                frameSize = struct.unpack('>i', block[position - blockStart + 4:position - blockStart + 8])[0]
+                # Frames are appended whole, so a frame that does not fit in the file is corrupt.
+                if frameSize < 0 or position + frameSize + 16 > size:
+                    raise IOError('Invalid frame size {} at {} of FS file {}.'.format(
+                        frameSize, position, self.storageElement.path))
+                position += frameSize + 16
+                self.__offsets.append(position)
+
+
+class FSFrameDecoder:
+    # Incremental decoder of FS frames from a byte stream (e.g. StorageElement.follow). feed() any chunk of bytes,
+    # then iterate to get the frames completed so far.
+    def __init__(self):
+        self.__buffer = bytearray()
+
+    def feed(self, data):
+        self.__buffer += data
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if len(self.__buffer) < 8:
+            raise StopIteration
+        frameSize = struct.unpack('>i', self.__buffer[4:8])[0]
+        if len(self.__buffer) < frameSize + 16:
+            raise StopIteration
+        frame = bytes(self.__buffer[8:8 + frameSize])
+        del self.__buffer[:frameSize + 16]
+        return frame
+
+    @classmethod
+    def unpack(cls, frame):
+        return msgpack.unpackb(frame, raw=False)
@@ -0,0 +1,307 @@
+__author__ = 'Hwaipy'
+
+import re
+import time
+from collections import OrderedDict
+import numpy as np
+
+
+# Software AWG70002A that stands in for the pyvisa resource (instr_handle) of TekAWG70kService.Instrument.
+# It implements the WLISt, SLISt, SOURce, OUTPut, AWGControl, CLOCk and common commands used there, including
+# ';' joined commands and the binary block transfers of waveform and marker data. Every call is one transfer, which
+# costs latency + bytes / bytesPerSecond; the cost is accumulated in simulatedTime, and slept if realTime is True.
+# Invalid commands raise RuntimeError, where the instrument would put an error into its queue.
+class SimulatedAWG70002:
+    Identity = 'TEKTRONIX,AWG70002A,SIMULATED,FV:7.1.0170.0'
+    MaxSequenceSteps = 16383
+
+    def __init__(self, latency=2e-3, bytesPerSecond=8e6, realTime=False):
+        self.latency = latency
+        self.bytesPerSecond = bytesPerSecond
+        self.realTime = realTime
+        self.timeout = 30000
+        self.waveforms = OrderedDict()
+        self.sequences = OrderedDict()
+        self.outputs = {1: False, 2: False}
+        self.assignments = {1: None, 2: None}
+        self.clockSource = 'INT'
+        self.clockRate = 25e9
+        self.running = False
+        self.transfers = 0
+        self.commandCount = 0
+        self.bytesTransferred = 0
+        self.simulatedTime = 0.0
+        self.__lastResponse = ''
+        self.__handlers = [(SimulatedAWG70002.__parsePattern(pattern), handler) for pattern, handler in [
+            ('*IDN?', lambda args, n: SimulatedAWG70002.Identity),
+            ('*OPC?', lambda args, n: '1'),
+            ('*RST', lambda args, n: self.reset()),
+            ('SYSTem:VERSion?', lambda args, n: '1.1'),
+            ('WLISt:SIZE?', lambda args, n: str(len(self.waveforms))),
+            ('WLISt:NAME?', lambda args, n: '"{}"'.format(self.__byIndex(self.waveforms, args[0]))),
+            ('WLISt:WAVeform:NEW', self.__newWaveform),
+            ('WLISt:WAVeform:DELete', lambda args, n: self.__delete(self.waveforms, args[0])),
+            ('WLISt:WAVeform:LENGth?', lambda args, n: str(len(self.__waveform(args[0])['Data']))),
+            ('WLISt:WAVeform:TYPE?', lambda args, n: self.__waveform(args[0]) and 'REAL'),
+            ('SLISt:SIZE?', lambda args, n: str(len(self.sequences))),
+            ('SLISt:NAME?', lambda args, n: '"{}"'.format(self.__byIndex(self.sequences, args[0]))),
+            ('SLISt:SEQuence:NEW', self.__newSequence),
+            ('SLISt:SEQuence:DELete', lambda args, n: self.__delete(self.sequences, args[0])),
+            ('SLISt:SEQuence:LENGth?', lambda args, n: str(self.__sequence(args[0])['Steps'])),
+            ('SLISt:SEQuence:STEP:MAX?', lambda args, n: str(SimulatedAWG70002.MaxSequenceSteps)),
+            ('SLISt:SEQuence:STEP#:WINPut', lambda args, n: self.__setStep(args, n[0], 'WaitMode')),
+            ('SLISt:SEQuence:STEP#:EJINput', lambda args, n: self.__setStep(args, n[0], 'JumpMode')),
+            ('SLISt:SEQuence:STEP#:EJUMp', lambda args, n: self.__setStep(args, n[0], 'JumpTarget')),
+            ('SLISt:SEQuence:STEP#:GOTO', lambda args, n: self.__setStep(args, n[0], 'Goto')),
+            ('SLISt:SEQuence:STEP#:RCOunt', lambda args, n: self.__setStep(args, n[0], 'Repeat')),
+            ('SLISt:SEQuence:STEP#:TASSet#:WAVeform', self.__setStepWaveform),
+            ('SOURce#:WAVeform', self.__assignWaveform),
+            ('SOURce#:CASSet:SEQuence', self.__assignSequence),
+            ('SOURce#:SCSTep?', lambda args, n: '1' if self.running else 'END'),
+            ('OUTPut#:STATe', lambda args, n: self.outputs.__setitem__(self.__channel(n[0]), args[0] in ['1', 'ON'])),
+            ('AWGControl:RUN:IMMediate', lambda args, n: setattr(self, 'running', True)),
+            ('AWGControl:STOP:IMMediate', lambda args, n: setattr(self, 'running', False)),
+            ('AWGControl:RSTate?', lambda args, n: '2' if self.running else '0'),
+            ('CLOCk:SOURce', lambda args, n: setattr(self, 'clockSource', args[0])),
+            ('CLOCk:SRATe', lambda args, n: setattr(self, 'clockRate', float(args[0]))),
+            ('CLOCk:SRATe?', lambda args, n: '{:E}'.format(self.clockRate)),
+        ]]
+
+    def reset(self):
+        self.waveforms.clear()
+        self.sequences.clear()
+        self.outputs = {1: False, 2: False}
+        self.assignments = {1: None, 2: None}
+        self.running = False
+
+    # pyvisa resource methods.
+    def write(self, message):
+        self.__transfer(len(message) + 1)
+        for command in self.__splitCommands(message):
+            self.__execute(command, False)
+
+    def query(self, message):
+        commands = self.__splitCommands(message)
+        responses = [self.__execute(command, False) for command in commands]
+        response = ';'.join([r for r in responses if r is not None]) + '\n'
+        self.__transfer(len(message) + 1 + len(response))
+        self.__lastResponse = response
+        return response
+
+    def query_ascii_values(self, message, converter='f', separator=',', container=list):
+        values = [float(v) for v in self.query(message).strip().split(separator)]
+        return container(values)
+
+    def query_binary_values(self, message, datatype='f', is_big_endian=False, container=list):
+        header, args = self.__parseCommand(message)
+        if not header.upper().endswith('DATA?'):
+            raise RuntimeError('Simulated AWG70002: binary query not supported: {}'.format(message))
+        name, start, size = args[0], int(args[1]) if len(args) > 1 else 0, int(args[2]) if len(args) > 2 else None
+        data = self.__waveform(name)['Data']
+        data = data[start:] if size is None else data[start:start + size]
+        self.__transfer(len(message) + 1 + data.nbytes)
+        self.commandCount += 1
+        values = data.astype(('>' if is_big_endian else '<') + datatype)
+        return values if container is np.ndarray else container(values.tolist())
+
+    def write_binary_values(self, message, values, datatype='f', is_big_endian=False):
+        values = np.asarray(values, dtype=('>' if is_big_endian else '<') + datatype)
+        self.__transfer(len(message) + values.nbytes + 2 + len(str(values.nbytes)) + 1)
+        self.commandCount += 1
+        header, args = self.__parseCommand(message.rstrip(','))
+        if self.__matches(SimulatedAWG70002.__parsePattern('WLISt:WAVeform:DATA'), header) is not None:
+            key = 'Data'
+        elif self.__matches(SimulatedAWG70002.__parsePattern('WLISt:WAVeform:MARKer:DATA'), header) is not None:
+            key = 'Marker'
+        else:
+            raise RuntimeError('Simulated AWG70002: binary write not supported: {}'.format(message))
+        target = self.__waveform(args[0])[key]
+        start = int(args[1]) if len(args) > 1 else 0
+        size = int(args[2]) if len(args) > 2 else len(values)
+        if size != len(values) or start < 0 or start + size > len(target):
+            raise RuntimeError('Simulated AWG70002: data out of range of {}: {} + {} > {}'.format(
+                args[0], start, size, len(target)))
+        target[start:start + size] = values
+
+    def write_ascii_values(self, message, values, converter='f', separator=','):
+        self.write(message + separator.join([str(v) for v in values]))
+
+    def read_raw(self):
+        return self.__lastResponse.encode('ascii')
+
+    def close(self):
+        pass
+
+    def __transfer(self, bytes):
+        self.transfers += 1
+        self.bytesTransferred += bytes
+        cost = self.latency + bytes / self.bytesPerSecond
+        self.simulatedTime += cost
+        if self.realTime:
+            time.sleep(cost)
+
+    def __execute(self, command, binary):
+        self.commandCount += 1
+        header, args = self.__parseCommand(command)
+        # TekAWG70kService sets outputs by 'OUTPUT1:1'.
+        output = re.match(r'^OUTP(?:UT)?(\d*):(1|0|ON|OFF)$', header.upper())
+        if output is not None:
+            header, args = 'OUTPut{}:STATe'.format(output.group(1)), [output.group(2)]
+        for pattern, handler in self.__handlers:
+            numbers = self.__matches(pattern, header)
+            if numbers is not None:
+                return handler(args, numbers)
+        raise RuntimeError('Simulated AWG70002: undefined header: {}'.format(command))
+
+    # A pattern is a list of (longForm, shortForm, numbered) for each node, and whether it is a query.
+    @classmethod
+    def __parsePattern(cls, pattern):
+        isQuery = pattern.endswith('?')
+        nodes = []
+        for node in pattern.rstrip('?').split(':'):
+            numbered = node.endswith('#')
+            node = node.rstrip('#')
+            nodes.append((node.upper(), ''.join([c for c in node if not c.islower()]), numbered))
+        return nodes, isQuery
+
+    # Returns the numeric suffixes of the numbered nodes if header matches pattern, otherwise None.
+    @classmethod
+    def __matches(cls, pattern, header):
+        nodes, isQuery = pattern
+        if header.endswith('?') != isQuery:
+            return None
+        tokens = header.rstrip('?').lstrip(':').split(':')
+        if len(tokens) != len(nodes):
+            return None
+        numbers = []
+        for token, (longForm, shortForm, numbered) in zip(tokens, nodes):
+            m = re.match(r'^(\*?[A-Za-z]+)(\d*)$', token)
+            if m is None or not [longForm, shortForm].__contains__(m.group(1).upper()):
+                return None
+            if numbered:
+                numbers.append(int(m.group(2)) if len(m.group(2)) > 0 else 1)
+            elif len(m.group(2)) > 0:
+                return None
+        return numbers
+
+    @classmethod
+    def __splitCommands(cls, message):
+        return [c.strip() for c in SimulatedAWG70002.__splitOutsideQuotes(message.strip(), ';') if len(c.strip()) > 0]
+
+    @classmethod
+    def __parseCommand(cls, command):
+        s = command.strip().split(None, 1)
+        args = [] if len(s) == 1 else [a.strip() for a in SimulatedAWG70002.__splitOutsideQuotes(s[1], ',')]
+        return s[0], [a[1:-1] if len(a) >= 2 and a[0] == a[-1] and a[0] in '"\'' else a for a in args]
+
+    @classmethod
+    def __splitOutsideQuotes(cls, s, separator):
+        parts = []
+        current = []
+        quote = None
+        for c in s:
+            if quote is not None:
+                quote = None if c == quote else quote
+            elif c in '"\'':
+                quote = c
+            elif c == separator:
+                parts.append(''.join(current))
+                current = []
+                continue
+            current.append(c)
+        parts.append(''.join(current))
+        return parts
+
+    def __newWaveform(self, args, numbers):
+        name, size = args[0], int(args[1])
+        if self.waveforms.__contains__(name):
+            raise RuntimeError('Simulated AWG70002: waveform {} exists.'.format(name))
+        self.waveforms[name] = {'Data': np.zeros(size, dtype=np.float32), 'Marker': np.zeros(size, dtype=np.uint8)}
+
+    def __waveform(self, name):
+        if not self.waveforms.__contains__(name):
+            raise RuntimeError('Simulated AWG70002: waveform {} not exists.'.format(name))
+        return self.waveforms[name]
+
+    def __newSequence(self, args, numbers):
+        name, steps, tracks = args[0], int(args[1]), int(args[2]) if len(args) > 2 else 1
+        if self.sequences.__contains__(name):
+            raise RuntimeError('Simulated AWG70002: sequence {} exists.'.format(name))
+        if steps > SimulatedAWG70002.MaxSequenceSteps:
+            raise RuntimeError('Simulated AWG70002: too many steps: {}.'.format(steps))
+        self.sequences[name] = {'Steps': steps, 'Tracks': tracks,
+                                'Items': [{'Waveform': None, 'Repeat': '1', 'WaitMode': 'OFF', 'Goto': 'NEXT',
+                                           'JumpMode': 'OFF', 'JumpTarget': 'NEXT'} for i in range(0, steps)]}
+
+    def __sequence(self, name):
+        if not self.sequences.__contains__(name):
+            raise RuntimeError('Simulated AWG70002: sequence {} not exists.'.format(name))
+        return self.sequences[name]
+
+    def __step(self, name, step):
+        sequence = self.__sequence(name)
+        if step < 1 or step > sequence['Steps']:
+            raise RuntimeError('Simulated AWG70002: step {} out of range of {}.'.format(step, name))
+        return sequence['Items'][step - 1]
+
+    def __setStep(self, args, step, key):
+        self.__step(args[0], step)[key] = args[1]
+
+    def __setStepWaveform(self, args, numbers):
+        self.__waveform(args[1])
+        self.__step(args[0], numbers[0])['Waveform'] = args[1]
+
+    def __assignWaveform(self, args, numbers):
+        self.__waveform(args[0])
+        self.assignments[self.__channel(numbers[0])] = ('Waveform', args[0])
+
+    def __assignSequence(self, args, numbers):
+        self.__sequence(args[0])
+        self.assignments[self.__channel(numbers[0])] = ('Sequence', args[0], int(args[1]) if len(args) > 1 else 1)
+
+    def __channel(self, channel):
+        if not self.outputs.__contains__(channel):
+            raise RuntimeError('Simulated AWG70002: channel {} not exists.'.format(channel))
+        return channel
+
+    def __byIndex(self, items, index):
+        index = int(index)
+        if index < 1 or index > len(items):
+            raise RuntimeError('Simulated AWG70002: index {} out of range.'.format(index))
+        return list(items.keys())[index - 1]
+
+    def __delete(self, items, name):
+        if name.upper() == 'ALL':
+            items.clear()
+        elif items.__contains__(name):
+            del items[name]
+        else:
+            raise RuntimeError('Simulated AWG70002: {} not exists.'.format(name))
+
+
+# Waveform and sequence uploads on the simulated instrument, timed in simulated (transfer) time.
+def benchmark(length=10000000, stepCounts=(1000, 10000)):
+    from Services.WaveformGenerator.TekAWG70kService import AWG70002, AWG70002PM
+    simulator = SimulatedAWG70002()
+    dev = AWG70002PM(instr_handle=simulator)
+    dev.transferLatency, dev.transferRate = simulator.latency, simulator.bytesPerSecond
+    data = np.sin(np.arange(0, length, dtype=np.float32) / 100)
+    for chunkSize in [1 << 16, 1 << 18, 1 << 20, 1 << 22]:
+        transfers, simulatedTime = simulator.transfers, simulator.simulatedTime
+        dev.writeWaveform('UploadBenchmark', data, chunkSize)
+        print('Waveform of {} samples, chunk size {:>9}: {} transfers, {:.3f} s simulated'.format(
+            length, chunkSize, simulator.transfers - transfers, simulator.simulatedTime - simulatedTime))
+        dev._deleteWaveform('UploadBenchmark')
+    dev.writeWaveformPattern(0)
+    for steps in stepCounts:
+        items = [AWG70002.SequenceItem('wfPattern000', AWG70002.SequenceItem.TriggerMode.TriggerA)] * steps
+        estimate = dev.writeSequence('BenchmarkSequence', items, dryRun=True)
+        transfers, simulatedTime = simulator.transfers, simulator.simulatedTime
+        dev.writeSequence('BenchmarkSequence', items)
+        print('Sequence of {:>6} steps: {} transfers, {:.3f} s simulated, {:.3f} s if one command per transfer'.format(
+            steps, simulator.transfers - transfers, simulator.simulatedTime - simulatedTime,
+            estimate['EstimatedTimePerCommand']))
+
+
+if __name__ == '__main__':
+    benchmark()
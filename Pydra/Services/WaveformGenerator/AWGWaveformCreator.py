@@ -0,0 +1,201 @@
+__author__ = 'Hwaipy'
+
+import math
+import numpy as np
+from Services.WaveformGenerator import PulseTemplates
+from Services.WaveformGenerator import WaveformBundle
+
+
+# In-process port of Soap/MDI-QKD/AWGWaveformCreator (AWGWaveformCreator.scala). Channels are produced as uint8
+# arrays holding exactly the bytes the Java creator wrote to test.wave.
+class AWGWaveformCreator:
+    ChannelNames = ['AMDecoy', 'Laser', 'Sync', 'PM', 'AMTime1', 'AMTime2']
+    ChunkSize = 1 << 22
+    # Pulses whose waveform depends on pulseIndex (Sync, and the first pulse modes).
+    HeadPulses = 10
+    # Channels affected by each parameter of AWGDev. A change of the random numbers affects all channels.
+    Dependencies = {
+        'delayAMDecoy': ['AMDecoy'],
+        'delaySync': ['Sync'],
+        'delayLaser': ['Laser'],
+        'delayPM': ['PM'],
+        'delayAMTime1': ['AMTime1'],
+        'delayAMTime2': ['AMTime2'],
+        'pulseWidth': ['AMDecoy', 'PM', 'AMTime1', 'AMTime2'],
+        'laserPulseWidth': ['Laser'],
+        'interferometerDiff': ['AMTime1', 'AMTime2'],
+        'firstLaserPulseMode': ['Laser'],
+        'firstModulationPulseMode': ['AMDecoy', 'Sync', 'PM', 'AMTime1', 'AMTime2'],
+        'specifiedRandomNumberMode': ['Laser'],
+        'specifiedRandomNumber': ['Laser'],
+        'amplituteSignalTime': ['AMDecoy'],
+        'amplituteSignalPhase': ['AMDecoy'],
+        'amplituteDecoyTime': ['AMDecoy'],
+        'amplituteDecoyPhase': ['AMDecoy'],
+        'amplitutePM': ['PM'],
+    }
+
+    def __init__(self, timeParameters={}, modeParameters={}, amplituteParameters={}):
+        self.sampleRate = 25e9
+        self.repetationRate = 100e6
+        self.period = 1 / self.repetationRate
+        self.pulseWidth = 2e-9
+        self.laserPulseWidth = 2.5e-9
+        self.interferometerDiff = 3e-9
+        self.firstLaserPulseMode = False
+        self.firstModulationPulseMode = False
+        self.specifiedRandomNumberMode = False
+        self.specifiedRandomNumber = 0
+        self.ampSignalTime = 255
+        self.ampSignalPhase = 127
+        self.ampDecoyTime = 100
+        self.ampDecoyPhase = 40
+        self.ampPM = 200
+        self.delays = {name: 0.0 for name in AWGWaveformCreator.ChannelNames}
+        self.templateLibrary = PulseTemplates.DefaultLibrary
+        self.configure(timeParameters, modeParameters, amplituteParameters)
+
+    # Parameters are the dicts of AWGDev: times in ns, amplitudes as floats between -1 and 1.
+    def configure(self, timeParameters={}, modeParameters={}, amplituteParameters={}):
+        for name in AWGWaveformCreator.ChannelNames:
+            if timeParameters.__contains__('delay{}'.format(name)):
+                self.delays[name] = timeParameters['delay{}'.format(name)] * 1e-9
+        if timeParameters.__contains__('pulseWidth'):
+            self.pulseWidth = timeParameters['pulseWidth'] * 1e-9
+        if timeParameters.__contains__('laserPulseWidth'):
+            self.laserPulseWidth = timeParameters['laserPulseWidth'] * 1e-9
+        if timeParameters.__contains__('interferometerDiff'):
+            self.interferometerDiff = timeParameters['interferometerDiff'] * 1e-9
+        for key in ['firstLaserPulseMode', 'firstModulationPulseMode', 'specifiedRandomNumberMode']:
+            if modeParameters.__contains__(key):
+                setattr(self, key, bool(modeParameters[key]))
+        if modeParameters.__contains__('specifiedRandomNumber'):
+            self.specifiedRandomNumber = int(modeParameters['specifiedRandomNumber'])
+        for key, attr in [('amplituteSignalTime', 'ampSignalTime'), ('amplituteSignalPhase', 'ampSignalPhase'),
+                          ('amplituteDecoyTime', 'ampDecoyTime'), ('amplituteDecoyPhase', 'ampDecoyPhase'),
+                          ('amplitutePM', 'ampPM')]:
+            if amplituteParameters.__contains__(key):
+                setattr(self, attr, AWGWaveformCreator.toByte(amplituteParameters[key]))
+
+    # ((amp + 1) / 2 * 255.99).toByte in Scala, read back unsigned.
+    @classmethod
+    def toByte(cls, amp):
+        return int((amp + 1) / 2 * 255.99) & 0xFF
+
+    # Random Number, same as the Java creator:
+    # bit 3 (0, 1) for (Vacuum, non Vacuum), bit 2 (0, 1) for (Decoy, Signal),
+    # bit 1 (0, 1) for basis (Phase, Time), bit 0 for encoding (0, 1).
+    # Only the channels listed in ``channels'' are generated if it is given.
+    def createWaveforms(self, randomNumbers, channels=None):
+        channels = [name for name in AWGWaveformCreator.ChannelNames if channels is None or channels.__contains__(name)]
+        amplitudes = {'AMDecoy': self._amDecoyAmplitude, 'Laser': self._laserAmplitude, 'Sync': self._syncAmplitude,
+                      'PM': self._pmAmplitude, 'AMTime': self._amTimeAmplitude}
+        amplitudes = {name: amplitudes[name] for name in set([self.__baseName(c) for c in channels])}
+        randomNumbers = np.asarray(randomNumbers, dtype=np.int64)
+        totalSample = int(len(randomNumbers) * self.period * self.sampleRate)
+
+        def evaluate(names, indices):
+            iSample = indices.astype(np.float64)
+            pulseIndex = (iSample / self.sampleRate / self.period).astype(np.int64)
+            timeInPulse = iSample / self.sampleRate - self.period * pulseIndex
+            randomNumber = randomNumbers[pulseIndex]
+            return [amplitudes[name](randomNumber, timeInPulse, pulseIndex) for name in names]
+
+        # Pulses are concatenated from the template library if every pulse has the same number of samples, while
+        # the samples where float rounding matters are still computed the same way as the Java creator.
+        samples = PulseTemplates.samplesPerPulse(len(randomNumbers), self.period, self.sampleRate, totalSample)
+        bases = {}
+        if samples is None:
+            for name in amplitudes.keys():
+                bases[name] = np.zeros(totalSample, dtype=np.uint8)
+            for start in range(0, totalSample, AWGWaveformCreator.ChunkSize):
+                stop = min(start + AWGWaveformCreator.ChunkSize, totalSample)
+                values = evaluate(amplitudes.keys(), np.arange(start, stop))
+                for name, value in zip(amplitudes.keys(), values):
+                    bases[name][start:stop] = value
+        else:
+            classes, classIndices = np.unique(randomNumbers, return_inverse=True)
+            thresholds = [0.0, self.pulseWidth, self.laserPulseWidth, self.interferometerDiff,
+                          self.interferometerDiff + self.pulseWidth]
+            columns = PulseTemplates.sensitiveColumns(samples, self.sampleRate, self.period, thresholds)
+            for name in amplitudes.keys():
+                table = np.array([self._pulseTemplate(amplitudes[name], name, int(rn), samples) for rn in classes],
+                                 dtype=np.uint8).reshape(len(classes), samples)
+                bases[name] = PulseTemplates.tilePulses(table, classIndices.reshape(-1), columns,
+                                                        AWGWaveformCreator.HeadPulses,
+                                                        lambda indices: evaluate([name], indices)[0], totalSample)
+        waveforms = {}
+        for name in channels:
+            # Sample i of the output is sample (i + delaySample) of the undelayed waveform.
+            delaySample = -math.floor(self.delays[name] * self.sampleRate + 0.5)
+            waveforms[name] = np.roll(bases[self.__baseName(name)], -delaySample)
+        return waveforms
+
+    # One pulse of random number ``rn'' on the ideal sample grid, away from the first pulses.
+    def _pulseTemplate(self, amplitude, name, rn, samples):
+        parameters = (self.period, self.pulseWidth, self.laserPulseWidth, self.interferometerDiff,
+                      self.firstLaserPulseMode, self.firstModulationPulseMode, self.specifiedRandomNumberMode,
+                      self.specifiedRandomNumber, self.ampSignalTime, self.ampSignalPhase, self.ampDecoyTime,
+                      self.ampDecoyPhase, self.ampPM)
+        return self.templateLibrary.template(
+            'AWGWaveformCreator.{}'.format(name), rn, self.sampleRate, parameters,
+            lambda: amplitude(np.full(samples, rn, dtype=np.int64), np.arange(0, samples) / self.sampleRate,
+                              np.full(samples, AWGWaveformCreator.HeadPulses, dtype=np.int64)).astype(np.uint8))
+
+    # The raw test.wave layout of the Java creator. Use saveBundle to keep the sample rate and parameters.
+    def saveToFile(self, path, waveforms):
+        with open(path, 'wb') as file:
+            for name in AWGWaveformCreator.ChannelNames:
+                file.write(waveforms[name].tobytes())
+
+    def saveBundle(self, path, waveforms):
+        parameters = {'repetationRate': self.repetationRate, 'pulseWidth': self.pulseWidth,
+                      'laserPulseWidth': self.laserPulseWidth, 'interferometerDiff': self.interferometerDiff,
+                      'firstLaserPulseMode': self.firstLaserPulseMode,
+                      'firstModulationPulseMode': self.firstModulationPulseMode,
+                      'specifiedRandomNumberMode': self.specifiedRandomNumberMode,
+                      'specifiedRandomNumber': self.specifiedRandomNumber, 'ampSignalTime': self.ampSignalTime,
+                      'ampSignalPhase': self.ampSignalPhase, 'ampDecoyTime': self.ampDecoyTime,
+                      'ampDecoyPhase': self.ampDecoyPhase, 'ampPM': self.ampPM, 'delays': self.delays}
+        WaveformBundle.saveBundle(path, waveforms, self.sampleRate, parameters,
+                                  [name for name in AWGWaveformCreator.ChannelNames if waveforms.__contains__(name)])
+
+    # AMTime1 and AMTime2 differ only in delay.
+    def __baseName(self, channel):
+        return 'AMTime' if channel.startswith('AMTime') else channel
+
+    def _modulationEnabled(self, pulseIndex):
+        return (pulseIndex == 0) if self.firstModulationPulseMode else True
+
+    def _laserAmplitude(self, randomNumber, timeInPulse, pulseIndex):
+        on = timeInPulse <= self.laserPulseWidth
+        if self.firstLaserPulseMode:
+            on &= pulseIndex == 0
+        if self.specifiedRandomNumberMode:
+            on &= randomNumber == self.specifiedRandomNumber
+        return on
+
+    def _syncAmplitude(self, randomNumber, timeInPulse, pulseIndex):
+        return (pulseIndex < 10) & self._modulationEnabled(pulseIndex)
+
+    def _amDecoyAmplitude(self, randomNumber, timeInPulse, pulseIndex):
+        isSignal = (randomNumber & 0x4) > 0
+        isTime = (randomNumber & 0x2) > 0
+        amp = np.where(isSignal, np.where(isTime, self.ampSignalTime, self.ampSignalPhase),
+                       np.where(isTime, self.ampDecoyTime, self.ampDecoyPhase))
+        on = (timeInPulse <= self.pulseWidth) & ((randomNumber & 0x8) != 0) & self._modulationEnabled(pulseIndex)
+        return np.where(on, amp, 0)
+
+    def _amTimeAmplitude(self, randomNumber, timeInPulse, pulseIndex):
+        inPulse1 = (timeInPulse >= 0) & (timeInPulse < self.pulseWidth)
+        inPulse2 = (timeInPulse >= self.interferometerDiff) & (
+            timeInPulse < self.interferometerDiff + self.pulseWidth)
+        encode = randomNumber & 0x1
+        on = np.where((randomNumber & 0x2) > 0, np.where(encode == 0, inPulse1, inPulse2), inPulse1 | inPulse2)
+        return on & ((randomNumber & 0x8) != 0) & self._modulationEnabled(pulseIndex)
+
+    def _pmAmplitude(self, randomNumber, timeInPulse, pulseIndex):
+        inPulse1 = (timeInPulse >= 0) & (timeInPulse < self.pulseWidth)
+        on = inPulse1 & ((randomNumber & 0x1) == 0) & ((randomNumber & 0x8) != 0) & (
+            (randomNumber & 0x2) == 0) & self._modulationEnabled(pulseIndex)
+        return np.where(on, self.ampPM, 0)
@@ -0,0 +1,80 @@
+__author__ = 'Hwaipy'
+
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+# Memoized per-pulse waveform shapes, keyed by (channel, random number class, sampleRate, pulse parameters).
+# The least recently used templates are evicted when the library is full.
+class PulseTemplateLibrary:
+    def __init__(self, maxTemplates=1024):
+        self.maxTemplates = maxTemplates
+        self.hits = 0
+        self.misses = 0
+        self.__templates = OrderedDict()
+        self.__lock = threading.Lock()
+
+    # ``builder'' is called to create the template when it is not in the library.
+    def template(self, channel, randomNumber, sampleRate, parameters, builder):
+        key = (channel, randomNumber, sampleRate, parameters)
+        with self.__lock:
+            if self.__templates.__contains__(key):
+                self.hits += 1
+                self.__templates.move_to_end(key)
+                return self.__templates[key]
+            self.misses += 1
+        template = builder()
+        template.setflags(write=False)
+        with self.__lock:
+            self.__templates[key] = template
+            while len(self.__templates) > self.maxTemplates:
+                self.__templates.popitem(last=False)
+        return template
+
+    def size(self):
+        return len(self.__templates)
+
+    def clear(self):
+        with self.__lock:
+            self.__templates.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+DefaultLibrary = PulseTemplateLibrary()
+
+
+# Number of samples per pulse if the waveform is a concatenation of equal pulses, otherwise None. totalSample may be
+# a little shorter than pulseCount * samples due to float rounding, in which case the last pulse is truncated.
+def samplesPerPulse(pulseCount, period, sampleRate, totalSample):
+    samples = int(round(period * sampleRate))
+    if samples == 0 or abs(period * sampleRate - samples) > 1e-6:
+        return None
+    if totalSample > pulseCount * samples or totalSample <= (pulseCount - 1) * samples:
+        return None
+    return samples
+
+
+# Columns of a pulse where sampling in float may differ from the ideal grid: the first sample of each pulse, where
+# pulseIndex can round to the previous pulse, and samples lying on a threshold of the amplitude functions.
+def sensitiveColumns(samplesPerPulse, sampleRate, period, thresholds):
+    times = np.arange(0, samplesPerPulse) / sampleRate
+    sensitive = np.zeros(samplesPerPulse, dtype=bool)
+    sensitive[0] = True
+    for threshold in thresholds:
+        sensitive |= np.abs(times - threshold) <= period * 1e-6
+    return np.nonzero(sensitive)[0]
+
+
+# Concatenates table[classIndices] into totalSample samples and overwrites the sensitive columns and the first
+# headPulses pulses with evaluate(sampleIndices), which computes the exact samples.
+def tilePulses(table, classIndices, columns, headPulses, evaluate, totalSample):
+    pulseCount, samples = len(classIndices), table.shape[1]
+    waveform = table[classIndices].reshape(-1)[:totalSample]
+    headPulses = min(headPulses, pulseCount)
+    indices = np.concatenate((np.arange(0, headPulses * samples),
+                              (np.arange(headPulses, pulseCount)[:, np.newaxis] * samples + columns).reshape(-1)))
+    indices = indices[indices < totalSample]
+    waveform[indices] = evaluate(indices)
+    return waveform
@@ -11,12 +11,22 @@ import enum
 import time
 import csv
 import os
+import hashlib
+import collections
+from Services.WaveformGenerator.AWGWaveformCreator import AWGWaveformCreator
+from Services.WaveformGenerator import WaveformBundle
 
 class Instrument:
     visa_resources = {'AWG70002A': 'GPIB8::1::INSTR'}
 
-    def __init__(self, instr_name=""):
+    # instr_handle, if given, is used in place of the VISA resource (e.g. AWG70002Simulator.SimulatedAWG70002).
+    def __init__(self, instr_name="", instr_handle=None):
         self.instr_name = instr_name
+        if instr_handle is not None:
+            self.rm = None
+            self.instr_handle = instr_handle
+            self._inited = True
+            return
         self.rm = visa.ResourceManager()
         self._inited = False
         if not instr_name in self.visa_resources:
@@ -160,59 +170,132 @@ class SCPI:
 
 
 class AWG70002(Instrument):
-    def __init__(self, instr_name="AWG70002A"):
-        super(AWG70002, self).__init__(instr_name)
+    # Samples per WLISt:WAVeform:DATA / WLISt:WAVeform:MARKer:DATA transfer.
+    UploadChunkSize = 1 << 20
+    # Maximum length of one transfer of ';' joined commands.
+    CommandBatchLength = 65536
+    # The commands setting one attribute of a sequence step, in the order _sequenceItemCommands sends them.
+    SequenceStepCommands = collections.OrderedDict([
+        ('Waveform', 'SLISt:SEQuence:STEP{step}:TASSet{track}:WAVeform "{name}", "{value}"'),
+        ('Repeat', 'SLISt:SEQuence:STEP{step}:RCOunt "{name}", {value}'),
+        ('WaitMode', 'SLISt:SEQuence:STEP{step}:WINPut "{name}", {value}'),
+        ('Goto', 'SLISt:SEQuence:STEP{step}:GOTO "{name}", {value}'),
+        ('JumpMode', 'SLISt:SEQuence:STEP{step}:EJINput "{name}", {value}'),
+        ('JumpTarget', 'SLISt:SEQuence:STEP{step}:EJUMp "{name}", {value}')])
+
+    def __init__(self, instr_name="AWG70002A", instr_handle=None):
+        super(AWG70002, self).__init__(instr_name, instr_handle)
         self.scpi = SCPI(self)
-
-    def writeWaveform(self, name, data):
+        self.lastUploadStatistics = None
+        # Used by the dry-run cost estimate: seconds per transfer, and bytes per second.
+        self.transferLatency = 5e-3
+        self.transferRate = 1e6
+
+    # data is sent as float32 in chunks of chunkSize samples. progress(sentSamples, totalSamples) is called after
+    # every chunk if given.
+    def writeWaveform(self, name, data, chunkSize=None, progress=None):
+        data = np.ascontiguousarray(data, dtype=np.float32)
         if self._isWaveformExists(name):
             self._deleteWaveform(name)
         self._createWaveform(name, len(data))
-        self._writeWaveformData(name, data)
+        return self._writeChunked(self._writeWaveformData, name, data, chunkSize, progress)
+
+    # Uploads a test waveform of length samples with each of the chunkSizes, and returns the throughput in bytes/s.
+    def benchmarkWaveformUpload(self, length=10000000, chunkSizes=(1 << 16, 1 << 18, 1 << 20, 1 << 22),
+                                name='UploadBenchmark'):
+        data = np.sin(np.arange(0, length, dtype=np.float32) / 100)
+        throughputs = {}
+        for chunkSize in chunkSizes:
+            statistics = self.writeWaveform(name, data, chunkSize)
+            throughputs[chunkSize] = statistics['Throughput']
+            print('Chunk size {:>9}: {} chunks in {:.3f} s, {:.2f} MB/s'.format(
+                chunkSize, statistics['Chunks'], statistics['Time'], statistics['Throughput'] / 1e6))
+        self._deleteWaveform(name)
+        return throughputs
 
     def _markerForm(self, marker1, marker2):
-        return ((marker1&0x1) << 6) | ((marker2&0x1) << 7)
-
-    def writeMarker(self, name, marker):
+        return AWG70002.packMarkers(marker1, marker2)
+
+    # Packs two 0/1 arrays into the marker bytes of the AWG: marker 1 in bit 6, marker 2 in bit 7.
+    # If marker2 is None, marker may be a N*2 array of both markers, or a N*1 array used for both markers.
+    @classmethod
+    def packMarkers(cls, marker, marker2=None):
+        if marker2 is None:
+            marker = np.asarray(marker)
+            marker, marker2 = (marker[:, 0], marker[:, 1]) if len(marker.shape) == 2 else (marker, marker)
+        marker = np.asarray(marker, dtype=np.uint8)
+        marker2 = np.asarray(marker2, dtype=np.uint8)
+        packed = np.bitwise_and(marker, 0x1)
+        np.left_shift(packed, 6, out=packed)
+        packed |= np.left_shift(np.bitwise_and(marker2, 0x1), 7)
+        return packed
+
+    def writeMarker(self, name, marker, marker2=None, chunkSize=None, progress=None):
         # Marker is a N*1 or N*2 np.array of 0/1, describing the marker data.
         # e.g., marker[:,0]=np.array([0,0,0,1,1]), marker[:,1]=np.array([0,1,1,1,0]),
         # then we set both markers accordingly.
         # if marker has only one column, we set both marker the same.
-        # by translating it to marker_raw = [0, 0x8, 0x8, 0xC, 0x4]
+        # Markers can also be given as two N*1 arrays, marker and marker2.
         if self._isWaveformExists(name):
             self._deleteWaveform(name)
+        rawMarker = AWG70002.packMarkers(marker, marker2)
+        self._createWaveform(name, len(rawMarker))
+        return self._writeChunked(self._writeMarkerData, name, rawMarker, chunkSize, progress)
 
-        np_marker = np.array(marker)
-        self._createWaveform(name, np_marker.shape[0])
-        if len(np_marker.shape) == 2:
-            raw_marker = self._markerForm(np_marker[:, 0], np_marker[:, 1])
-        else:
-            raw_marker = self._markerForm(np_marker, np_marker)
-
-        self._writeMarkerData(name, raw_marker)
-
-    def addMarker(self, name, marker):
-        np_marker = np.array(marker)
+    def addMarker(self, name, marker, marker2=None, chunkSize=None, progress=None):
+        rawMarker = AWG70002.packMarkers(marker, marker2)
         if not self._isWaveformExists(name):
-            self._createWaveform(name, np_marker.shape[0])
-
-        if len(np_marker.shape) == 2:
-            raw_marker = self._markerForm(np_marker[:, 0], np_marker[:, 1])
-        else:
-            raw_marker = self._markerForm(np_marker, np_marker)
-
-        self._writeMarkerData(name, raw_marker)
-
-
-    def writeSequence(self, name, sequenceItems):
+            self._createWaveform(name, len(rawMarker))
+        return self._writeChunked(self._writeMarkerData, name, rawMarker, chunkSize, progress)
+
+    # The step commands are joined with ';' and sent in transfers of at most CommandBatchLength characters, followed
+    # by a single *OPC? to wait for the instrument. progress(sentTransfers, totalTransfers) is called after every
+    # transfer if given. With dryRun, nothing is sent and the cost estimate is returned. With verbose, a summary of the
+    # upload is printed.
+    def writeSequence(self, name, sequenceItems, dryRun=False, progress=None, verbose=False):
+        commands = []
+        for i in range(len(sequenceItems)):
+            commands += self._sequenceItemCommands(name, i + 1, sequenceItems[i])
+        batches = self._batchCommands(commands)
+        if dryRun:
+            return self.estimateSequenceCost(len(sequenceItems), commands, batches)
+        beginTime = time.time()
         if self._isSequenceExists(name):
             self._deleteSequence(name)
         self._createSequence(name, len(sequenceItems), 1)
-        for i in range(len(sequenceItems)):
-            self._setSequenceItem(name, i+1, sequenceItems[i])
-            if i%10==0:
-                print(i)
-            #print("Send %d SeqItem to AWG"%i)
+        for i in range(len(batches)):
+            self._write_raw(batches[i])
+            if progress is not None:
+                progress(i + 1, len(batches))
+        self._waitCMD()
+        elapsed = time.time() - beginTime
+        if verbose:
+            print('Sequence {}: {} steps in {} transfers, {:.3f} s'.format(name, len(sequenceItems), len(batches),
+                                                                           elapsed))
+        return elapsed
+
+    # Estimated upload time with one transfer per command (as _setSequenceItem does) and with batched transfers.
+    def estimateSequenceCost(self, steps, commands, batches):
+        bytes = sum([len(command) + 1 for command in commands])
+        return {'Steps': steps, 'Commands': len(commands), 'Transfers': len(batches), 'Bytes': bytes,
+                'EstimatedTimePerCommand': len(commands) * self.transferLatency + bytes / self.transferRate,
+                'EstimatedTimeBatched': len(batches) * self.transferLatency + bytes / self.transferRate}
+
+    # Dry-run estimates and upload times of sequences of the given step counts.
+    def benchmarkSequenceUpload(self, stepCounts=(1000, 10000, 100000), waveformName='wfPattern000', dryRun=False):
+        results = {}
+        for steps in stepCounts:
+            items = [AWG70002.SequenceItem(waveformName, AWG70002.SequenceItem.TriggerMode.TriggerA)] * steps
+            estimate = self.writeSequence('BenchmarkSequence', items, dryRun=True)
+            print('{:>7} steps: {} commands in {} transfers, estimated {:.2f} s per command, {:.2f} s batched'.format(
+                steps, estimate['Commands'], estimate['Transfers'], estimate['EstimatedTimePerCommand'],
+                estimate['EstimatedTimeBatched']))
+            if not dryRun:
+                estimate['Time'] = self.writeSequence('BenchmarkSequence', items)
+            results[steps] = estimate
+        if not dryRun:
+            self._deleteSequence('BenchmarkSequence')
+        return results
 
     def assignOutputSeq(self, channel, sequence):
         self._assignSequence(channel, sequence, 1)
@@ -320,12 +403,29 @@ class AWG70002(Instrument):
     def _getWaveformType(self, name):
         return self.scpi.WLISt.WAVeform.TYPE.query('"{}"'.format(name))
 
+    # Sends data[i:i + chunkSize] with writer(name, chunk, start=i). The statistics of the upload are returned and
+    # kept in lastUploadStatistics.
+    def _writeChunked(self, writer, name, data, chunkSize=None, progress=None):
+        chunkSize = AWG70002.UploadChunkSize if chunkSize is None else int(chunkSize)
+        beginTime = time.time()
+        chunks = 0
+        for start in range(0, len(data), chunkSize):
+            chunk = data[start:start + chunkSize]
+            writer(name, chunk, start)
+            chunks += 1
+            if progress is not None:
+                progress(start + len(chunk), len(data))
+        elapsed = time.time() - beginTime
+        self.lastUploadStatistics = {'Name': name, 'Samples': len(data), 'Bytes': data.nbytes, 'Chunks': chunks,
+                                     'ChunkSize': chunkSize, 'Time': elapsed,
+                                     'Throughput': data.nbytes / elapsed if elapsed > 0 else float('inf')}
+        return self.lastUploadStatistics
+
     def _writeWaveformData(self, name, data, start=0):
         self._write_binary('WLISt:WAVeform:DATA "{}",{},{},'.format(name, start, len(data)), data,
                                               datatype='f', is_big_endian=False)
 
     def _writeMarkerData(self, name, data, start=0):
-        print(data)
         self._write_binary('WLISt:WAVeform:MARKer:DATA "{}",{},{},'.format(name, start, len(data)), data,
                                               datatype='B', is_big_endian=False)
 
@@ -372,39 +472,63 @@ class AWG70002(Instrument):
 
     def _setSequenceItemWaitMode(self, name, step, mode):
         # mode can be OFF|ATRIGGER|BTRIGGER|ITRIGGER
-        self._write_raw('SLISt:SEQuence:STEP{}:WINPut "{}", {}'.format(step, name, mode))
+        self._write_raw(self._sequenceStepCommand('WaitMode', name, step, mode))
 
     def _setSequenceItemJumpMode(self, name, step, mode):
         # mode can be OFF|ATRIGGER|BTRIGGER|ITRIGGER
-        self._write_raw('SLISt:SEQuence:STEP{}:EJINput "{}", {}'.format(step, name, mode))
+        self._write_raw(self._sequenceStepCommand('JumpMode', name, step, mode))
 
     def _setSequenceItemJumpTarget(self, name, step, target):
         # target can be NEXT|FIRST|LAST|END or a index
-        self._write_raw('SLISt:SEQuence:STEP{}:EJUMp "{}", {}'.format(step, name, target))
+        self._write_raw(self._sequenceStepCommand('JumpTarget', name, step, target))
 
     def _setSequenceItemGoto(self, name, step, target):
         # target can be NEXT|FIRST|LAST|END or a index
-        self._write_raw('SLISt:SEQuence:STEP{}:GOTO "{}", {}'.format(step, name, target))
+        self._write_raw(self._sequenceStepCommand('Goto', name, step, target))
 
     def _setSequenceItemRepeat(self, name, step, count):
         # count can be INFINITE or a number
-        self._write_raw('SLISt:SEQuence:STEP{}:RCOunt "{}", {}'.format(step, name, count))
+        self._write_raw(self._sequenceStepCommand('Repeat', name, step, count))
 
     def _setSequenceItemWaveform(self, name, step, track, waveformName):
-        self._write_raw(
-            'SLISt:SEQuence:STEP{}:TASSet{}:WAVeform "{}", "{}"'.format(step, track, name, waveformName))
+        self._write_raw(self._sequenceStepCommand('Waveform', name, step, waveformName, track))
+
+    def _sequenceStepCommand(self, attribute, name, step, value, track=1):
+        return AWG70002.SequenceStepCommands[attribute].format(step=step, track=track, name=name, value=value)
 
     def _setSequenceItem(self, name, step, sequenceItem):
-        self._setSequenceItemWaveform(name, step, 1, sequenceItem.waveformName)
+        for command in self._sequenceItemCommands(name, step, sequenceItem):
+            self._write_raw(command)
 
+    # The commands of all SequenceStepCommands for one step, on track 1.
+    def _sequenceItemCommands(self, name, step, sequenceItem):
         def modeParse(mode, clazz):
             return mode.value if isinstance(mode, clazz) else mode
 
-        self._setSequenceItemRepeat(name, step, sequenceItem.repeat)
-        self._setSequenceItemWaitMode(name, step, modeParse(sequenceItem.waitMode, AWG70002.SequenceItem.TriggerMode))
-        self._setSequenceItemGoto(name, step, modeParse(sequenceItem.goto, AWG70002.SequenceItem.Target))
-        self._setSequenceItemJumpMode(name, step, modeParse(sequenceItem.jumpMode, AWG70002.SequenceItem.TriggerMode))
-        self._setSequenceItemJumpTarget(name, step, modeParse(sequenceItem.jumpTarget, AWG70002.SequenceItem.Target))
+        values = {'Waveform': sequenceItem.waveformName, 'Repeat': sequenceItem.repeat,
+                  'WaitMode': modeParse(sequenceItem.waitMode, AWG70002.SequenceItem.TriggerMode),
+                  'Goto': modeParse(sequenceItem.goto, AWG70002.SequenceItem.Target),
+                  'JumpMode': modeParse(sequenceItem.jumpMode, AWG70002.SequenceItem.TriggerMode),
+                  'JumpTarget': modeParse(sequenceItem.jumpTarget, AWG70002.SequenceItem.Target)}
+        return [self._sequenceStepCommand(attribute, name, step, values[attribute])
+                for attribute in AWG70002.SequenceStepCommands]
+
+    # Joins commands with ';:' (the ':' restarts each command from the root) into transfers of at most
+    # CommandBatchLength characters.
+    def _batchCommands(self, commands):
+        batches = []
+        current = []
+        length = 0
+        for command in commands:
+            if len(current) > 0 and length + len(command) + 2 > AWG70002.CommandBatchLength:
+                batches.append(';:'.join(current))
+                current = []
+                length = 0
+            current.append(command)
+            length += len(command) + 2
+        if len(current) > 0:
+            batches.append(';:'.join(current))
+        return batches
 
     # Source: Assign pattern to source #
     def _assignWaveform(self, channel, waveformName):
@@ -439,12 +563,108 @@ class AWG70002(Instrument):
 
 class AWG70002PM(AWG70002):
     ''' AWG70002A in Pulsed Mode'''
-    def __init__(self):
-        super(AWG70002PM, self).__init__("AWG70002A")
+    # Used as maxSeqSteps if the instrument does not answer SLIST:SEQUENCE:STEP:MAX?.
+    DefaultMaxSeqSteps = 16383
+
+    def __init__(self, instr_handle=None):
+        super(AWG70002PM, self).__init__("AWG70002A", instr_handle)
         self.clockRate = self._getIntClockRate()
-        #self.maxSeqSteps = self._getMaxSequenceSteps()
-        self._wfList = self._listWaveforms()
+        self.__maxSeqSteps = None
         self._idxseq = 1
+        self.syncCatalog()
+
+    # Queried on first use. A failed query is retried next time.
+    @property
+    def maxSeqSteps(self):
+        if self.__maxSeqSteps is None:
+            try:
+                self.__maxSeqSteps = self._getMaxSequenceSteps()
+            except ValueError:
+                return AWG70002PM.DefaultMaxSeqSteps
+        return self.__maxSeqSteps
+
+    # Local catalog of the waveforms on the instrument, name -> {'Length', 'Hash', 'MarkerHash'}. It is synced from
+    # the instrument once and then kept up to date by the create / delete / write methods below. Hashes are None if
+    # the data is not written by this object. Waveforms with identical content are found by contentKey.
+    def syncCatalog(self):
+        self._catalog = {}
+        self._contents = {}
+        for name in self._listWaveforms():
+            self._catalog[name] = {'Length': self._getWaveformLength(name), 'Hash': None, 'MarkerHash': None}
+
+    def getCatalog(self):
+        return {name: dict(entry) for name, entry in self._catalog.items()}
+
+    def findWaveform(self, contentKey):
+        return self._contents.get(contentKey)
+
+    @classmethod
+    def contentHash(cls, data):
+        return hashlib.sha1(np.ascontiguousarray(data).tobytes()).hexdigest()
+
+    @classmethod
+    def contentKey(cls, length, hash, markerHash):
+        return (length, hash, markerHash)
+
+    def _isWaveformExists(self, name):
+        return self._catalog.__contains__(name)
+
+    def _createWaveform(self, name, length):
+        super(AWG70002PM, self)._createWaveform(name, length)
+        self._catalog[name] = {'Length': length, 'Hash': None, 'MarkerHash': None}
+
+    def _deleteWaveform(self, name):
+        super(AWG70002PM, self)._deleteWaveform(name)
+        self.__updateContent(name, None)
+
+    def _deleteAllWaveforms(self):
+        super(AWG70002PM, self)._deleteAllWaveforms()
+        self._catalog = {}
+        self._contents = {}
+
+    # Skips the upload if the waveform already holds this data.
+    def writeWaveform(self, name, data, chunkSize=None, progress=None):
+        data = np.ascontiguousarray(data, dtype=np.float32)
+        hash = AWG70002PM.contentHash(data)
+        if self._catalog.get(name) == {'Length': len(data), 'Hash': hash, 'MarkerHash': None}:
+            return None
+        statistics = super(AWG70002PM, self).writeWaveform(name, data, chunkSize, progress)
+        self.__updateContent(name, {'Length': len(data), 'Hash': hash, 'MarkerHash': None})
+        return statistics
+
+    def writeMarker(self, name, marker, marker2=None, chunkSize=None, progress=None):
+        rawMarker = AWG70002.packMarkers(marker, marker2)
+        markerHash = AWG70002PM.contentHash(rawMarker)
+        if self._catalog.get(name) == {'Length': len(rawMarker), 'Hash': None, 'MarkerHash': markerHash}:
+            return None
+        statistics = super(AWG70002PM, self).writeMarker(name, marker, marker2, chunkSize, progress)
+        self.__updateContent(name, {'Length': len(rawMarker), 'Hash': None, 'MarkerHash': markerHash})
+        return statistics
+
+    def addMarker(self, name, marker, marker2=None, chunkSize=None, progress=None):
+        rawMarker = AWG70002.packMarkers(marker, marker2)
+        markerHash = AWG70002PM.contentHash(rawMarker)
+        entry = self._catalog.get(name)
+        if entry is not None and entry['MarkerHash'] == markerHash:
+            return None
+        statistics = super(AWG70002PM, self).addMarker(name, marker, marker2, chunkSize, progress)
+        entry = dict(self._catalog[name])
+        entry['MarkerHash'] = markerHash
+        self.__updateContent(name, entry)
+        return statistics
+
+    # Sets the catalog entry of name (removes it if entry is None), keeping the content index in step.
+    def __updateContent(self, name, entry):
+        old = self._catalog.pop(name, None)
+        if old is not None:
+            oldKey = AWG70002PM.contentKey(old['Length'], old['Hash'], old['MarkerHash'])
+            if self._contents.get(oldKey) == name:
+                del self._contents[oldKey]
+        if entry is not None:
+            self._catalog[name] = entry
+            if entry['Hash'] is not None or entry['MarkerHash'] is not None:
+                self._contents.setdefault(AWG70002PM.contentKey(entry['Length'], entry['Hash'], entry['MarkerHash']),
+                                          name)
 
     def _mkWaveformName(self, wfTime):
         return "wfPattern%03d" % (wfTime)
@@ -458,24 +678,29 @@ class AWG70002PM(AWG70002):
         The total length is wfLength (points)
         '''
         name = self._mkWaveformName(wfHighBeg)
-        data = [0]*wfLength
+        self.writeWaveform(name, self._waveformPattern(wfHighBeg, wfHighWidth, wfLength))
+        return name
+
+    def _waveformPattern(self, wfHighBeg, wfHighWidth, wfLength):
+        data = np.zeros(wfLength, dtype=np.float32)
         wfHighBeg = wfHighBeg if wfHighBeg > 0 else 0
         wfHighEnd = wfHighBeg + wfHighWidth
         wfHighEnd = wfHighEnd if wfHighEnd < wfLength else wfLength
-        data[wfHighBeg:wfHighEnd] = [1]*(wfHighEnd-wfHighBeg)
-
-        self.writeWaveform(name, data)
-        return name
+        data[wfHighBeg:wfHighEnd] = 1
+        return data
 
     def writeMarkerPattern(self, mkHighBeg, mkFlag, mkHighWidth=200, mkLength=2400):
         name = self._mkMarkerName(mkHighBeg, mkFlag)
+        self.writeMarker(name, self._markerPattern(mkHighBeg, mkFlag, mkHighWidth, mkLength))
+        return name
+
+    def _markerPattern(self, mkHighBeg, mkFlag, mkHighWidth, mkLength):
         marker = np.zeros([mkLength,2], dtype='uint8')
         mkHighBeg = mkHighBeg if mkHighBeg>0 else 0
         mkHighEnd = mkHighBeg + mkHighWidth
         mkHighEnd = mkHighEnd if mkHighEnd<mkLength else mkLength
         marker[int(mkHighBeg): int(mkHighEnd+1), int(mkFlag-1)] = 1
-        self.writeMarker(name, marker)
-        return name
+        return marker
 
     def setClock(self, rate=20E9):
         super(AWG70002PM, self).setClock(rate)
@@ -501,22 +726,29 @@ class AWG70002PM(AWG70002):
     def clearAll(self):
         self._deleteAllWaveforms()
         self._deleteAllSequence()
-        self._wfList=[]
 
+    # Returns the name of a waveform already holding the same data if there is one.
     def AddWaveform(self, wfHighBeg, wfHighWidth=200, wfLength=2400):
         name = self._mkWaveformName(wfHighBeg)
-        if name in self._wfList:
+        if name in self._catalog:
             return name # do not need to add
-        self.writeWaveformPattern(wfHighBeg, wfHighWidth, wfLength)
-        self._wfList = self._listWaveforms() # refresh list
+        data = self._waveformPattern(wfHighBeg, wfHighWidth, wfLength)
+        existing = self.findWaveform(AWG70002PM.contentKey(wfLength, AWG70002PM.contentHash(data), None))
+        if existing is not None:
+            return existing
+        self.writeWaveform(name, data)
         return name
 
     def AddMarker(self, mkHighBeg, mkFlag, mkHighWidth=200, mkLength=2400):
         name = self._mkMarkerName(mkHighBeg, mkFlag)
-        if name in self._wfList:
+        if name in self._catalog:
             return name # do not need to add
-        self.writeMarkerPattern(mkHighBeg, mkFlag, mkHighWidth, mkLength)
-        self._wfList = self._listWaveforms() # refresh list
+        marker = self._markerPattern(mkHighBeg, mkFlag, mkHighWidth, mkLength)
+        rawMarker = AWG70002.packMarkers(marker)
+        existing = self.findWaveform(AWG70002PM.contentKey(mkLength, None, AWG70002PM.contentHash(rawMarker)))
+        if existing is not None:
+            return existing
+        self.writeMarker(name, marker)
         return name
 
     def writePulseSequences(self, positions, waitMode=AWG70002.SequenceItem.TriggerMode.TriggerA):
@@ -526,7 +758,6 @@ class AWG70002PM(AWG70002):
             raise Exception("Input Sequence too Large: ", positions,
                             ", Limit=", self.maxSeqSteps)
         seqlist = []
-        self._wfList = self._listWaveforms()
         for wfBegPos in positions:
             wfname = self.AddWaveform(wfBegPos)
             seqlist.append(AWG70002.SequenceItem(wfname, waitMode))
@@ -542,7 +773,6 @@ class AWG70002PM(AWG70002):
             raise Exception("Input Sequence too Large: ", positions,
                             ", Limit=", self.maxSeqSteps)
         seqlist = []
-        self._wfList = self._listWaveforms()
         for mkBegPos, mkchan in zip(positions, mkflag):
             mkname = self.AddMarker(mkBegPos, mkchan)
             seqlist.append(AWG70002.SequenceItem(mkname, waitMode))
@@ -572,6 +802,21 @@ class AWG70002PM(AWG70002):
                 scw.writerow(['TrigA', wfname, 1E10, '2400'])
 
 
+# Packing of 10M-sample markers, from the list of pairs that AWGDev used to build, and from two uint8 arrays.
+def benchmarkMarkerPacking(length=10000000):
+    marker1 = (np.arange(0, length) % 250 < 50).astype(np.uint8)
+    marker2 = (np.arange(0, length) % 250 < 10).astype(np.uint8)
+    start = time.time()
+    legacy = np.array([[marker1[i], marker2[i]] for i in range(0, length)])
+    legacy = ((legacy[:, 0] & 0x1) << 6) | ((legacy[:, 1] & 0x1) << 7)
+    legacyTime = time.time() - start
+    start = time.time()
+    packed = AWG70002.packMarkers(marker1, marker2)
+    packedTime = time.time() - start
+    assert np.array_equal(legacy, packed)
+    print('{} samples: list of pairs {:.3f} s, packMarkers {:.3f} s'.format(length, legacyTime, packedTime))
+
+
 import math
 class AWGEncoder:
     def __init__(self):
@@ -694,8 +939,8 @@ RND_VP1 = 3
 import sys
 import os
 class AWGDev:
-    def __init__(self):
-        self.dev = AWG70002PM()
+    def __init__(self, dev=None):
+        self.dev = AWG70002PM() if dev is None else dev
         self.dev._stop()
         self.dataRoot = './'
         self.timeParameters = {
@@ -722,9 +967,12 @@ class AWGDev:
             'amplitutePM': 0,
         }
         self.rns = [0,1,2,3,8,9,10,11,12,13,14,15]*100
+        self.waveforms = {}
+        self.dirtyChannels = set(AWGWaveformCreator.ChannelNames)
 
     def setRandomNumbers(self, rns):
         self.rns = rns
+        self.dirtyChannels.update(AWGWaveformCreator.ChannelNames)
 
     def configure(self, key, value):
         if self.timeParameters.__contains__(key):
@@ -737,6 +985,8 @@ class AWGDev:
             raise RuntimeError('No such configuration.')
         oldValue = map[key]
         map[key] = value
+        if oldValue != value:
+            self.dirtyChannels.update(AWGWaveformCreator.Dependencies.get(key, AWGWaveformCreator.ChannelNames))
         return oldValue
 
     def getConfiguration(self, key):
@@ -750,62 +1000,30 @@ class AWGDev:
             raise RuntimeError('No such configuration.')
         return map[key]
 
+    # AWG waveform name, output channel, analog channel, marker 1 channel, marker 2 channel.
+    Outputs = [('Waveform1', 1, 'AMDecoy', 'Laser', 'Sync'), ('Waveform2', 2, 'PM', 'AMTime1', 'AMTime2')]
+
+    # Only the channels affected by parameters changed since the last call are regenerated and uploaded.
     def generateNewWaveform(self):
+        changed = set(self.dirtyChannels)
+        if len(changed) == 0:
+            return
         start = time.time()
-
-        rndFile = open('{}/RNDs'.format(self.dataRoot), 'wb')
-        rndFile.write(bytearray(self.rns))
-        rndFile.close()
-
-        parameters = []
-        for key in self.timeParameters.keys():
-            parameters.append('{}={}'.format(key, self.timeParameters[key] * 1e-9))
-        for key in self.modeParameters.keys():
-            if key.endswith('Mode'):
-                parameters.append('{}={}'.format(key, 'true' if self.modeParameters[key] else 'false'))
-            else:
-                parameters.append('{}={}'.format(key, self.modeParameters[key]))
-        for key in self.amplituteParameters.keys():
-            parameters.append('{}={}'.format(key, self.amplituteParameters[key]))
-        args = ' '.join(parameters)
-        os.system("\"C:\\Program Files (x86)\\Java\\jdk1.8.0_111\\bin\\java\" -jar awgwaveformcreator_2.12-0.1.0.jar {}".format(args))
-
-        waveformNames = 'AMDecoy', 'Laser', 'Sync', 'PM', 'AMTime1', 'AMTime2'
-        path = '{}/test.wave'.format(self.dataRoot)
-        fileSize = os.path.getsize(path)
-        waveformSize = int(fileSize / 6)
-        waveforms = {}
-        file = open(path, 'br')
-        for waveformName in waveformNames:
-            bytes = file.read(waveformSize)
-            waveforms[waveformName] = [b for b in bytes]
-
+        creator = AWGWaveformCreator(self.timeParameters, self.modeParameters, self.amplituteParameters)
+        self.waveforms.update(creator.createWaveforms(self.rns, changed))
         stop = time.time()
-        print('{} s!'.format(stop - start))
-
-        waveform1 = waveforms['AMDecoy' ]
-        waveform1 = [(w/128.0-1) for w in waveform1]
-        print("####",len(waveform1))
-        marker11 = waveforms['Laser']
-        marker12 = waveforms['Sync']
-        waveform2 = waveforms['PM']
-        waveform2 = [(w/128.0-1) for w in waveform2]
-        marker21 = waveforms['AMTime1']
-        marker22 = waveforms['AMTime2']
-
-        assert len(waveform1) == len(marker11)
-        assert len(waveform1) == len(marker12)
-        assert len(waveform2) == len(marker21)
-        assert len(waveform2) == len(marker22)
-        print('ready')
-        self.dev.writeWaveform("Waveform1", waveform1)
-        self.dev.addMarker('Waveform1', [[marker11[i], marker12[i]] for i in range(0, len(waveform1))])
-        self.dev.writeWaveform("Waveform2", waveform2)
-        self.dev.addMarker('Waveform2', [[marker21[i], marker22[i]] for i in range(0, len(waveform2))])
-        self.dev.assignOutput(1,"Waveform1")
-        self.dev.assignOutput(2,"Waveform2")
-        self.dev._setOutput(1, True)
-        self.dev._setOutput(2, True)
+        print('{} s! Regenerated {}.'.format(stop - start, ', '.join(sorted(changed))))
+
+        for name, channel, analog, marker1, marker2 in AWGDev.Outputs:
+            # writeWaveform recreates the waveform, so its markers have to be written again.
+            if changed.__contains__(analog):
+                self.dev.writeWaveform(name, self.waveforms[analog] / 128.0 - 1)
+            if len(changed.intersection([analog, marker1, marker2])) > 0:
+                self.dev.addMarker(name, self.waveforms[marker1], self.waveforms[marker2])
+            if changed.__contains__(analog):
+                self.dev.assignOutput(channel, name)
+                self.dev._setOutput(channel, True)
+        self.dirtyChannels.difference_update(changed)
 
     def startPlay(self):
         self.dev._start()
@@ -890,38 +1108,19 @@ if __name__ == "__main__2":
         print(args)
         os.system("\"C:\\Program Files (x86)\\Java\\jdk1.8.0_111\\bin\\java\" -jar awgwaveformcreator_2.12-0.1.0.jar {}".format(args))
 
-        waveformNames = 'AMDecoy', 'Laser', 'Sync', 'PM', 'AMTime1', 'AMTime2'
-        path = '{}/test.wave'.format(dataRoot)
-        fileSize = os.path.getsize(path)
-        waveformSize = int(fileSize / 6)
-        waveforms = {}
-        file = open(path, 'br')
-        for waveformName in waveformNames:
-            bytes = file.read(waveformSize)
-            waveforms[waveformName] = [b for b in bytes]
+        waveforms = WaveformBundle.loadLegacyWave('{}/test.wave'.format(dataRoot))
 
         stop = time.time()
         print('{} s!'.format(stop - start))
 
-        waveform1 = waveforms['AMDecoy' ]
-        waveform1 = [(w/128.0-1) for w in waveform1]
+        waveform1 = waveforms['AMDecoy'] / 128.0 - 1
         print("####",len(waveform1))
-        marker11 = waveforms['Laser']
-        marker12 = waveforms['Sync']
-        waveform2 = waveforms['PM']
-        waveform2 = [(w/128.0-1) for w in waveform2]
-        marker21 = waveforms['AMTime1']
-        marker22 = waveforms['AMTime2']
-
-        assert len(waveform1) == len(marker11)
-        assert len(waveform1) == len(marker12)
-        assert len(waveform2) == len(marker21)
-        assert len(waveform2) == len(marker22)
+        waveform2 = waveforms['PM'] / 128.0 - 1
         print('ready')
         dev.writeWaveform("Waveform1", waveform1)
-        dev.addMarker('Waveform1', [[marker11[i], marker12[i]] for i in range(0, len(waveform1))])
+        dev.addMarker('Waveform1', waveforms['Laser'], waveforms['Sync'])
         dev.writeWaveform("Waveform2", waveform2)
-        dev.addMarker('Waveform2', [[marker21[i], marker22[i]] for i in range(0, len(waveform2))])
+        dev.addMarker('Waveform2', waveforms['AMTime1'], waveforms['AMTime2'])
         dev.assignOutput(1,"Waveform1")
         dev.assignOutput(2,"Waveform2")
         dev._setOutput(1, True)
@@ -0,0 +1,106 @@
+__author__ = 'Hwaipy'
+
+import json
+import struct
+import numpy as np
+
+# A waveform bundle is a self-describing file of named channels:
+#   Magic (8 bytes), header length (uint32, little endian), header (UTF-8 JSON), padding, channel data.
+# The header holds the version, sample rate, parameters and, for each channel, its name, dtype (numpy dtype.str),
+# length and offset in the file. Channel data are aligned to Alignment bytes, so that each channel is decoded as a
+# NumPy view of one memory map of the file.
+Magic = b'PYDRAWFB'
+Version = 1
+Alignment = 64
+
+
+class WaveformBundle:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            prefix = file.read(len(Magic) + 4)
+            if len(prefix) < len(Magic) + 4 or prefix[:len(Magic)] != Magic:
+                raise RuntimeError('{} is not a waveform bundle.'.format(path))
+            headerLength = struct.unpack('<I', prefix[len(Magic):])[0]
+            header = json.loads(file.read(headerLength).decode('utf-8'))
+        if header['Version'] > Version:
+            raise RuntimeError('Waveform bundle version {} is not supported.'.format(header['Version']))
+        self.sampleRate = header['SampleRate']
+        self.parameters = header['Parameters']
+        self.channels = header['Channels']
+        self.channelNames = [channel['Name'] for channel in self.channels]
+        self.__map = np.memmap(path, dtype=np.uint8, mode='r')
+        self.__views = {}
+        for channel in self.channels:
+            dtype = np.dtype(channel['DType'])
+            data = self.__map[channel['Offset']:channel['Offset'] + channel['Length'] * dtype.itemsize]
+            self.__views[channel['Name']] = data.view(dtype)
+
+    def __getitem__(self, name):
+        return self.__views[name]
+
+    def __contains__(self, name):
+        return self.__views.__contains__(name)
+
+    def __len__(self):
+        return len(self.channels)
+
+    def waveforms(self):
+        return dict(self.__views)
+
+    def close(self):
+        self.__views = {}
+        self.__map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+# waveforms is a dict of name -> array. Channels are written in the order of channelNames if given.
+def saveBundle(path, waveforms, sampleRate, parameters={}, channelNames=None):
+    channelNames = list(waveforms.keys()) if channelNames is None else channelNames
+    arrays = [np.ascontiguousarray(waveforms[name]).reshape(-1) for name in channelNames]
+    channels = [{'Name': name, 'DType': array.dtype.str, 'Length': len(array), 'Offset': 0}
+                for name, array in zip(channelNames, arrays)]
+
+    def encodeHeader():
+        return json.dumps({'Version': Version, 'SampleRate': sampleRate, 'Parameters': parameters,
+                           'Channels': channels}).encode('utf-8')
+
+    # Offsets are written in the header, so the header is encoded until its length is stable.
+    headerLength = -1
+    header = encodeHeader()
+    while len(header) != headerLength:
+        headerLength = len(header)
+        offset = _align(len(Magic) + 4 + headerLength)
+        for channel, array in zip(channels, arrays):
+            channel['Offset'] = offset
+            offset = _align(offset + array.nbytes)
+        header = encodeHeader()
+    with open(path, 'wb') as file:
+        file.write(Magic)
+        file.write(struct.pack('<I', len(header)))
+        file.write(header)
+        for channel, array in zip(channels, arrays):
+            file.write(b'\0' * (channel['Offset'] - file.tell()))
+            array.tofile(file)
+
+
+def loadBundle(path):
+    return WaveformBundle(path)
+
+
+# The test.wave written by the Java AWGWaveformCreator: equal-size uint8 channels, concatenated in channelNames order.
+def loadLegacyWave(path, channelNames=('AMDecoy', 'Laser', 'Sync', 'PM', 'AMTime1', 'AMTime2')):
+    data = np.memmap(path, dtype=np.uint8, mode='r')
+    if len(data) % len(channelNames) != 0:
+        raise RuntimeError('Size of {} is not a multiple of {}.'.format(path, len(channelNames)))
+    data = data.reshape(len(channelNames), -1)
+    return {name: data[i] for i, name in enumerate(channelNames)}
+
+
+def _align(offset):
+    return (offset + Alignment - 1) // Alignment * Alignment
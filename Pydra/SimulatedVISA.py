@@ -0,0 +1,383 @@
+__author__ = 'Hwaipy'
+
+import random
+import re
+import threading
+import time
+from collections import deque
+import numpy as np
+import Instruments
+from SCPI import encodeBlock
+
+# In-memory VISA resources for testing VISAInstrument subclasses without hardware. A simulated resource is registered
+# with simulate(resourceID, script) and then opened by VISAInstrument like any VISA resource, e.g.
+#     simulate('SIM::34465A::1', KeySight34465AScript(noise=1e-6))
+#     dev = KeySight_MultiMeter_34465A('SIM::34465A::1')
+# The script answers the SCPI commands of one instrument model and keeps its state, so that it persists when the
+# resource is opened again. Every write (and query) costs latency seconds.
+Prefix = 'SIM::'
+_simulations = {}
+_lock = threading.Lock()
+
+
+def simulate(resourceID, script, latency=0.0):
+    if not resourceID.startswith(Prefix):
+        raise ValueError('Simulated resource ID should start with {}.'.format(Prefix))
+    with _lock:
+        _simulations[resourceID] = (script, latency)
+    return script
+
+
+def remove(resourceID=None):
+    with _lock:
+        if resourceID is None:
+            _simulations.clear()
+        else:
+            _simulations.pop(resourceID, None)
+
+
+def openSimulated(resourceID):
+    with _lock:
+        if not _simulations.__contains__(resourceID):
+            raise ValueError('No simulated resource {}.'.format(resourceID))
+        script, latency = _simulations[resourceID]
+    return SimulatedResource(resourceID, script, latency)
+
+
+def listSimulated():
+    with _lock:
+        return list(_simulations.keys())
+
+
+Instruments.registerTransport(Prefix, openSimulated, listSimulated)
+
+
+# Compiles a header pattern in the notation of SCPI manuals, e.g. '[SENSe:]VOLTage[:DC]:APERture?', where the lower
+# case letters are optional, [] marks optional nodes and # a numeric suffix.
+def compileHeader(pattern):
+    regex = ''
+    for token in re.findall(r'\[|\]|:|\?|\*?[A-Za-z]+#?', pattern):
+        if token == '[':
+            regex += '(?:'
+        elif token == ']':
+            regex += ')?'
+        elif token == ':':
+            regex += ':'
+        elif token == '?':
+            regex += r'\?'
+        else:
+            numbered = token.endswith('#')
+            token = token.rstrip('#')
+            forms = sorted({token.upper(), ''.join([c for c in token if not c.islower()])}, key=len, reverse=True)
+            regex += '(?:{})'.format('|'.join([re.escape(f) for f in forms])) + (r'(\d*)' if numbered else '')
+    return re.compile('^:?' + regex + '$')
+
+
+class SimulatedResource:
+    def __init__(self, resourceID, script, latency=0.0):
+        self.resource_name = resourceID
+        self.script = script
+        self.latency = latency
+        self.timeout = 2000
+        self.read_termination = '\n'
+        self.write_termination = '\n'
+        self.__output = b''
+
+    def write(self, message):
+        self.write_raw(message.encode('latin-1'))
+
+    def write_raw(self, message):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        responses = [self.script.execute(command) for command in SimulatedResource.splitCommands(message)]
+        responses = [r.encode('latin-1') if isinstance(r, str) else r for r in responses if r is not None]
+        if len(responses) > 0:
+            self.__output += b';'.join(responses) + b'\n'
+
+    def query(self, message):
+        self.write(message)
+        return self.read()
+
+    def read(self):
+        return self.read_raw().decode('latin-1')
+
+    def read_raw(self):
+        if not self.__output.__contains__(b'\n'):
+            raise RuntimeError('{}: Query UNTERMINATED, nothing to read.'.format(self.resource_name))
+        index = self.__output.index(b'\n') + 1
+        data, self.__output = self.__output[:index], self.__output[index:]
+        return data
+
+    def read_bytes(self, count):
+        if len(self.__output) < count:
+            raise RuntimeError('{}: Timeout, {} of {} bytes to read.'.format(self.resource_name, len(self.__output),
+                                                                            count))
+        data, self.__output = self.__output[:count], self.__output[count:]
+        return data
+
+    def close(self):
+        pass
+
+    # Splits a message into (header, args) of each ';' separated command. The arguments of commands with a binary
+    # block are not supported.
+    @classmethod
+    def splitCommands(cls, message):
+        commands = []
+        for command in re.findall(rb'(?:[^;"\']|"[^"]*"|\'[^\']*\')+', message.strip()):
+            command = command.decode('latin-1').strip()
+            if len(command) == 0:
+                continue
+            split = command.split(None, 1)
+            args = [] if len(split) == 1 else [a.strip() for a in re.findall(r'(?:[^,"]|"[^"]*")+', split[1])]
+            commands.append((split[0], args))
+        return commands
+
+
+# SCPI responses of one instrument model. Subclasses extend commands() with (pattern, handler(args, suffixes)).
+# Handlers return None, a str, or bytes (e.g. a binary block). Unknown commands raise RuntimeError.
+class SimulatedScript:
+    identity = 'USTC,VISAInstrument,SIM00001,1.0'
+
+    def __init__(self, noise=0.0):
+        self.noise = noise
+        self.lock = threading.RLock()
+        self.history = []
+        self.__commands = [(compileHeader(pattern), handler) for pattern, handler in self.commands()]
+
+    def commands(self):
+        return [('*IDN?', lambda args, n: self.identity),
+                ('*OPC?', lambda args, n: '1'),
+                ('*RST', lambda args, n: self.reset()),
+                ('*CLS', lambda args, n: None),
+                ('SYSTem:VERSion?', lambda args, n: '1999.0')]
+
+    def reset(self):
+        pass
+
+    def execute(self, command):
+        header, args = command
+        with self.lock:
+            self.history.append(header.lstrip(':'))
+            for regex, handler in self.__commands:
+                m = regex.match(header.upper())
+                if m is not None:
+                    return handler(args, [int(g) if len(g) > 0 else 1 for g in m.groups() if g is not None])
+        raise RuntimeError('Undefined header: {}'.format(header))
+
+    def noisy(self, value, count=None):
+        if count is None:
+            return value + random.gauss(0, self.noise) if self.noise > 0 else value
+        return value + (np.random.normal(0, self.noise, count) if self.noise > 0 else np.zeros(count))
+
+
+# Keysight 34465A. Readings are generated at one per aperture (or per sample timer, if the sample source is TIMer)
+# after the trigger, with values[function] + noise, into a reading memory of memorySize, where the oldest readings are
+# overwritten (and the overflow bit of the questionable status is set) when it is full.
+class KeySight34465AScript(SimulatedScript):
+    identity = 'Keysight Technologies,34465A,MY00000001,A.02.14-02.40-02.14-00.49-01-01'
+    memorySize = 50000
+    Infinite = 9.9e37
+
+    def __init__(self, noise=0.0, values=None):
+        super().__init__(noise)
+        self.values = {'VOLT': 1.0, 'CURR': 1e-3, 'RES': 1e3} if values is None else values
+        self.reset()
+
+    def reset(self):
+        self.function = 'VOLT'
+        self.range = 'AUTO'
+        self.aperture = 0.001
+        self.triggerSource = 'IMM'
+        self.triggerCount = 1
+        self.sampleCount = 1
+        self.sampleSource = 'IMM'
+        self.sampleTimer = 0.001
+        self.format = 'ASCII'
+        self.memory = deque()
+        self.overflow = False
+        # Time of the trigger, readings to take and taken, or None if idle.
+        self.acquisition = None
+        self.waitingForTrigger = False
+
+    def commands(self):
+        return super().commands() + [
+            ('CONFigure[:VOLTage][:DC]', lambda args, n: self.__configure('VOLT', args)),
+            ('CONFigure:CURRent[:DC]', lambda args, n: self.__configure('CURR', args)),
+            ('CONFigure:RESistance', lambda args, n: self.__configure('RES', args)),
+            ('[SENSe:]FUNCtion[:ON]?', lambda args, n: '"{}"'.format(self.function)),
+        ] + [(sense + suffix, handler) for sense in ['[SENSe:]VOLTage[:DC]', '[SENSe:]CURRent[:DC]',
+                                                       '[SENSe:]RESistance'] for suffix, handler in [
+            (':APERture', lambda args, n: self.__setAperture(args)),
+            (':APERture?', lambda args, n: '{:+.8E}'.format(self.aperture)),
+            (':RANGe', lambda args, n: setattr(self, 'range', args[0])),
+            (':RANGe?', lambda args, n: '{:+.8E}'.format(self.__range())),
+        ]] + [
+            ('TRIGger:SOURce', lambda args, n: setattr(self, 'triggerSource', args[0].upper()[:3])),
+            ('TRIGger:COUNt', lambda args, n: setattr(self, 'triggerCount', self.__count(args[0]))),
+            ('SAMPle:COUNt', lambda args, n: setattr(self, 'sampleCount', self.__count(args[0]))),
+            ('SAMPle:SOURce', lambda args, n: setattr(self, 'sampleSource', args[0].upper()[:3])),
+            ('SAMPle:TIMer', lambda args, n: setattr(self, 'sampleTimer', float(args[0]))),
+            ('FORMat[:DATA]', lambda args, n: setattr(self, 'format', args[0].upper()[:4])),
+            ('INITiate[:IMMediate]', lambda args, n: self.__initiate()),
+            ('*TRG', lambda args, n: self.__trigger()),
+            ('ABORt', lambda args, n: self.__abort()),
+            ('FETCh?', lambda args, n: self.__fetch()),
+            ('READ?', lambda args, n: self.__initiate() or self.__fetch()),
+            ('R?', lambda args, n: self.__remove(int(float(args[0])) if len(args) > 0 else None, True)),
+            ('DATA:REMove?', lambda args, n: self.__remove(int(float(args[0])), False,
+                                                            len(args) > 1 and args[1].upper() == 'WAIT')),
+            ('DATA:POINts?', lambda args, n: self.__update() or str(len(self.memory))),
+            ('STATus:QUEStionable[:EVENt]?', lambda args, n: self.__questionable()),
+        ]
+
+    def __configure(self, function, args):
+        self.__abort()
+        self.function = function
+        self.range = args[0] if len(args) > 0 else 'AUTO'
+        self.memory.clear()
+
+    # Autorange picks the lowest range that holds the value, with 20% over range.
+    def __range(self):
+        if self.range.upper().startswith('AUTO') or self.range.upper().startswith('DEF'):
+            ranges = {'VOLT': [0.1, 1.0, 10.0, 100.0, 1000.0], 'CURR': [1e-4, 1e-3, 1e-2, 0.1, 1.0, 3.0],
+                      'RES': [1e2, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8]}[self.function]
+            value = abs(self.values[self.function])
+            return next((r for r in ranges if value <= r * 1.2), ranges[-1])
+        return float(self.range)
+
+    def __setAperture(self, args):
+        self.aperture = float(args[0])
+
+    def __interval(self):
+        return max(self.aperture, self.sampleTimer) if self.sampleSource == 'TIM' else self.aperture
+
+    def __count(self, arg):
+        return KeySight34465AScript.Infinite if arg.upper().startswith('INF') else int(float(arg))
+
+    def __initiate(self):
+        self.memory.clear()
+        self.acquisition = None
+        self.waitingForTrigger = True
+        if self.triggerSource == 'IMM':
+            self.__trigger()
+
+    def __trigger(self):
+        if self.waitingForTrigger:
+            self.waitingForTrigger = False
+            self.acquisition = [time.time(), self.sampleCount * self.triggerCount, 0]
+
+    def __abort(self):
+        self.__update()
+        self.acquisition = None
+        self.waitingForTrigger = False
+
+    def __update(self):
+        if self.acquisition is None:
+            return
+        start, total, taken = self.acquisition
+        count = int(min(total, (time.time() - start) / self.__interval())) - taken
+        if count <= 0:
+            return
+        readings = self.noisy(self.values[self.function], count)
+        overflow = len(self.memory) + count - self.memorySize
+        if overflow > 0:
+            self.overflow = True
+            for i in range(0, min(overflow, len(self.memory))):
+                self.memory.popleft()
+            readings = readings[-self.memorySize:]
+        self.memory.extend(readings.tolist())
+        self.acquisition[2] += count
+        if self.acquisition[2] >= total:
+            self.acquisition = None
+
+    # Waits (holding the instrument, as the bus would be) until the acquisition is complete.
+    def __fetch(self):
+        if self.acquisition is not None:
+            start, total, taken = self.acquisition
+            if total >= KeySight34465AScript.Infinite:
+                raise RuntimeError('Fetch of an infinite acquisition.')
+            time.sleep(max(0, start + total * self.__interval() - time.time()))
+        self.__update()
+        return self.__format(list(self.memory))
+
+    def __remove(self, count, block, wait=False):
+        self.__update()
+        if wait:
+            while len(self.memory) < count and self.acquisition is not None:
+                time.sleep(self.__interval())
+                self.__update()
+        if count is None:
+            count = len(self.memory)
+        elif count > len(self.memory) and not block:
+            raise RuntimeError('Data out of range: {} of {} readings.'.format(count, len(self.memory)))
+        readings = [self.memory.popleft() for i in range(0, min(count, len(self.memory)))]
+        if block and self.format == 'ASCI':
+            return encodeBlock(np.frombuffer(self.__format(readings).encode('ascii'), dtype=np.uint8))
+        return self.__format(readings)
+
+    def __format(self, readings):
+        if self.format == 'REAL':
+            return encodeBlock(np.array(readings, dtype='>f8'))
+        return ','.join(['{:+.15E}'.format(r) for r in readings])
+
+    def __questionable(self):
+        self.__update()
+        event = 0x4000 if self.overflow else 0
+        self.overflow = False
+        return str(event)
+
+
+class KeySight34470AScript(KeySight34465AScript):
+    identity = 'Keysight Technologies,34470A,MY00000002,A.02.14-02.40-02.14-00.49-01-01'
+    memorySize = 2000000
+
+
+# ITECH IT6322 triple-channel power supply. Measured voltages are the setpoints of the outputs that are on (with
+# noise), and measured currents are voltages / loads, limited by the current setpoints.
+class IT6322Script(SimulatedScript):
+    identity = 'ITECH Ltd., IT6322, 600000000000000000, 1.11-1.08'
+
+    def __init__(self, noise=0.0, loads=(50.0, 50.0, 50.0)):
+        super().__init__(noise)
+        self.loads = list(loads)
+        self.reset()
+
+    def reset(self):
+        self.voltages = [0.0, 0.0, 0.0]
+        self.currents = [3.0, 3.0, 3.0]
+        self.outputs = [False, False, False]
+        self.channel = 0
+        self.remote = False
+
+    def commands(self):
+        return super().commands() + [
+            ('SYSTem:REMote', lambda args, n: setattr(self, 'remote', True)),
+            ('SYSTem:BEEPer', lambda args, n: None),
+            ('INSTrument:NSELect', lambda args, n: setattr(self, 'channel', int(args[0]) - 1)),
+            ('[SOURce:]VOLTage', lambda args, n: self.voltages.__setitem__(self.channel, self.__value(args[0], 'V'))),
+            ('[SOURce:]CURRent', lambda args, n: self.currents.__setitem__(self.channel, self.__value(args[0], 'A'))),
+            ('OUTPut', lambda args, n: self.outputs.__setitem__(self.channel, args[0].upper() in ['1', 'ON'])),
+            ('APPly:VOLTage', lambda args, n: self.__setAll(self.voltages, args, float)),
+            ('APPly:CURRent', lambda args, n: self.__setAll(self.currents, args, float)),
+            ('APPly:OUTput', lambda args, n: self.__setAll(self.outputs, args, lambda a: int(a) > 0)),
+            ('APPly:VOLTage?', lambda args, n: ', '.join(['{:.4f}'.format(v) for v in self.voltages])),
+            ('APPly:CURRent?', lambda args, n: ', '.join(['{:.4f}'.format(c) for c in self.currents])),
+            ('APPly:OUTput?', lambda args, n: ', '.join(['1' if o else '0' for o in self.outputs])),
+            ('MEASure:VOLTage:ALL?', lambda args, n: ', '.join(['{:.4f}'.format(v) for v in self.__measure()[0]])),
+            ('MEASure:CURRent:ALL?', lambda args, n: ', '.join(['{:.4f}'.format(c) for c in self.__measure()[1]])),
+        ]
+
+    def __value(self, arg, unit):
+        return float(arg.upper().rstrip(unit))
+
+    def __setAll(self, values, args, converter):
+        for i in range(0, len(values)):
+            values[i] = converter(args[i])
+
+    def __measure(self):
+        voltages, currents = [], []
+        for v, limit, on, load in zip(self.voltages, self.currents, self.outputs, self.loads):
+            current = min(v / load, limit) if on else 0.0
+            voltages.append(self.noisy(current * load) if on else 0.0)
+            currents.append(self.noisy(current) if on else 0.0)
+        return voltages, currents
@@ -1,5 +1,7 @@
 __author__ = 'Hwaipy'
 
+import collections
+import concurrent.futures
 import queue
 import threading
 import time
@@ -71,34 +73,136 @@ class BlockingCommunicator(Communicator):
         return self.dataQueue.get()
 
 
+# Runs actions on one thread, e.g. the I/O of an instrument. Actions are taken in order of priority, and in
+# submission order within a priority: interactive actions (the default) overtake the queued bulk transfers, but never
+# each other, so that a query still sees the effect of the writes before it. Consecutive writes submitted by
+# writeLater are coalesced into one call.
 class SingleThreadProcessor:
+    PriorityInteractive = 0
+    PriorityBulk = 1
+
     def __init__(self):
-        self.queue = queue.Queue()
+        self.__queues = [collections.deque() for p in range(0, SingleThreadProcessor.PriorityBulk + 1)]
+        self.__condition = threading.Condition()
+        self.__depth = 0
+        self.__metrics = {'Tasks': 0, 'Coalesced': 0, 'MaxDepth': 0, 'WaitTime': 0.0, 'ServiceTime': 0.0,
+                          'MaxServiceTime': 0.0}
         threading.Thread(target=self.__loop, name='SingleTreadProcessorThread-{}'.format(time.time()),
                          daemon=True).start()
 
     def invokeLater(self, action, *args, **kwargs):
-        self.queue.put((action, args, kwargs, None, [None, None]))
+        self.submit(SingleThreadProcessor.PriorityInteractive, action, *args, **kwargs)
 
     def invokeAndWait(self, action, *args, **kwargs):
-        semaphore = threading.Semaphore(0)
-        result = [None, None]
-        self.queue.put((action, args, kwargs, semaphore, result))
-        semaphore.acquire()
-        if result[1] is not None:
-            raise result[1]
-        return result[0]
+        return self.submit(SingleThreadProcessor.PriorityInteractive, action, *args, **kwargs).result()
+
+    # Returns a concurrent.futures.Future of the result of action.
+    def submit(self, priority, action, *args, **kwargs):
+        future = concurrent.futures.Future()
+        self.__put(priority, [action, args, kwargs, future, None, time.time()])
+        return future
+
+    # Consecutive writeLater of the same action (and priority) are sent as action(joiner(messages)), as long as the
+    # joined messages are not longer than maxLength.
+    def writeLater(self, action, message, joiner, maxLength=4096, priority=PriorityInteractive):
+        self.__put(priority, [action, (message,), {}, None, (joiner, maxLength), time.time()])
+
+    def __put(self, priority, task):
+        with self.__condition:
+            self.__queues[priority].append(task)
+            self.__depth += 1
+            self.__metrics['MaxDepth'] = max(self.__metrics['MaxDepth'], self.__depth)
+            self.__condition.notify()
+
+    def __take(self):
+        with self.__condition:
+            while self.__depth == 0:
+                self.__condition.wait()
+            tasks = next(q for q in self.__queues if len(q) > 0)
+            task = tasks.popleft()
+            self.__depth -= 1
+            if task[4] is not None:
+                action, messages, length = task[0], [task[1][0]], len(task[1][0])
+                joiner, maxLength = task[4]
+                while len(tasks) > 0 and tasks[0][0] == action and tasks[0][4] == task[4] and (
+                        length + 2 + len(tasks[0][1][0]) <= maxLength):
+                    message = tasks.popleft()[1][0]
+                    self.__depth -= 1
+                    messages.append(message)
+                    length += 2 + len(message)
+                if len(messages) > 1:
+                    self.__metrics['Coalesced'] += len(messages) - 1
+                    task = [action, (joiner(messages),), {}, None, None, task[5]]
+            return task
 
     def __loop(self):
         while True:
-            action, args, kwargs, semaphore, result = self.queue.get()
-            try:
-                ret = action(*args, **kwargs)
-                result[0] = ret
-            except BaseException as e:
-                result[1] = e
-            if semaphore is not None:
-                semaphore.release()
+            action, args, kwargs, future, coalesce, submitTime = self.__take()
+            startTime = time.time()
+            if future is None or future.set_running_or_notify_cancel():
+                try:
+                    ret = action(*args, **kwargs)
+                    if future is not None:
+                        future.set_result(ret)
+                except BaseException as e:
+                    if future is not None:
+                        future.set_exception(e)
+            serviceTime = time.time() - startTime
+            with self.__condition:
+                self.__metrics['Tasks'] += 1
+                self.__metrics['WaitTime'] += startTime - submitTime
+                self.__metrics['ServiceTime'] += serviceTime
+                self.__metrics['MaxServiceTime'] = max(self.__metrics['MaxServiceTime'], serviceTime)
+
+    # Queue depth, and the mean wait and service times (in s) of the executed tasks.
+    def metrics(self):
+        with self.__condition:
+            metrics = dict(self.__metrics)
+            metrics['Depth'] = self.__depth
+        tasks = max(metrics['Tasks'], 1)
+        metrics['MeanWaitTime'] = metrics['WaitTime'] / tasks
+        metrics['MeanServiceTime'] = metrics['ServiceTime'] / tasks
+        return metrics
+
+
+# A reentrant lock taken in the order of request (a ticket lock), so that no thread waits behind later comers.
+class FairLock:
+    def __init__(self):
+        self.__condition = threading.Condition()
+        self.__nextTicket = 0
+        self.__serving = 0
+        self.__owner = None
+        self.__count = 0
+
+    def acquire(self):
+        me = threading.get_ident()
+        with self.__condition:
+            if self.__owner == me:
+                self.__count += 1
+                return
+            ticket = self.__nextTicket
+            self.__nextTicket += 1
+            while ticket != self.__serving:
+                self.__condition.wait()
+            self.__owner = me
+            self.__count = 1
+
+    def release(self):
+        with self.__condition:
+            if self.__owner != threading.get_ident():
+                raise RuntimeError('FairLock released by a thread that does not own it.')
+            self.__count -= 1
+            if self.__count == 0:
+                self.__owner = None
+                self.__serving += 1
+                self.__condition.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.release()
 
 
 class SingleThreadWarpper:
@@ -1,5 +1,9 @@
 import math
 import array
+import time
+import numpy as np
+from Services.WaveformGenerator import PulseTemplates
+from Services.WaveformGenerator import WaveformBundle
 
 
 class AWGEncoder:
@@ -16,6 +20,7 @@ class AWGEncoder:
         self.pulseDiff = 3e-9
         self.delays = {'AMDecoy': 0, 'AMTime1': 0, 'AMTime2': 0, 'PM': 0, 'Laser': 0, 'Sync': 0}
         self.enable = {'AMDecoy': True, 'AMTime1': True, 'AMTime2': True, 'PM': True, 'Laser': True, 'Sync': True}
+        self.templateLibrary = PulseTemplates.DefaultLibrary
 
     # Defination of Random Number:
     # parameter ``randomNumbers'' should be a list of RN
@@ -24,14 +29,14 @@ class AWGEncoder:
     # The second element (0, 1) represent for basis (Time, Phase)
     # The third element (0, 1) represent for encoding (0, 1)
     def generateWaveforms(self, randomNumbers):
-        return {
-            'AMDecoy': self._generateWaveform(randomNumbers, self._decoyWaveformAmp, 'AMDecoy'),
-            'AMTime1': self._generateWaveform(randomNumbers, self._timeWaveformAmp, 'AMTime1'),
-            'AMTime2': self._generateWaveform(randomNumbers, self._timeWaveformAmp, 'AMTime2'),
-            'PM': self._generateWaveform(randomNumbers, self._phaseWaveformAmp, 'PM'),
-            'Laser': self._generateWaveform(randomNumbers, self._laserWaveformAmp, 'Laser'),
-            'Sync': self._generateWaveform(randomNumbers, self._syncWaveformAmp, 'Sync')
-        }
+        return self._generateWaveforms(randomNumbers, {
+            'AMDecoy': self._decoyWaveformAmp,
+            'AMTime1': self._timeWaveformAmp,
+            'AMTime2': self._timeWaveformAmp,
+            'PM': self._phaseWaveformAmp,
+            'Laser': self._laserWaveformAmp,
+            'Sync': self._syncWaveformAmp
+        })
 
     # Marker, 1 bit
     def _laserWaveformAmp(self, timeInPulse, pulseIndex, randomNumber):
@@ -78,7 +83,100 @@ class AWGEncoder:
     def _syncWaveformAmp(self, timeInPulse, pulseIndex, randomNumber):
         return 1 if pulseIndex <= 5 else 0
 
+    # Pulses whose waveform depends on pulseIndex and not only on the random number.
+    HeadPulses = {'Laser': 1, 'Sync': 6}
+    ChunkSize = 1 << 22
+
+    # Every amp function above is piecewise constant in timeInPulse between the thresholds below, and is tabulated
+    # per random-number class with one value per bucket (below, equal to, or between thresholds). timeInPulse and
+    # pulseIndex of a sample are computed with exactly the same float operations as _generateWaveformPerSample, so
+    # the output is identical to it, including samples near pulse boundaries.
+    # If every pulse has the same number of samples, the waveform is concatenated from per-pulse templates of the
+    # template library, and only the samples where float rounding may matter are computed per sample.
     def _generateWaveform(self, randomNumbers, amp, name):
+        return self._generateWaveforms(randomNumbers, {name: amp})[name]
+
+    def _generateWaveforms(self, randomNumbers, amps):
+        sampleCount = int(len(randomNumbers) * self.period * self.sampleRate)
+        thresholds = np.array(sorted({0.0, self.pulseWidth, self.pulseDiff, self.pulseDiff + self.pulseWidth}))
+        classes = {}
+        classIndices = np.empty(len(randomNumbers), dtype=np.int64)
+        for i in range(0, len(randomNumbers)):
+            classIndices[i] = classes.setdefault(tuple(randomNumbers[i]), len(classes))
+        bucketTimes = self._bucketTimes(thresholds)
+        bucketTemplates = {}
+        for name in amps.keys():
+            template = np.array([amp for rn in classes.keys() for amp in
+                                 [amps[name](t, AWGEncoder.HeadPulses.get(name, 0), list(rn)) for t in bucketTimes]])
+            if template.dtype.kind in 'iub' or template.size == 0:
+                template = template.astype(np.int8)
+            bucketTemplates[name] = template
+
+        def grid(indices):
+            times = indices / self.sampleRate
+            pulseIndices = (times / self.period).astype(np.int64)
+            timesInPulse = times % self.period
+            k = np.searchsorted(thresholds, timesInPulse, side='right')
+            keys = classIndices[pulseIndices] * len(bucketTimes) + 2 * k - (
+                timesInPulse == thresholds[np.maximum(k - 1, 0)])
+            return pulseIndices, timesInPulse, keys
+
+        def evaluate(name, sampleGrid):
+            pulseIndices, timesInPulse, keys = sampleGrid
+            values = np.take(bucketTemplates[name], keys)
+            for h in np.nonzero(pulseIndices < AWGEncoder.HeadPulses.get(name, 0))[0]:
+                values[h] = amps[name](timesInPulse[h], int(pulseIndices[h]), randomNumbers[pulseIndices[h]])
+            return values
+
+        waveforms = {}
+        samples = PulseTemplates.samplesPerPulse(len(randomNumbers), self.period, self.sampleRate, sampleCount)
+        if samples is None:
+            for name in amps.keys():
+                waveforms[name] = np.zeros(sampleCount, dtype=bucketTemplates[name].dtype)
+            for start in range(0, sampleCount, AWGEncoder.ChunkSize):
+                stop = min(start + AWGEncoder.ChunkSize, sampleCount)
+                sampleGrid = grid(np.arange(start, stop))
+                for name in amps.keys():
+                    waveforms[name][start:stop] = evaluate(name, sampleGrid)
+        else:
+            columns = PulseTemplates.sensitiveColumns(samples, self.sampleRate, self.period, thresholds)
+            for name in amps.keys():
+                table = np.array([self._pulseTemplate(amps[name], name, rn, samples) for rn in classes.keys()],
+                                 dtype=bucketTemplates[name].dtype).reshape(len(classes), samples)
+                waveforms[name] = PulseTemplates.tilePulses(table, classIndices, columns,
+                                                            AWGEncoder.HeadPulses.get(name, 0),
+                                                            lambda indices: evaluate(name, grid(indices)),
+                                                            sampleCount)
+        for name in amps.keys():
+            if not self.enable[name]:
+                waveforms[name][:] = 0
+                continue
+            delaySample = -math.floor(self.delays[name] * self.sampleRate + 0.5)
+            # Same as wf[delaySample:] + wf[:delaySample], which leaves wf unchanged when the delay exceeds its length.
+            if abs(delaySample) <= sampleCount:
+                waveforms[name] = np.roll(waveforms[name], -delaySample)
+        return waveforms
+
+    # One pulse of random number class ``rn'' on the ideal sample grid, away from the first pulses.
+    def _pulseTemplate(self, amp, name, rn, samples):
+        headPulses = AWGEncoder.HeadPulses.get(name, 0)
+        parameters = (self.period, self.pulseWidth, self.pulseDiff, self.ampSignalTime, self.ampSignalPhase,
+                      self.ampDecoyTime, self.ampDecoyPhase, self.firstPulseMode, headPulses)
+        return self.templateLibrary.template('AWGEncoder.{}'.format(amp.__name__), rn, self.sampleRate, parameters,
+                                             lambda: np.array([amp(j / self.sampleRate, headPulses, list(rn))
+                                                               for j in range(0, samples)]))
+
+    # Representative timeInPulse of each bucket: below thresholds[0], at thresholds[0], between thresholds[0] and
+    # thresholds[1], at thresholds[1], ..., above thresholds[-1].
+    def _bucketTimes(self, thresholds):
+        times = [thresholds[0] - self.period]
+        for i in range(0, len(thresholds)):
+            times.append(thresholds[i])
+            times.append((thresholds[i] + thresholds[i + 1]) / 2 if i + 1 < len(thresholds) else thresholds[i] + self.period)
+        return times
+
+    # The original per-sample implementation. Kept as the reference for tests and benchmark.
+    def _generateWaveformPerSample(self, randomNumbers, amp, name):
         wf = [amp((i / self.sampleRate) % self.period, int(i / self.sampleRate / self.period),
                   randomNumbers[int(i / self.sampleRate / self.period)]) for i in
               range(0, int(len(randomNumbers) * self.period * self.sampleRate))]
@@ -86,7 +184,28 @@ class AWGEncoder:
         if not self.enable[name]:
             return [0 for w in wf]
         return wf[delaySample:] + wf[:delaySample]
-        return ''
+
+
+def benchmark(lengths=(100, 1000, 10000, 100000), referenceLimit=10000):
+    encoder = AWGEncoder()
+    rnClasses = [[a, b, c] for a in range(0, 3) for b in range(0, 2) for c in range(0, 2)]
+    amps = {'AMDecoy': encoder._decoyWaveformAmp, 'AMTime1': encoder._timeWaveformAmp,
+            'AMTime2': encoder._timeWaveformAmp, 'PM': encoder._phaseWaveformAmp,
+            'Laser': encoder._laserWaveformAmp, 'Sync': encoder._syncWaveformAmp}
+    for length in lengths:
+        randomNumbers = [rnClasses[i] for i in np.random.randint(0, len(rnClasses), length)]
+        start = time.time()
+        encoder.generateWaveforms(randomNumbers)
+        vectorized = time.time() - start
+        if length > referenceLimit:
+            print('{:>8} pulses: vectorized {:.3f} s'.format(length, vectorized))
+            continue
+        start = time.time()
+        for name in amps.keys():
+            encoder._generateWaveformPerSample(randomNumbers, amps[name], name)
+        perSample = time.time() - start
+        print('{:>8} pulses: vectorized {:.3f} s, per sample {:.3f} s, {:.1f}x'.format(
+            length, vectorized, perSample, perSample / vectorized))
 
 
 RND_ST0 = 12
@@ -103,8 +222,12 @@ RND_VP0 = 2
 RND_VP1 = 3
 
 if __name__ == '__main__':
-    import time
     import os
+    import sys
+
+    if sys.argv[1:] == ['benchmark']:
+        benchmark()
+        sys.exit(0)
 
     start = time.time()
 
@@ -153,15 +276,7 @@ if __name__ == '__main__':
     print(args)
     os.system("java -jar awgwaveformcreator_2.12-0.1.0.jar {}".format(args))
 
-    waveformNames = 'AMDecoy', 'Laser', 'Sync', 'PM', 'AMTime1', 'AMTime2'
-    path = '{}/test.wave'.format(dataRoot)
-    fileSize = os.path.getsize(path)
-    waveformSize = int(fileSize / 6)
-    waveforms = {}
-    file = open(path, 'br')
-    for waveformName in waveformNames:
-        bytes = file.read(waveformSize)
-        waveforms[waveformName] = [b for b in bytes]
+    waveforms = WaveformBundle.loadLegacyWave('{}/test.wave'.format(dataRoot))
 
     stop = time.time()
     print('{} s!'.format(stop - start))
@@ -174,5 +289,5 @@ if __name__ == '__main__':
     # wf = waveforms['PM']
     # wf = waveforms['AMTime1']
     # wf = waveforms['AMTime2']
-    plt.plot([i / 25.0 for i in range(0, len(wf))], wf)
+    plt.plot(np.arange(0, len(wf)) / 25.0, wf)
     plt.show()
@@ -1,5 +1,6 @@
 import Pydra
 import time
+from Services.Storage import StorageService, FSFrameDecoder
 
 class ExperimentControl:
     def __init__(self):
@@ -7,29 +8,27 @@ class ExperimentControl:
         self.currentTDCReportSize = -1
 
     def getCurrentTDCReport(self, timeout = 5):
-        storage = self.session.blockingInvoker("StorageService")
+        storage = StorageService(self.session)
         path = '/test/tdc/mdireport.fs'
+        if self.currentTDCReportSize == -1:
+            self.currentTDCReportSize = int(storage.metaData(path, False)['Size'])
         startTime = time.time()
         while True:
-            currentSize = int(storage.metaData("", path, False)['Size'])
-            if self.currentTDCReportSize == -1:
+            if timeout <= 0:
+                waitTime = 10
+            else:
+                waitTime = timeout - (time.time() - startTime)
+                if waitTime <= 0:
+                    return None
+            currentSize = int(storage.waitForUpdate(path, self.currentTDCReportSize, waitTime)['Size'])
+            if currentSize != self.currentTDCReportSize:
                 self.currentTDCReportSize = currentSize
-                continue
-            if self.currentTDCReportSize >= currentSize:
-                if timeout <= 0:
-                    time.sleep(0.3)
-                    continue
-                else:
-                    timePass = time.time() - startTime
-                    if timePass > timeout:
-                        return None
-            else: break
-
-        frameBytes = storage.FSFileReadTailFrames("", path, 0, 1)
-
-
-        # val mg = new MessageGenerator()
-        # mg.feed(frameBytes)
+                break
+
+        frames = storage.getElement(path).toFSFileElement().readTailFrames(0, 1)
+        if len(frames) == 0:
+            return None
+        return FSFrameDecoder.unpack(frames[0])
 
     def stop(self):
         self.session.stop()
@@ -0,0 +1,66 @@
+__author__ = 'Hwaipy'
+
+import random
+import unittest
+import numpy as np
+from soap.MDIQKD.AWGEncoder import AWGEncoder
+
+
+class AWGEncoderTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        pass
+
+    def setUp(self):
+        random.seed(1)
+        rnClasses = [[a, b, c] for a in range(0, 3) for b in range(0, 2) for c in range(0, 2)]
+        self.randomNumbers = [random.choice(rnClasses) for i in range(0, 400)]
+
+    def assertIdentical(self, encoder, randomNumbers):
+        amps = {'AMDecoy': encoder._decoyWaveformAmp, 'AMTime1': encoder._timeWaveformAmp,
+                'AMTime2': encoder._timeWaveformAmp, 'PM': encoder._phaseWaveformAmp,
+                'Laser': encoder._laserWaveformAmp, 'Sync': encoder._syncWaveformAmp}
+        waveforms = encoder.generateWaveforms(randomNumbers)
+        for name in amps.keys():
+            expected = encoder._generateWaveformPerSample(randomNumbers, amps[name], name)
+            self.assertEqual(len(waveforms[name]), len(expected))
+            self.assertTrue(np.array_equal(waveforms[name], np.array(expected)), name)
+
+    def testDefault(self):
+        self.assertIdentical(AWGEncoder(), self.randomNumbers)
+
+    def testDelaysAndModes(self):
+        encoder = AWGEncoder()
+        encoder.delays = {'AMDecoy': -112.06e-9, 'AMTime1': -30.2e-9, 'AMTime2': 20.08e-9, 'PM': 1e-3,
+                          'Laser': 3.33e-9, 'Sync': -1e-3}
+        encoder.firstPulseMode = True
+        encoder.enable['PM'] = False
+        self.assertIdentical(encoder, self.randomNumbers)
+
+    def testIrregularTiming(self):
+        encoder = AWGEncoder()
+        encoder.sampleRate = 24.7e9
+        encoder.repetationRate = 99.3e6
+        encoder.period = 1 / encoder.repetationRate
+        encoder.pulseWidth = 2.5e-9
+        encoder.pulseDiff = 3.11e-9
+        self.assertIdentical(encoder, self.randomNumbers)
+        self.assertIdentical(encoder, [[2, 0, 0]])
+        self.assertIdentical(encoder, [])
+
+    def testTruncatedLastPulse(self):
+        encoder = AWGEncoder()
+        self.assertEqual(int(59 * encoder.period * encoder.sampleRate), 59 * 250 - 1)
+        self.assertIdentical(encoder, self.randomNumbers[:59])
+        self.assertIdentical(encoder, self.randomNumbers[:1])
+
+    def tearDown(self):
+        pass
+
+    @classmethod
+    def tearDownClass(cls):
+        pass
+
+
+if __name__ == '__main__':
+    unittest.main()
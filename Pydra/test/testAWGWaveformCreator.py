@@ -0,0 +1,152 @@
+__author__ = 'Hwaipy'
+
+import math
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from Services.WaveformGenerator.AWGWaveformCreator import AWGWaveformCreator
+
+
+# Per-sample transliteration of AWGWaveformCreator.scala, as the reference.
+def referenceWaveform(c, randomNumbers, name):
+    def amplitude(rn, t, p):
+        isVacuum, isSignal, isTime, encode = (rn & 0x8) == 0, (rn & 0x4) > 0, (rn & 0x2) > 0, rn & 0x1
+        inPulse1 = (t >= 0) and (t < c.pulseWidth)
+        inPulse2 = (t >= c.interferometerDiff) and (t < c.interferometerDiff + c.pulseWidth)
+        if name == 'Laser':
+            if c.firstLaserPulseMode and p > 0: return 0
+            if c.specifiedRandomNumberMode and rn != c.specifiedRandomNumber: return 0
+            return 1 if (t <= c.laserPulseWidth) and ((not c.firstLaserPulseMode) or p == 0) else 0
+        if c.firstModulationPulseMode and p > 0: return 0
+        if name == 'Sync': return 1 if p < 10 else 0
+        if name == 'AMDecoy':
+            if t > c.pulseWidth or isVacuum: return 0
+            if isSignal: return c.ampSignalTime if isTime else c.ampSignalPhase
+            return c.ampDecoyTime if isTime else c.ampDecoyPhase
+        if name == 'PM': return c.ampPM if inPulse1 and encode == 0 and not isVacuum and not isTime else 0
+        if (not inPulse1) and (not inPulse2): return 0
+        if isVacuum: return 0
+        if not isTime: return 1
+        if encode == 0: return 1 if inPulse1 else 0
+        return 1 if inPulse2 else 0
+
+    delaySample = -math.floor(c.delays[name] * c.sampleRate + 0.5)
+    totalSample = int(len(randomNumbers) * c.period * c.sampleRate)
+    result = []
+    for i in range(0, totalSample):
+        iSample = (i + delaySample + totalSample) % totalSample
+        pulseIndex = int(iSample / c.sampleRate / c.period)
+        timeInPulse = iSample / c.sampleRate - c.period * pulseIndex
+        result.append(amplitude(randomNumbers[pulseIndex], timeInPulse, pulseIndex))
+    return result
+
+
+class AWGWaveformCreatorTest(unittest.TestCase):
+    timeParameters = {'delayAMDecoy': -112.06, 'delaySync': 3, 'delayLaser': -125.34, 'delayPM': 0,
+                      'delayAMTime1': -30.20, 'delayAMTime2': -20.08, 'pulseWidth': 2, 'laserPulseWidth': 3.2,
+                      'interferometerDiff': 3.11}
+    amplituteParameters = {'amplituteSignalTime': 1, 'amplituteSignalPhase': 0.05, 'amplituteDecoyTime': -0.35,
+                           'amplituteDecoyPhase': -0.6, 'amplitutePM': 0}
+
+    @classmethod
+    def setUpClass(cls):
+        pass
+
+    def setUp(self):
+        random.seed(1)
+        self.randomNumbers = [random.choice([0, 1, 2, 3, 8, 9, 10, 11, 12, 13, 14, 15]) for i in range(0, 300)]
+
+    def assertIdentical(self, creator):
+        waveforms = creator.createWaveforms(self.randomNumbers)
+        for name in AWGWaveformCreator.ChannelNames:
+            self.assertEqual(waveforms[name].dtype, np.uint8)
+            self.assertEqual(waveforms[name].tolist(), referenceWaveform(creator, self.randomNumbers, name), name)
+
+    def testParameters(self):
+        creator = AWGWaveformCreator(AWGWaveformCreatorTest.timeParameters, {},
+                                     AWGWaveformCreatorTest.amplituteParameters)
+        self.assertEqual(creator.delays['Laser'], -125.34e-9)
+        self.assertEqual([creator.ampSignalTime, creator.ampSignalPhase, creator.ampDecoyTime,
+                          creator.ampDecoyPhase, creator.ampPM], [255, 134, 83, 51, 127])
+        self.assertEqual(AWGWaveformCreator.toByte(-1.5), 193)
+
+    def testWaveforms(self):
+        self.assertIdentical(AWGWaveformCreator())
+        self.assertIdentical(AWGWaveformCreator(AWGWaveformCreatorTest.timeParameters, {},
+                                                AWGWaveformCreatorTest.amplituteParameters))
+
+    def testModes(self):
+        self.assertIdentical(AWGWaveformCreator(AWGWaveformCreatorTest.timeParameters,
+                                                {'firstLaserPulseMode': True, 'firstModulationPulseMode': True},
+                                                AWGWaveformCreatorTest.amplituteParameters))
+        self.assertIdentical(AWGWaveformCreator(AWGWaveformCreatorTest.timeParameters,
+                                                {'specifiedRandomNumberMode': True, 'specifiedRandomNumber': 11},
+                                                AWGWaveformCreatorTest.amplituteParameters))
+
+    def testIrregularGrid(self):
+        creator = AWGWaveformCreator(AWGWaveformCreatorTest.timeParameters, {},
+                                     AWGWaveformCreatorTest.amplituteParameters)
+        self.randomNumbers = self.randomNumbers[:59]
+        self.assertEqual(int(59 * creator.period * creator.sampleRate), 59 * 250 - 1)
+        self.assertIdentical(creator)
+        creator.sampleRate = 24.7e9
+        creator.pulseWidth = 2.02e-9
+        self.assertIdentical(creator)
+
+    def testPartialChannels(self):
+        creator = AWGWaveformCreator(AWGWaveformCreatorTest.timeParameters, {},
+                                     AWGWaveformCreatorTest.amplituteParameters)
+        waveforms = creator.createWaveforms(self.randomNumbers)
+        partial = creator.createWaveforms(self.randomNumbers, ['AMTime2', 'PM'])
+        self.assertEqual(sorted(partial.keys()), ['AMTime2', 'PM'])
+        self.assertTrue(np.array_equal(partial['AMTime2'], waveforms['AMTime2']))
+        self.assertTrue(np.array_equal(partial['PM'], waveforms['PM']))
+
+    def testDependencies(self):
+        modeParameters = {'firstLaserPulseMode': False, 'firstModulationPulseMode': False,
+                          'specifiedRandomNumberMode': True, 'specifiedRandomNumber': 3}
+        changes = {'pulseWidth': 2.5, 'laserPulseWidth': 2.0, 'interferometerDiff': 4.2,
+                   'firstLaserPulseMode': True, 'firstModulationPulseMode': True, 'specifiedRandomNumberMode': False,
+                   'specifiedRandomNumber': 11, 'amplituteSignalTime': 0.5, 'amplituteSignalPhase': 0.5,
+                   'amplituteDecoyTime': 0.5, 'amplituteDecoyPhase': 0.5, 'amplitutePM': 0.5}
+        for name in AWGWaveformCreator.ChannelNames:
+            changes['delay{}'.format(name)] = 7.3
+        self.assertEqual(sorted(changes.keys()), sorted(AWGWaveformCreator.Dependencies.keys()))
+        parameters = [AWGWaveformCreatorTest.timeParameters, modeParameters,
+                      AWGWaveformCreatorTest.amplituteParameters]
+        waveforms = AWGWaveformCreator(*parameters).createWaveforms(self.randomNumbers)
+        for key in changes.keys():
+            changed = [dict(p) for p in parameters]
+            [p for p in changed if p.__contains__(key)][0][key] = changes[key]
+            newWaveforms = AWGWaveformCreator(*changed).createWaveforms(self.randomNumbers)
+            affected = [name for name in AWGWaveformCreator.ChannelNames if
+                        not np.array_equal(waveforms[name], newWaveforms[name])]
+            self.assertEqual(affected, AWGWaveformCreator.Dependencies[key], key)
+
+    def testSaveToFile(self):
+        testSpace = tempfile.mkdtemp()
+        try:
+            creator = AWGWaveformCreator()
+            waveforms = creator.createWaveforms(self.randomNumbers)
+            path = os.path.join(testSpace, 'test.wave')
+            creator.saveToFile(path, waveforms)
+            with open(path, 'rb') as file:
+                data = file.read()
+            self.assertEqual(len(data), 6 * 300 * 250)
+            self.assertEqual(data[3 * 75000:4 * 75000], waveforms['PM'].tobytes())
+        finally:
+            shutil.rmtree(testSpace)
+
+    def tearDown(self):
+        pass
+
+    @classmethod
+    def tearDownClass(cls):
+        pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+__author__ = 'Hwaipy'
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+from Services.HBTFile import HBTFile
+
+
+class HBTFileTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        pass
+
+    def setUp(self):
+        self.testSpace = tempfile.mkdtemp()
+        self.path = os.path.join(self.testSpace, 'HBTFileTest.hbt')
+
+    def testInitialize(self):
+        hbtFile = HBTFile(self.path)
+        hbtFile.initialize([["Column 1", HBTFile.BYTE], ["Column 2", HBTFile.DOUBLE]])
+        data = open(self.path, 'rb').read()
+        head = b'Byte:Column 1\nDouble:Column 2'
+        self.assertEqual(data, b'HBT\0' + struct.pack('>i', len(head)) + head)
+        self.assertEqual(hbtFile.getRowCount(), 0)
+        self.assertEqual(hbtFile.getHeads(), [["Column 1", "Byte"], ["Column 2", "Double"]])
+        self.assertRaises(IOError, hbtFile.initialize, [["Column 1", HBTFile.BYTE]])
+        self.assertRaises(IOError, HBTFile, os.path.join(self.testSpace, 'HBTFileTest.txt'))
+
+    def testAppendAndRead(self):
+        hbtFile = HBTFile(self.path)
+        hbtFile.initialize(
+            [["Column 1", HBTFile.BYTE], ["Column 2", HBTFile.SHORT], ["Column 3", HBTFile.INT],
+             ["Column 4", HBTFile.LONG], ["Column 5", HBTFile.FLOAT], ["Column 6", HBTFile.DOUBLE]])
+        hbtFile.appendRow([1, 2, 3, 4, 5, 6])
+        hbtFile.appendRows([[1, 2, 3, 4, 5, 6], [1, 2, 3, 4, 5, 6], [1.1, 2.2, 3.3, 4.4, 5.5, 6.6]])
+        self.assertEqual(hbtFile.readRow(0), [1, 2, 3, 4, 5, 6])
+        self.assertEqual(hbtFile.readRows(1, 2), [[1, 2, 3, 4, 5, 6], [1, 2, 3, 4, 5, 6]])
+        self.assertEqual(hbtFile.readRow(3), [1, 2, 3, 4, 5.5, 6.6])
+        self.assertEqual(hbtFile.getColumnCount(), 6)
+        self.assertEqual(hbtFile.getRowCount(), 4)
+        self.assertEqual(hbtFile.readMetaData()['RowDataLength'], 27)
+        self.assertEqual(hbtFile.getHeadNames(),
+                         ['Column 1', 'Column 2', 'Column 3', 'Column 4', 'Column 5', 'Column 6'])
+        self.assertRaises(IOError, hbtFile.readRow, 4)
+        self.assertRaises(IOError, hbtFile.appendRow, [1, 2])
+
+    def testReopenAndColumns(self):
+        hbtFile = HBTFile(self.path)
+        hbtFile.initialize([["Index", HBTFile.INT], ["Value", HBTFile.DOUBLE]])
+        hbtFile.appendRows([[i, i * 0.25] for i in range(0, 1000)])
+        hbtFile.close()
+        reopened = HBTFile(self.path)
+        self.assertEqual(reopened.getRowCount(), 1000)
+        self.assertEqual(reopened.column('Index')[10:13].tolist(), [10, 11, 12])
+        self.assertEqual(reopened.column(1)[-1], 999 * 0.25)
+        self.assertEqual(reopened.column('Value').sum(), sum([i * 0.25 for i in range(0, 1000)]))
+        reopened.appendRow([1000, 250.0])
+        self.assertEqual(len(reopened.column('Index')), 1001)
+        reopened.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.testSpace)
+
+    @classmethod
+    def tearDownClass(cls):
+        pass
+
+
+if __name__ == '__main__':
+    unittest.main()
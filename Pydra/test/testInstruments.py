@@ -0,0 +1,158 @@
+__author__ = 'Hwaipy'
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import SimulatedVISA
+from Instruments import DefaultIdentityCache, deviceMethod, DeviceException, IdentityCache, parseIdentity, \
+    VISAInstrument, VISAInstrumentWrapper
+from SCPI import SCPI
+from SimulatedVISA import IT6322Script, KeySight34465AScript
+
+
+class InstrumentsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        pass
+
+    def setUp(self):
+        self.testSpace = tempfile.mkdtemp()
+
+    def testParseIdentity(self):
+        self.assertEqual(parseIdentity('Keysight Technologies,34465A,MY5700, A.02.14-02.40\n'),
+                         ['Keysight Technologies', '34465A', 'MY5700', 'A.02.14-02.40'])
+        self.assertEqual(parseIdentity('USTC,VISAInstrument'), ['USTC', 'VISAInstrument', '', ''])
+        self.assertEqual(parseIdentity(''), ['', '', '', ''])
+        self.assertEqual(parseIdentity(None), ['', '', '', ''])
+        self.assertTrue(VISAInstrument.matchIdentity(parseIdentity('USTC, VISAInstrument, 1, 2')))
+        self.assertFalse(VISAInstrument.matchIdentity(parseIdentity('USTC,Other,1,2')))
+
+    def testIdentityCache(self):
+        cache = IdentityCache(ttl=0.2)
+        self.assertIsNone(cache.get('GPIB0::1::INSTR'))
+        cache.put('GPIB0::1::INSTR', ['USTC', 'VISAInstrument', '1', '2'])
+        cache.put('GPIB0::2::INSTR', ['USTC', 'Other', '3', '4'])
+        self.assertEqual(cache.get('GPIB0::1::INSTR'), ['USTC', 'VISAInstrument', '1', '2'])
+        cache.invalidate('GPIB0::2::INSTR')
+        self.assertIsNone(cache.get('GPIB0::2::INSTR'))
+        time.sleep(0.3)
+        self.assertIsNone(cache.get('GPIB0::1::INSTR'))
+
+    def testPersistentIdentityCache(self):
+        path = os.path.join(self.testSpace, 'identities.json')
+        cache = IdentityCache(path=path)
+        cache.put('TCPIP0::192.168.1.2::inst0::INSTR', ['USTC', 'VISAInstrument', '1', '2'])
+        self.assertEqual(IdentityCache(path=path).get('TCPIP0::192.168.1.2::inst0::INSTR'),
+                         ['USTC', 'VISAInstrument', '1', '2'])
+        self.assertIsNone(IdentityCache(ttl=-1, path=path).get('TCPIP0::192.168.1.2::inst0::INSTR'))
+        cache.invalidate()
+        self.assertIsNone(IdentityCache(path=path).get('TCPIP0::192.168.1.2::inst0::INSTR'))
+
+    def testConcurrentIdentityCache(self):
+        path = os.path.join(self.testSpace, 'identities.json')
+        cache = IdentityCache(path=path)
+
+        def put(i):
+            for j in range(0, 20):
+                cache.put('TCPIP0::{}::{}::INSTR'.format(i, j), ['USTC', 'VISAInstrument', str(i), str(j)])
+
+        threads = [threading.Thread(target=put, args=(i,)) for i in range(0, 8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        reloaded = IdentityCache(path=path)
+        for i in range(0, 8):
+            for j in range(0, 20):
+                self.assertEqual(reloaded.get('TCPIP0::{}::{}::INSTR'.format(i, j)),
+                                 ['USTC', 'VISAInstrument', str(i), str(j)])
+        self.assertEqual(os.listdir(self.testSpace), ['identities.json'])
+
+    def testListResourcesSavesOnce(self):
+        SimulatedVISA.simulate('SIM::34465A::1', KeySight34465AScript())
+        SimulatedVISA.simulate('SIM::IT6322::1', IT6322Script())
+        cache = IdentityCache(path=os.path.join(self.testSpace, 'identities.json'))
+        saves = []
+        save = cache.save
+        cache.save = lambda: saves.append(save())
+        try:
+            self.assertEqual(VISAInstrument.listResources(cache=cache), [])
+            self.assertEqual(len(saves), 1)
+            self.assertEqual(IdentityCache(path=cache.path).get('SIM::IT6322::1')[1], 'IT6322')
+            VISAInstrument.listResources(cache=cache)
+            self.assertEqual(len(saves), 1)
+        finally:
+            SimulatedVISA.remove()
+
+    def testCachedIdentity(self):
+        queries = []
+
+        def query(cmd):
+            queries.append(cmd)
+            return 'USTC,VISAInstrument,SN1,V2\n'
+
+        instrument = VISAInstrument.__new__(VISAInstrument)
+        instrument.resourceID = 'TEST::IDENTITY::INSTR'
+        instrument.identity = None
+        instrument.scpi = SCPI(query, None)
+        DefaultIdentityCache.invalidate(instrument.resourceID)
+        instrument.verifyIdentity()
+        self.assertEqual(queries, ['*IDN?'])
+        instrument.verifyIdentity()
+        self.assertEqual([instrument.getManufacturer(), instrument.getModel(), instrument.getSerialNumber()],
+                         ['USTC', 'VISAInstrument', 'SN1'])
+        self.assertEqual(instrument.getIdentity(), ['USTC', 'VISAInstrument', 'SN1', 'V2'])
+        self.assertEqual(queries, ['*IDN?'])
+        instrument.identity = None
+        instrument.verifyIdentity()
+        self.assertEqual(queries, ['*IDN?'])
+        self.assertEqual(instrument.refreshIdentity(), ['USTC', 'VISAInstrument', 'SN1', 'V2'])
+        self.assertEqual(queries, ['*IDN?', '*IDN?'])
+        DefaultIdentityCache.invalidate(instrument.resourceID)
+
+    def testDeviceMethod(self):
+        def fail(exception):
+            raise exception
+
+        method = deviceMethod(fail)
+        self.assertEqual(method.__name__, 'fail')
+        try:
+            method(ValueError('v'))
+            self.fail()
+        except DeviceException as e:
+            self.assertEqual(e.message, 'Error in fail')
+            self.assertIsInstance(e.exception, ValueError)
+        deviceException = DeviceException('d')
+        try:
+            deviceMethod(fail, 'other')(deviceException)
+            self.fail()
+        except DeviceException as e:
+            self.assertIs(e, deviceException)
+
+    def testWrapper(self):
+        SimulatedVISA.simulate('SIM::WRAPPER', SimulatedVISA.SimulatedScript())
+        wrapper = VISAInstrument.connect('SIM::WRAPPER')
+        self.assertIs(wrapper.getSerialNumber, wrapper.getSerialNumber)
+        self.assertEqual(wrapper.getSerialNumber(), 'SIM00001')
+        self.assertEqual(wrapper.getVersion(), '1999.0')
+        self.assertRaises(DeviceException, wrapper.checkChannel, 1)
+        self.assertRaises(DeviceException, wrapper.resourceID)
+        self.assertRaises(AttributeError, getattr, wrapper, 'missing')
+        self.assertRaises(AttributeError, getattr, wrapper, '__deepcopy__')
+        wrapper.close()
+        SimulatedVISA.remove('SIM::WRAPPER')
+        DefaultIdentityCache.invalidate('SIM::WRAPPER')
+
+    def tearDown(self):
+        shutil.rmtree(self.testSpace)
+
+    @classmethod
+    def tearDownClass(cls):
+        pass
+
+
+if __name__ == '__main__':
+    unittest.main()
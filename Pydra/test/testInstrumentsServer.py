@@ -0,0 +1,144 @@
+__author__ = 'Hwaipy'
+
+import threading
+import time
+import unittest
+import SimulatedVISA
+from Instruments import DefaultIdentityCache, DeviceException, InstrumentsServer
+from Services.MultiMeter.KeySightMultiMeter import KeySight_MultiMeter_34465A, KeySight_MultiMeter_34470A, \
+    MultiMeterServiceWrap
+from SimulatedVISA import KeySight34465AScript
+from Utils import FairLock
+
+
+class InstrumentsServerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        pass
+
+    def setUp(self):
+        DefaultIdentityCache.invalidate()
+        self.script = SimulatedVISA.simulate('SIM::34465A::1', KeySight34465AScript())
+        self.sessions = []
+
+        class Session:
+            def __init__(self, address, invoker, name):
+                self.invoker = invoker
+                self.name = name
+                self.stopped = False
+
+            def stop(self):
+                self.stopped = True
+
+        def sessionFactory(address, invoker, name):
+            session = Session(address, invoker, name)
+            self.sessions.append(session)
+            return session
+
+        self.server = InstrumentsServer(('localhost', 20102), sessionFactory)
+
+    def testShared(self):
+        dmm = self.server.open(KeySight_MultiMeter_34465A, 'SIM::34465A::1')
+        self.assertIs(self.server.open(KeySight_MultiMeter_34465A, 'SIM::34465A::1'), dmm)
+        self.assertRaises(DeviceException, self.server.open, KeySight_MultiMeter_34470A, 'SIM::34465A::1')
+        self.assertEqual(self.server.instruments(), {'SIM::34465A::1': '34465A'})
+        self.assertEqual(self.script.history.count('*IDN?'), 1)
+        self.assertEqual(dmm.directMeasure(2), [1.0, 1.0])
+        self.assertEqual(dmm.model, '34465A')
+        self.assertRaises(DeviceException, dmm.setMeasureQuantity, None)
+
+    def testCachedState(self):
+        dmm = self.server.open(KeySight_MultiMeter_34465A, 'SIM::34465A::1')
+        wrap = MultiMeterServiceWrap(dmm)
+        for i in range(0, 3):
+            wrap.setDCVoltageMeasurement(aperture=0.0002)
+            self.assertEqual(wrap.getAperture(), 0.0002)
+            self.assertEqual(wrap.getRange(), 1)
+            self.assertEqual(wrap.getIdentity(), KeySight34465AScript.identity.split(','))
+        self.assertEqual(self.script.history.count('CONF:VOLT:DC'), 1)
+        self.assertEqual(self.script.history.count('VOLT:APER?'), 1)
+        self.assertEqual(self.script.history.count('VOLT:RANG?'), 3)
+        self.script.values['VOLT'] = 5.0
+        self.assertEqual(wrap.getRange(), 10)
+        wrap.setDCVoltageMeasurement(range=1, autoRange=False, aperture=0.0002)
+        self.assertEqual(wrap.getRange(), 1)
+        self.assertEqual(wrap.getRange(), 1)
+        self.assertEqual(self.script.history.count('CONF:VOLT:DC'), 2)
+        self.assertEqual(self.script.history.count('VOLT:RANG?'), 5)
+        self.assertEqual(dmm.statistics(), {'Calls': 16, 'CachedQueries': 5, 'SkippedSetters': 2})
+        dmm.invalidate()
+        wrap.setDCVoltageMeasurement(range=1, autoRange=False, aperture=0.0002)
+        self.assertEqual(wrap.getRange(), 1)
+        self.assertEqual(self.script.history.count('CONF:VOLT:DC'), 3)
+
+    def testFailedSetter(self):
+        failing = []
+
+        class FailingMultiMeter(KeySight_MultiMeter_34465A):
+            def setMeasureQuantity(self, mq, range=0, autoRange=True, aperture=0.001):
+                super().setMeasureQuantity(mq, range, autoRange, aperture)
+                if len(failing) > 0:
+                    raise RuntimeError('Failed after the writes.')
+
+        dmm = self.server.open(FailingMultiMeter, 'SIM::34465A::1')
+        wrap = MultiMeterServiceWrap(dmm)
+        wrap.setDCVoltageMeasurement(range=1, autoRange=False, aperture=0.0002)
+        self.assertEqual([wrap.getRange(), wrap.getAperture()], [1, 0.0002])
+        self.assertEqual([wrap.getRange(), wrap.getAperture()], [1, 0.0002])
+        failing.append(True)
+        self.assertRaises(DeviceException, wrap.setDCVoltageMeasurement, range=10, autoRange=False, aperture=0.0005)
+        self.assertEqual([wrap.getRange(), wrap.getAperture()], [10, 0.0005])
+        self.assertEqual(self.script.history.count('VOLT:RANG?'), 2)
+        self.assertRaises(DeviceException, wrap.setDCVoltageMeasurement, range=10, autoRange=False, aperture=0.0005)
+        self.assertEqual(wrap.getRange(), 10)
+        self.assertEqual(self.script.history.count('CONF:VOLT:DC'), 3)
+
+    def testServe(self):
+        self.assertRaises(DeviceException, self.server.serve, 'SIM::34465A::1', 'DMM')
+        dmm = self.server.open(KeySight_MultiMeter_34465A, 'SIM::34465A::1')
+        session = self.server.serve('SIM::34465A::1', 'DMM', MultiMeterServiceWrap)
+        self.assertIs(session.invoker.dev, dmm)
+        self.assertIs(self.server.serve('SIM::34465A::1', 'DMM-Raw').invoker, dmm)
+        self.assertRaises(DeviceException, self.server.serve, 'SIM::34465A::1', 'DMM')
+        self.assertEqual(self.server.services(), {'DMM': 'SIM::34465A::1', 'DMM-Raw': 'SIM::34465A::1'})
+        self.assertEqual(session.invoker.directMeasure(1), [1.0])
+        self.server.close()
+        self.assertEqual([s.stopped for s in self.sessions], [True, True])
+        self.assertEqual(self.server.services(), {})
+        self.assertEqual(self.server.instruments(), {})
+
+    def testFairLock(self):
+        lock = FairLock()
+        order = []
+        lock.acquire()
+        with lock:
+            pass
+
+        def client(i):
+            with lock:
+                order.append(i)
+
+        threads = []
+        for i in range(0, 5):
+            thread = threading.Thread(target=client, args=(i,))
+            thread.start()
+            threads.append(thread)
+            time.sleep(0.02)
+        lock.release()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, [0, 1, 2, 3, 4])
+        self.assertRaises(RuntimeError, lock.release)
+
+    def tearDown(self):
+        self.server.close()
+        SimulatedVISA.remove()
+        DefaultIdentityCache.invalidate()
+
+    @classmethod
+    def tearDownClass(cls):
+        pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+__author__ = 'Hwaipy'
+
+import time
+import unittest
+import numpy as np
+import SimulatedVISA
+from Instruments import DefaultIdentityCache, DeviceException
+from Services.MultiMeter.KeySightMultiMeter import KeySight_MultiMeter_34465A, KeySight_MultiMeter_34470A, \
+    MultiMeterServiceWrap
+from SimulatedVISA import KeySight34465AScript, KeySight34470AScript
+
+
+class KeySightMultiMeterTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        pass
+
+    def setUp(self):
+        DefaultIdentityCache.invalidate()
+        self.script = SimulatedVISA.simulate('SIM::34470A::1', KeySight34470AScript(values={'VOLT': 2.0}))
+        self.dev = KeySight_MultiMeter_34470A('SIM::34470A::1')
+
+    def testStream(self):
+        stream = self.dev.startStream(interval=0.001, pollInterval=0.01)
+        subscription = stream.subscribe()
+        self.assertRaises(DeviceException, self.dev.directMeasure, 1)
+        self.assertRaises(DeviceException, self.dev.startStream)
+        readings = []
+        for reading in subscription:
+            readings.append(reading)
+            if len(readings) == 100:
+                break
+        self.assertEqual([r[1] for r in readings], [2.0] * 100)
+        timestamps = np.array([r[0] for r in readings])
+        self.assertTrue(np.allclose(np.diff(timestamps), 0.001, atol=1e-6))
+        self.assertLess(abs(timestamps[-1] - time.time()), 0.1)
+        self.dev.stopStream()
+        self.assertFalse(stream.isRunning())
+        readings += list(subscription)
+        statistics = stream.statistics()
+        self.assertEqual(statistics['Readings'], len(readings))
+        self.assertEqual(statistics['Overruns'], 0)
+        self.assertEqual(self.dev.directMeasure(2), [2.0, 2.0])
+
+    def testBufferOverrun(self):
+        stream = self.dev.startStream(interval=0.001, bufferSize=20, pollInterval=0.01)
+        subscription = stream.subscribe(fromStart=True)
+        time.sleep(0.1)
+        timestamps, values = subscription.read(maxCount=5)
+        self.assertEqual(len(values), 5)
+        self.assertGreater(subscription.lost, 0)
+        late = stream.subscribe(fromStart=True)
+        self.assertEqual(late.read(timeout=0)[1].tolist(), [2.0] * 20)
+        self.assertEqual(late.lost, 0)
+        self.dev.stopStream()
+
+    def testInstrumentOverrun(self):
+        self.script.memorySize = 10
+        stream = self.dev.startStream(interval=0.001, pollInterval=0.05)
+        subscription = stream.subscribe()
+        time.sleep(0.2)
+        self.dev.stopStream()
+        statistics = stream.statistics()
+        self.assertGreater(statistics['Overruns'], 0)
+        self.assertGreater(statistics['LostReadings'], 0)
+        timestamps = np.array([r[0] for r in subscription])
+        self.assertTrue(np.all(np.diff(timestamps) > 0))
+        self.assertLess(abs(timestamps[-1] - time.time()), 0.2)
+
+    def testServiceStream(self):
+        SimulatedVISA.simulate('SIM::34465A::1', KeySight34465AScript())
+        wrap = MultiMeterServiceWrap(KeySight_MultiMeter_34465A.connect('SIM::34465A::1'))
+        wrap.startStream(0.001)
+        timestamps, values, lost = wrap.readStream()
+        self.assertEqual(len(timestamps), len(values))
+        self.assertGreater(len(values), 0)
+        self.assertEqual(lost, 0)
+        wrap.stopStream()
+
+    def tearDown(self):
+        self.dev.stopStream()
+        self.dev.close()
+        SimulatedVISA.remove()
+        DefaultIdentityCache.invalidate()
+
+    @classmethod
+    def tearDownClass(cls):
+        pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+__author__ = 'Hwaipy'
+
+import unittest
+import numpy as np
+from Services.WaveformGenerator.PulseTemplates import PulseTemplateLibrary, samplesPerPulse, sensitiveColumns, \
+    tilePulses
+
+
+class PulseTemplatesTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        pass
+
+    def setUp(self):
+        pass
+
+    def testLibrary(self):
+        library = PulseTemplateLibrary(maxTemplates=2)
+        builds = []
+
+        def builder(value):
+            def build():
+                builds.append(value)
+                return np.full(4, value)
+
+            return build
+
+        self.assertEqual(library.template('AM', 1, 25e9, (2e-9,), builder(1)).tolist(), [1, 1, 1, 1])
+        self.assertEqual(library.template('AM', 1, 25e9, (2e-9,), builder(5)).tolist(), [1, 1, 1, 1])
+        library.template('AM', 2, 25e9, (2e-9,), builder(2))
+        library.template('AM', 1, 25e9, (2e-9,), builder(5))
+        library.template('AM', 1, 25e9, (3e-9,), builder(3))
+        self.assertEqual(library.size(), 2)
+        library.template('AM', 1, 25e9, (2e-9,), builder(5))
+        library.template('AM', 2, 25e9, (2e-9,), builder(2))
+        self.assertEqual(builds, [1, 2, 3, 2])
+        self.assertEqual((library.hits, library.misses), (3, 4))
+        self.assertRaises(ValueError, library.template('AM', 2, 25e9, (2e-9,), builder(2)).fill, 0)
+        library.clear()
+        self.assertEqual((library.size(), library.hits, library.misses), (0, 0, 0))
+
+    def testTiling(self):
+        self.assertEqual(samplesPerPulse(400, 1 / 100e6, 25e9, 100000), 250)
+        self.assertEqual(samplesPerPulse(59, 1 / 100e6, 25e9, 14749), 250)
+        self.assertEqual(samplesPerPulse(10, 1 / 99.3e6, 24.7e9, 2487), None)
+        self.assertEqual(sensitiveColumns(250, 25e9, 1 / 100e6, [2e-9, 3.11e-9, 5e-9]).tolist(), [0, 50, 125])
+        table = np.array([[0, 1, 2, 3], [4, 5, 6, 7]])
+        waveform = tilePulses(table, np.array([1, 0, 1]), np.array([2]), 1, lambda indices: -indices, 11)
+        self.assertEqual(waveform.tolist(), [0, -1, -2, -3, 0, 1, -6, 3, 4, 5, -10])
+
+    def tearDown(self):
+        pass
+
+    @classmethod
+    def tearDownClass(cls):
+        pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+__author__ = 'Hwaipy'
+
+import io
+import unittest
+import numpy as np
+from SCPI import SCPI, encodeBlock, parseBlock, readBlock
+
+
+class SCPITest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        pass
+
+    def setUp(self):
+        self.written = []
+        self.queried = []
+
+        def query(cmd):
+            self.queried.append(cmd)
+            return 'response\n'
+
+        self.scpi = SCPI(query, self.written.append)
+
+    def testCommands(self):
+        self.scpi.CONF.VOLT.DC.write('AUTO')
+        self.scpi.CONF.VOLT.DC.write(10, 0.001)
+        self.scpi._TRG.write()
+        self.scpi.SAMP.COUN.write(5)
+        self.assertEqual(self.written, ['CONF:VOLT:DC AUTO', 'CONF:VOLT:DC 10,0.001', '*TRG', 'SAMP:COUN 5'])
+        self.assertEqual(self.scpi._IDN.query(), 'response')
+        self.assertEqual(self.scpi.WLISt.NAME.query(1, '"{}"'), 'response')
+        self.assertEqual(self.queried, ['*IDN?', 'WLISt:NAME? 1,"{}"'])
+        self.assertEqual(str(self.scpi.CONF.VOLT), '[SCPI]CONF:VOLT')
+
+    def testInterned(self):
+        self.assertIs(self.scpi.CONF.VOLT.DC, self.scpi.CONF.VOLT.DC)
+        self.assertIsNot(self.scpi.CONF.VOLT, self.scpi.CONF.CURR)
+        self.assertIsNot(self.scpi.CONF.VOLT, SCPI(None, None).CONF.VOLT)
+        self.assertRaises(AttributeError, getattr, self.scpi, '__deepcopy__')
+
+    def testBatch(self):
+        with self.scpi.batch():
+            self.scpi.TRIG.SOURCE.write('BUS')
+            self.scpi.SAMP.COUN.write(10)
+            with self.scpi.batch():
+                self.scpi.INIT.write()
+            self.scpi._TRG.write()
+            self.assertEqual(self.written, [])
+        self.assertEqual(self.written, ['TRIG:SOURCE BUS;:SAMP:COUN 10;:INIT;*TRG'])
+        self.scpi.INIT.write()
+        self.assertEqual(self.written[-1], 'INIT')
+
+    def testBatchFlushedBeforeQuery(self):
+        with self.scpi.batch():
+            self.scpi.INST.NSEL.write(1)
+            self.assertEqual(self.scpi.VOLT.query(), 'response')
+            self.assertEqual(self.written, ['INST:NSEL 1'])
+            self.scpi.VOLT.write('1V')
+            self.scpi.OUTP.write(1)
+        self.assertEqual(self.written, ['INST:NSEL 1', 'VOLT 1V;:OUTP 1'])
+        self.assertEqual(self.queried, ['VOLT?'])
+
+    def testBatchLineLength(self):
+        scpi = SCPI(None, self.written.append, maxLineLength=34)
+        with scpi.batch():
+            for i in range(0, 5):
+                scpi.SOURce.VOLTage.write(i)
+        self.assertEqual(self.written, ['SOURce:VOLTage 0;:SOURce:VOLTage 1', 'SOURce:VOLTage 2;:SOURce:VOLTage 3',
+                                        'SOURce:VOLTage 4'])
+        self.assertEqual(max([len(w) for w in self.written]), 34)
+
+    def testBlocks(self):
+        values = np.array([1.5, -2.25, 1e-300, 3e8])
+        block = encodeBlock(values.astype('>f8'))
+        self.assertEqual(block[:4], b'#232')
+        self.assertEqual(parseBlock(block + b'\n', '>f8').tolist(), values.tolist())
+        self.assertEqual(parseBlock(b'#0' + values.tobytes() + b'\n', '<f8').tolist(), values.tolist())
+        self.assertEqual(parseBlock(b'#10', 'B').tolist(), [])
+        self.assertRaises(RuntimeError, parseBlock, b'1.5,2.5\n', '>f8')
+        self.assertRaises(RuntimeError, parseBlock, block[:-1], '>f8')
+        stream = io.BytesIO(b' ' + block + b'\n' + b'next')
+        self.assertEqual(readBlock(stream.read), block)
+        self.assertEqual(stream.read(), b'next')
+
+    def testBinaryTransfer(self):
+        raw = []
+
+        def queryRaw(cmd):
+            self.queried.append(cmd)
+            return encodeBlock(np.arange(0, 5, dtype='>f8')) + b'\n'
+
+        scpi = SCPI(None, self.written.append, queryRaw=queryRaw, writeRaw=raw.append)
+        with scpi.batch():
+            scpi.FORM.DATA.write('REAL', 64)
+            self.assertEqual(scpi.FETC.queryBinary('>f8').tolist(), [0, 1, 2, 3, 4])
+        self.assertEqual(self.written, ['FORM:DATA REAL,64'])
+        self.assertEqual(self.queried, ['FETC?'])
+        scpi.WLISt.WAVeform.DATA.writeBinary(np.array([0.5, 1], dtype='<f4'), '"W"', 0)
+        scpi.DATA.writeBinary(np.array([1, 2], dtype=np.uint8))
+        self.assertEqual(raw, [b'WLISt:WAVeform:DATA "W",0,#18' + np.array([0.5, 1], dtype='<f4').tobytes(),
+                               b'DATA #12\x01\x02'])
+        self.assertRaises(RuntimeError, self.scpi.FETC.queryBinary, '>f8')
+
+    def tearDown(self):
+        pass
+
+    @classmethod
+    def tearDownClass(cls):
+        pass
+
+
+if __name__ == '__main__':
+    unittest.main()
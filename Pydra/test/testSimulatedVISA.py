@@ -0,0 +1,121 @@
+__author__ = 'Hwaipy'
+
+import time
+import unittest
+import numpy as np
+import SimulatedVISA
+from Instruments import DefaultIdentityCache, DeviceException, VISAInstrument
+from SCPI import parseBlock, readBlock
+from Services.MultiMeter.KeySightMultiMeter import KeySight_MultiMeter_34465A, KeySight_MultiMeter_34470A, \
+    MeasureQuantity
+from Services.PowerSupply.ITECH_IT6322 import IT6322
+from SimulatedVISA import compileHeader, IT6322Script, KeySight34465AScript, KeySight34470AScript, SimulatedResource
+
+
+class SimulatedVISATest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        pass
+
+    def setUp(self):
+        DefaultIdentityCache.invalidate()
+        self.dmm = SimulatedVISA.simulate('SIM::34465A::1', KeySight34465AScript(values={'VOLT': 1.5, 'CURR': 2e-3,
+                                                                                        'RES': 100.0}))
+        SimulatedVISA.simulate('SIM::34470A::1', KeySight34470AScript())
+        self.power = SimulatedVISA.simulate('SIM::IT6322::1', IT6322Script(loads=(10.0, 10.0, 10.0)))
+
+    def testHeaders(self):
+        regex = compileHeader('[SENSe:]VOLTage[:DC]:APERture')
+        for header in ['VOLT:APER', 'SENS:VOLT:DC:APER', ':VOLTAGE:APERTURE', 'SENSe:VOLT:DC:APERture'.upper()]:
+            self.assertIsNotNone(regex.match(header), header)
+        for header in ['VOL:APER', 'VOLT:APER?', 'VOLT:DC']:
+            self.assertIsNone(regex.match(header), header)
+        self.assertEqual(compileHeader('OUTPut#').match('OUTP2').groups(), ('2',))
+        self.assertEqual(SimulatedResource.splitCommands(b'APP:VOLT 1, 2, 3;:DISP:TEXT "a;b";*TRG\n'),
+                         [('APP:VOLT', ['1', '2', '3']), (':DISP:TEXT', ['"a;b"']), ('*TRG', [])])
+
+    def testResource(self):
+        resource = SimulatedVISA.openSimulated('SIM::34465A::1')
+        self.assertEqual(resource.query('*IDN?'), KeySight34465AScript.identity + '\n')
+        resource.write('CONF:CURR;:TRIG:SOUR IMM;:SAMP:COUN 3;:FORM REAL,64;:INIT')
+        resource.write('FETC?')
+        self.assertEqual(parseBlock(readBlock(resource.read_bytes), '>f8').tolist(), [2e-3] * 3)
+        self.assertRaises(RuntimeError, resource.query, 'SYST:UNKN?')
+        self.assertRaises(RuntimeError, resource.read)
+        self.assertRaises(ValueError, SimulatedVISA.openSimulated, 'SIM::NONE')
+
+    def testMultiMeter(self):
+        dev = KeySight_MultiMeter_34465A.connect('SIM::34465A::1')
+        self.assertEqual(dev.getModel(), '34465A')
+        self.assertEqual(dev.directMeasure(4), [1.5] * 4)
+        dev.setMeasureQuantity(MeasureQuantity.Resistance, aperture=0.0001)
+        self.assertEqual(dev.getVersion(), '1999.0')
+        self.assertEqual(self.dmm.aperture, 0.0001)
+        fetch = dev.directMeasureAndFetchLater(2)
+        self.assertEqual(fetch(), [100.0, 100.0])
+        self.assertRaises(DeviceException, KeySight_MultiMeter_34470A, 'SIM::34465A::1')
+        dev.close()
+
+    def testNoise(self):
+        self.dmm.noise = 0.01
+        dev = KeySight_MultiMeter_34465A('SIM::34465A::1')
+        readings = np.array(dev.directMeasure(200))
+        self.assertLess(abs(np.mean(readings) - 1.5), 0.01)
+        self.assertGreater(np.std(readings), 0.005)
+
+    def testReadingMemory(self):
+        self.dmm.memorySize = 10
+        resource = SimulatedVISA.openSimulated('SIM::34465A::1')
+        resource.write('VOLT:APER 0.001;:TRIG:COUN INF;:INIT')
+        time.sleep(0.03)
+        self.assertEqual(resource.query('DATA:POIN?'), '10\n')
+        self.assertEqual(resource.query('STAT:QUES?'), '16384\n')
+        self.assertEqual(len(resource.query('DATA:REM? 4').split(',')), 4)
+        self.assertEqual(resource.query('STAT:QUES?'), '0\n')
+        resource.write('ABOR')
+        self.assertRaises(RuntimeError, resource.query, 'DATA:REM? 100')
+
+    def testLatency(self):
+        SimulatedVISA.simulate('SIM::34465A::2', KeySight34465AScript(), latency=0.01)
+        resource = SimulatedVISA.openSimulated('SIM::34465A::2')
+        start = time.time()
+        for i in range(0, 5):
+            resource.query('*IDN?')
+        self.assertGreaterEqual(time.time() - start, 0.05)
+
+    def testPowerSupply(self):
+        dev = IT6322('SIM::IT6322::1')
+        self.assertTrue(self.power.remote)
+        self.assertEqual(dev.voltageSetpoints, [0, 0, 0])
+        dev.setVoltage(1, 5)
+        dev.setCurrentLimit(1, 0.2)
+        dev.setOutputStatus(1, True)
+        dev.setVoltages([1, 40, 3])
+        dev.setOutputStatuses([True, True, False])
+        dev.scpi.SYSTem.VERSion.query()
+        self.assertEqual(self.power.voltages, [1, 30, 3])
+        self.assertEqual(self.power.currents, [3, 0.2, 3])
+        self.assertEqual(self.power.outputs, [True, True, False])
+        voltages = [float(v) for v in dev.scpi.MEAS.VOLT.ALL.query().split(', ')]
+        currents = [float(c) for c in dev.scpi.MEAS.CURR.ALL.query().split(', ')]
+        self.assertEqual(voltages, [1, 2, 0])
+        self.assertEqual(currents, [0.1, 0.2, 0])
+
+    def testListResources(self):
+        resources = KeySight_MultiMeter_34465A.listResources()
+        self.assertIn('SIM::34465A::1', resources)
+        self.assertNotIn('SIM::34470A::1', resources)
+        self.assertEqual(IT6322.listResources(), ['SIM::IT6322::1'])
+        self.assertEqual(VISAInstrument.listResources(), [])
+
+    def tearDown(self):
+        SimulatedVISA.remove()
+        DefaultIdentityCache.invalidate()
+
+    @classmethod
+    def tearDownClass(cls):
+        pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+__author__ = 'Hwaipy'
+
+import threading
+import unittest
+from Utils import SingleThreadProcessor
+
+
+class SingleThreadProcessorTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        pass
+
+    def setUp(self):
+        self.processor = SingleThreadProcessor()
+        self.executed = []
+        self.gate = threading.Event()
+        started = threading.Event()
+
+        # Holds the processor, so that the tasks of a test are queued together.
+        def hold():
+            started.set()
+            self.gate.wait()
+
+        self.processor.invokeLater(hold)
+        started.wait()
+
+    def testInvoke(self):
+        self.gate.set()
+        self.processor.invokeLater(self.executed.append, 1)
+        self.assertEqual(self.processor.invokeAndWait(lambda a, b=0: a + b, 2, b=3), 5)
+        self.assertEqual(self.executed, [1])
+        self.assertRaises(ZeroDivisionError, self.processor.invokeAndWait, lambda: 1 / 0)
+        future = self.processor.submit(SingleThreadProcessor.PriorityBulk, lambda: threading.current_thread().name)
+        self.assertTrue(future.result().startswith('SingleTreadProcessorThread'))
+
+    def testPriority(self):
+        self.processor.submit(SingleThreadProcessor.PriorityBulk, self.executed.append, 'bulk')
+        self.processor.invokeLater(self.executed.append, 'write')
+        future = self.processor.submit(SingleThreadProcessor.PriorityInteractive, self.executed.append, 'query')
+        self.gate.set()
+        future.result()
+        self.processor.invokeAndWait(lambda: None)
+        self.processor.submit(SingleThreadProcessor.PriorityBulk, lambda: None).result()
+        self.assertEqual(self.executed, ['write', 'query', 'bulk'])
+
+    def testCoalescedWrites(self):
+        joiner = lambda messages: ';'.join(messages)
+        for message in ['A 1', 'B 2', 'C 3']:
+            self.processor.writeLater(self.executed.append, message, joiner)
+        self.processor.invokeLater(self.executed.append, 'query')
+        for message in ['D 4', 'E 5', 'F 6']:
+            self.processor.writeLater(self.executed.append, message, joiner, maxLength=8)
+        self.gate.set()
+        self.processor.invokeAndWait(lambda: None)
+        self.assertEqual(self.executed, ['A 1;B 2;C 3', 'query', 'D 4;E 5', 'F 6'])
+        metrics = self.processor.metrics()
+        self.assertEqual(metrics['Coalesced'], 3)
+        self.assertEqual(metrics['Depth'], 0)
+        self.assertEqual(metrics['MaxDepth'], 8)
+        self.assertGreaterEqual(metrics['Tasks'], 5)
+        self.assertGreater(metrics['MeanServiceTime'], 0)
+        self.assertGreaterEqual(metrics['MaxServiceTime'], metrics['MeanServiceTime'])
+
+    def tearDown(self):
+        self.gate.set()
+
+    @classmethod
+    def tearDownClass(cls):
+        pass
+
+
+if __name__ == '__main__':
+    unittest.main()
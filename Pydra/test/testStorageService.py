@@ -6,7 +6,8 @@ from Pydra import Message, ProtocolException, Session
 import socket
 import threading
 import time
-from Services.Storage import StorageService, HBTFileElement
+import msgpack
+from Services.Storage import StorageService, HBTFileElement, FSFrameDecoder
 
 
 class StorageServiceTest(unittest.TestCase):
@@ -73,6 +74,52 @@ class StorageServiceTest(unittest.TestCase):
         self.assertEqual(elements[1].get(u"Size"), 10)
         mc.stop()
 
+    def testWalk(self):
+        mc = Session((StorageServiceTest.addr, StorageServiceTest.port), None)
+        mc.start()
+        service = StorageService(mc, listingCacheTTL=10, pageSize=3)
+        service.createFile(u"{}a2/NewFile".format(StorageServiceTest.testSpacePath))
+        expected = [StorageServiceTest.testSpacePath + p for p in
+                    ["_A1", "_A2", "a1", "a2", "a2/NewFile", "a3", "a4", "a5"]]
+        self.assertEqual(list(service.walk(StorageServiceTest.testSpacePath)), expected)
+        self.assertEqual(list(service.walk(StorageServiceTest.testSpacePath, 1)),
+                         [p for p in expected if not p.endswith("a2/NewFile")])
+        self.assertEqual([m.get(u"Type") for m in service.walk(StorageServiceTest.testSpacePath, -1, True)],
+                         [u"Content", u"Content", u"Collection", u"Collection", u"Content", u"Collection",
+                          u"Collection", u"Collection"])
+        self.assertEqual(list(service.walk(StorageServiceTest.testSpacePath)), expected)
+        service.delete(u"{}a2/NewFile".format(StorageServiceTest.testSpacePath))
+        self.assertEqual(list(service.walk(StorageServiceTest.testSpacePath)),
+                         [p for p in expected if not p.endswith("a2/NewFile")])
+        mc.stop()
+
+    def testWalkCache(self):
+        mc = Session((StorageServiceTest.addr, StorageServiceTest.port), None)
+        mc.start()
+        service = StorageService(mc, listingCacheTTL=10, pageSize=3)
+        walk = service.walk(StorageServiceTest.testSpacePath)
+        self.assertEqual(next(walk), StorageServiceTest.testSpacePath + "_A1")
+        service.createFile(u"{}a2/NewFile".format(StorageServiceTest.testSpacePath))
+        list(walk)
+        self.assertIn(StorageServiceTest.testSpacePath + "a2/NewFile",
+                      list(service.walk(StorageServiceTest.testSpacePath)))
+        for listing in [lambda: list(service.walk(StorageServiceTest.testSpacePath, -1, True)),
+                        lambda: service.listElements(StorageServiceTest.testSpacePath, True)]:
+            listing()[0][u"Name"] = u"Modified"
+            self.assertEqual(listing()[0][u"Name"], u"_A1")
+        mc.stop()
+
+    def testMetaDataMany(self):
+        mc = Session((StorageServiceTest.addr, StorageServiceTest.port), None)
+        mc.start()
+        service = StorageService(mc, pageSize=2)
+        paths = [StorageServiceTest.testSpacePath + p for p in ["a1", "_A1", "_A2", "NotExist"]]
+        self.assertEqual([(m.get(u"Name"), m.get(u"Type"), m.get(u"Size")) for m in service.metaDataMany(paths)],
+                         [(u"a1", u"Collection", None), (u"_A1", u"Content", 36), (u"_A2", u"Content", 10),
+                          (u"NotExist", u"NotExist", None)])
+        self.assertEqual(service.existsMany(paths), [True, True, True, False])
+        mc.stop()
+
     def testNote(self):
         mc = Session((StorageServiceTest.addr, StorageServiceTest.port), None)
         mc.start()
@@ -245,6 +292,23 @@ class StorageServiceTest(unittest.TestCase):
         self.assertEqual(A1.readAsString(0, 16), "1234567890ABCDEf")
         mc.stop()
 
+    def testFollow(self):
+        mc = Session((StorageServiceTest.addr, StorageServiceTest.port), None)
+        mc.start()
+        A1 = StorageService(mc).getElement(StorageServiceTest.testSpacePath).resolve('_A1')
+
+        def appendLater():
+            for data in [b"ABC", b"DE"]:
+                time.sleep(0.3)
+                A1.append(data)
+
+        threading.Thread(target=appendLater).start()
+        startTime = time.time()
+        self.assertEqual(b"".join(A1.follow(timeout=1.5)), b"ABCDE")
+        self.assertLess(time.time() - startTime, 3)
+        self.assertEqual(A1.waitForUpdate(36, 0.1)["Size"], 41)
+        mc.stop()
+
     def testElementDelete(self):
         mc = Session((StorageServiceTest.addr, StorageServiceTest.port), None)
         mc.start()
@@ -299,6 +363,57 @@ class StorageServiceTest(unittest.TestCase):
                          ['Column 1', 'Column 2', 'Column 3', 'Column 4', 'Column 5', 'Column 6'])
         mc.stop()
 
+    def testHBTFileCache(self):
+        mc = Session((StorageServiceTest.addr, StorageServiceTest.port), None)
+        mc.start()
+        service = StorageService(mc)
+        element = service.getElement(StorageServiceTest.testSpacePath).resolve('HBTFileCacheTest.hbt')
+        hbtFile = HBTFileElement(element, metaDataTTL=0.5, prefetchRows=3)
+        hbtFile.initialize([["Column 1", HBTFileElement.INT], ["Column 2", HBTFileElement.DOUBLE]])
+        self.assertEqual(hbtFile.getRowCount(), 0)
+        hbtFile.appendRows([[i, i * 0.5] for i in range(0, 10)])
+        self.assertEqual(hbtFile.getRowCount(), 10)
+        self.assertEqual([hbtFile.readRow(i) for i in range(0, 10)], [[i, i * 0.5] for i in range(0, 10)])
+        element.toHBTFileElement().appendRow([10, 5.0])
+        self.assertEqual(hbtFile.readRow(10), [10, 5.0])
+        element.toHBTFileElement().appendRow([11, 5.5])
+        self.assertEqual(hbtFile.getRowCount(), 11)
+        time.sleep(0.6)
+        self.assertEqual(hbtFile.getRowCount(), 12)
+        self.assertEqual(hbtFile.getHeadNames(), ['Column 1', 'Column 2'])
+        mc.stop()
+
+    def testFSFile(self):
+        mc = Session((StorageServiceTest.addr, StorageServiceTest.port), None)
+        mc.start()
+        service = StorageService(mc)
+        fsFile = service.getElement(StorageServiceTest.testSpacePath).resolve('FSFileTest.fs').toFSFileElement()
+        fsFile.initialize()
+        self.assertEqual(fsFile.frameCount(), 0)
+        messages = [{u"Index": i, u"Content": u"M" * i} for i in range(0, 50)]
+        frames = [msgpack.packb(m, use_bin_type=True) for m in messages]
+        fsFile.appendFrame(frames[0])
+        fsFile.appendFrames(frames[1:])
+        self.assertEqual(fsFile.frameCount(), 50)
+        self.assertEqual(fsFile.readFrames(10, 5), frames[10:15])
+        self.assertEqual(fsFile.readFrame(49), frames[49])
+        self.assertEqual(fsFile.readFrames(45, 10), frames[45:])
+        self.assertEqual(fsFile.readTailFrames(0, 2), [frames[49], frames[48]])
+        self.assertEqual(list(fsFile.messages(40)), messages[40:])
+        decoder = FSFrameDecoder()
+        data = fsFile.storageElement.readAll()
+        for i in range(0, len(data), 7):
+            decoder.feed(data[i:i + 7])
+        self.assertEqual(list(decoder), frames)
+        fsFile.storageElement.clear()
+        fsFile.appendFrames(frames[20:25])
+        self.assertEqual(fsFile.readFrames(0, 10), frames[20:25])
+        fsFile.storageElement.write(b'\x00\x00\x00\x00\x7f\xff\xff\xff', 0)
+        self.assertEqual(fsFile.readFrames(0, 10), frames[20:25])
+        fsFile.invalidate()
+        self.assertRaises(IOError, fsFile.readFrames, 0, 10)
+        mc.stop()
+
     def tearDown(self):
         pass
 
@@ -0,0 +1,204 @@
+__author__ = 'Hwaipy'
+
+import unittest
+import numpy as np
+from Services.WaveformGenerator.AWG70002Simulator import SimulatedAWG70002
+from Services.WaveformGenerator.TekAWG70kService import AWG70002, AWG70002PM, AWGDev
+
+
+class TekAWG70kServiceTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        pass
+
+    def setUp(self):
+        self.simulator = SimulatedAWG70002()
+        self.dev = AWG70002PM(instr_handle=self.simulator)
+
+    def testSimulator(self):
+        self.assertEqual(self.dev._identity(), SimulatedAWG70002.Identity)
+        self.assertEqual(self.dev.clockRate, 25e9)
+        self.assertEqual(self.dev.maxSeqSteps, SimulatedAWG70002.MaxSequenceSteps)
+        self.dev.setClock(20e9)
+        self.assertEqual(self.dev.clockRate, 20e9)
+        self.dev.start([1, 2])
+        self.assertTrue(self.simulator.running)
+        self.assertEqual(self.simulator.outputs, {1: True, 2: True})
+        self.assertTrue(self.dev.isAWGend())
+        self.dev.stop()
+        self.assertFalse(self.simulator.running)
+        self.assertEqual(self.simulator.outputs, {1: False, 2: False})
+        self.assertRaises(RuntimeError, self.simulator.write, 'WLISt:WAVeform:DELete "NotExists"')
+        self.assertRaises(RuntimeError, self.simulator.write, 'WLISt:UNDefined')
+
+    def testMaxSequenceSteps(self):
+        transfers = self.simulator.transfers
+        self.assertEqual(self.dev.maxSeqSteps, SimulatedAWG70002.MaxSequenceSteps)
+        self.assertEqual(self.dev.maxSeqSteps, SimulatedAWG70002.MaxSequenceSteps)
+        self.assertEqual(self.simulator.transfers - transfers, 1)
+
+        class Unanswered(SimulatedAWG70002):
+            def query(self, message):
+                if message.startswith('SLIST:SEQUENCE:STEP:MAX?'):
+                    raise RuntimeError('Timeout.')
+                return SimulatedAWG70002.query(self, message)
+
+        dev = AWG70002PM(instr_handle=Unanswered())
+        self.assertEqual(dev.maxSeqSteps, AWG70002PM.DefaultMaxSeqSteps)
+        self.assertEqual(dev.getSysParams()['maxSequenceLength'], AWG70002PM.DefaultMaxSeqSteps)
+
+    def testTransferTiming(self):
+        self.simulator = SimulatedAWG70002()
+        self.simulator.write('WLISt:WAVeform:NEW "W",10')
+        self.assertEqual(self.simulator.transfers, 1)
+        self.assertAlmostEqual(self.simulator.simulatedTime,
+                               self.simulator.latency + 26 / self.simulator.bytesPerSecond)
+
+    def testChunkedUpload(self):
+        awg = AWG70002.__new__(AWG70002)
+        written = []
+        progress = []
+        data = np.arange(0, 10, dtype=np.float32)
+        statistics = awg._writeChunked(lambda name, chunk, start: written.append((name, chunk.tolist(), start)), 'W',
+                                       data, 4, lambda sent, total: progress.append((sent, total)))
+        self.assertEqual(written, [('W', [0, 1, 2, 3], 0), ('W', [4, 5, 6, 7], 4), ('W', [8, 9], 8)])
+        self.assertEqual(progress, [(4, 10), (8, 10), (10, 10)])
+        self.assertEqual([statistics[k] for k in ['Name', 'Samples', 'Bytes', 'Chunks', 'ChunkSize']],
+                         ['W', 10, 40, 3, 4])
+        self.assertIs(awg.lastUploadStatistics, statistics)
+        self.assertEqual(awg._writeChunked(lambda name, chunk, start: None, 'W', data)['Chunks'], 1)
+        self.assertEqual(awg._writeChunked(lambda name, chunk, start: None, 'W', data[:0])['Chunks'], 0)
+
+    def testWaveformUpload(self):
+        data = np.sin(np.arange(0, 10000) / 100)
+        statistics = self.dev.writeWaveform('W', data, chunkSize=3000)
+        self.assertEqual(statistics['Chunks'], 4)
+        self.assertEqual(self.simulator.waveforms['W']['Data'].tolist(), data.astype(np.float32).tolist())
+        self.assertEqual(self.dev._getWaveformLength('W'), 10000)
+
+    def testUploadDeduplication(self):
+        data = np.sin(np.arange(0, 10000) / 100)
+        self.assertIsNotNone(self.dev.writeWaveform('W', data, chunkSize=3000))
+        transfers = self.simulator.transfers
+        self.assertIsNone(self.dev.writeWaveform('W', data))
+        self.assertEqual(self.simulator.transfers, transfers)
+        hash = AWG70002PM.contentHash(data.astype(np.float32))
+        self.assertEqual(self.dev.getCatalog()['W'], {'Length': 10000, 'Hash': hash, 'MarkerHash': None})
+        self.assertEqual(self.dev.findWaveform(AWG70002PM.contentKey(10000, hash, None)), 'W')
+        marker1 = (np.arange(0, 10000) % 250 < 50).astype(np.uint8)
+        marker2 = (np.arange(0, 10000) % 250 < 10).astype(np.uint8)
+        self.assertIsNotNone(self.dev.addMarker('W', marker1, marker2, chunkSize=3000))
+        transfers = self.simulator.transfers
+        self.assertIsNone(self.dev.addMarker('W', marker1, marker2))
+        self.assertEqual(self.simulator.transfers, transfers)
+        markerHash = AWG70002PM.contentHash(AWG70002.packMarkers(marker1, marker2))
+        self.assertIsNone(self.dev.findWaveform(AWG70002PM.contentKey(10000, hash, None)))
+        self.assertEqual(self.dev.findWaveform(AWG70002PM.contentKey(10000, hash, markerHash)), 'W')
+        self.assertIsNotNone(self.dev.writeWaveform('W', data * 0.5))
+        self.assertGreater(self.simulator.transfers, transfers)
+        self.dev._deleteWaveform('W')
+        self.assertEqual(self.dev.getCatalog(), {})
+        self.assertIsNone(self.dev.findWaveform(AWG70002PM.contentKey(10000, hash, markerHash)))
+
+    def testPackMarkers(self):
+        marker1 = np.array([0, 1, 1, 0, 1])
+        marker2 = np.array([0, 0, 1, 1, 3])
+        packed = [0x00, 0x40, 0xC0, 0x80, 0xC0]
+        self.assertEqual(AWG70002.packMarkers(marker1, marker2).dtype, np.uint8)
+        self.assertEqual(AWG70002.packMarkers(marker1, marker2).tolist(), packed)
+        self.assertEqual(AWG70002.packMarkers(np.stack([marker1, marker2], axis=1)).tolist(), packed)
+        self.assertEqual(AWG70002.packMarkers(marker1).tolist(), [0x00, 0xC0, 0xC0, 0x00, 0xC0])
+        self.assertEqual(AWG70002.packMarkers([1, 0], [True, True]).tolist(), [0xC0, 0x80])
+
+    def testMarkerUpload(self):
+        data = np.sin(np.arange(0, 10000) / 100)
+        self.dev.writeWaveform('W', data)
+        marker1 = (np.arange(0, 10000) % 250 < 50).astype(np.uint8)
+        marker2 = (np.arange(0, 10000) % 250 < 10).astype(np.uint8)
+        self.assertEqual(self.dev.addMarker('W', marker1, marker2, chunkSize=3000)['Chunks'], 4)
+        self.assertEqual(self.simulator.waveforms['W']['Marker'].tolist(),
+                         (marker1 * 0x40 + marker2 * 0x80).tolist())
+        self.assertEqual(self.simulator.waveforms['W']['Data'].tolist(), data.astype(np.float32).tolist())
+        self.dev.writeMarker('M', np.stack([marker1, marker2], axis=1))
+        self.assertEqual(self.simulator.waveforms['M']['Marker'].tolist(),
+                         (marker1 * 0x40 + marker2 * 0x80).tolist())
+
+    def testSequenceItemCommands(self):
+        awg = AWG70002.__new__(AWG70002)
+        written = []
+        awg._write_raw = written.append
+        item = AWG70002.SequenceItem('W', AWG70002.SequenceItem.TriggerMode.TrigegrB, repeat=2,
+                                     goto=AWG70002.SequenceItem.Target.LAST, jumpMode='ITR', jumpTarget=5)
+        awg._setSequenceItemWaveform('S', 3, 1, 'W')
+        awg._setSequenceItemRepeat('S', 3, 2)
+        awg._setSequenceItemWaitMode('S', 3, 'BTR')
+        awg._setSequenceItemGoto('S', 3, 'LAST')
+        awg._setSequenceItemJumpMode('S', 3, 'ITR')
+        awg._setSequenceItemJumpTarget('S', 3, 5)
+        self.assertEqual(written, ['SLISt:SEQuence:STEP3:TASSet1:WAVeform "S", "W"',
+                                   'SLISt:SEQuence:STEP3:RCOunt "S", 2', 'SLISt:SEQuence:STEP3:WINPut "S", BTR',
+                                   'SLISt:SEQuence:STEP3:GOTO "S", LAST',
+                                   'SLISt:SEQuence:STEP3:EJINput "S", ITR', 'SLISt:SEQuence:STEP3:EJUMp "S", 5'])
+        self.assertEqual(awg._sequenceItemCommands('S', 3, item), written)
+        del written[:]
+        awg._setSequenceItem('S', 3, item)
+        self.assertEqual(written, awg._sequenceItemCommands('S', 3, item))
+        self.assertEqual(awg._batchCommands(written), [';:'.join(written)])
+
+    def testSequenceUpload(self):
+        self.dev.writeWaveformPattern(0)
+        self.dev.writeWaveformPattern(100)
+        items = [AWG70002.SequenceItem('wfPattern000', AWG70002.SequenceItem.TriggerMode.TriggerA),
+                 AWG70002.SequenceItem('wfPattern100', 'OFF', repeat=3, goto='FIRST')] * 3000
+        estimate = self.dev.writeSequence('S', items, dryRun=True)
+        self.assertEqual(len(self.simulator.sequences), 0)
+        transfers = self.simulator.transfers
+        self.dev.writeSequence('S', items)
+        # SLISt:SIZE?, SLISt:SEQuence:NEW, the batches and *OPC?.
+        self.assertEqual(self.simulator.transfers - transfers, estimate['Transfers'] + 3)
+        self.assertEqual(self.dev._getSequenceLength('S'), 6000)
+        steps = self.simulator.sequences['S']['Items']
+        self.assertEqual(steps[0], {'Waveform': 'wfPattern000', 'Repeat': '1', 'WaitMode': 'ATR', 'Goto': 'NEXT',
+                                    'JumpMode': 'OFF', 'JumpTarget': 'NEXT'})
+        self.assertEqual(steps[5999], {'Waveform': 'wfPattern100', 'Repeat': '3', 'WaitMode': 'OFF', 'Goto': 'FIRST',
+                                       'JumpMode': 'OFF', 'JumpTarget': 'NEXT'})
+        self.dev.assignOutputSeq(1, 'S')
+        self.assertEqual(self.simulator.assignments[1], ('Sequence', 'S', 1))
+
+    def testCatalog(self):
+        self.assertEqual(self.dev.AddWaveform(0), 'wfPattern000')
+        self.assertEqual(self.dev.AddWaveform(-5), 'wfPattern000')
+        self.assertEqual(self.dev.AddMarker(10, 2), 'mk2Pattern010')
+        self.assertEqual(sorted(self.simulator.waveforms.keys()), ['mk2Pattern010', 'wfPattern000'])
+        dev = AWG70002PM(instr_handle=self.simulator)
+        self.assertEqual(dev.getCatalog(), {'wfPattern000': {'Length': 2400, 'Hash': None, 'MarkerHash': None},
+                                            'mk2Pattern010': {'Length': 2400, 'Hash': None, 'MarkerHash': None}})
+        dev.clearAll()
+        self.assertEqual(len(self.simulator.waveforms), 0)
+        self.assertEqual(dev.getCatalog(), {})
+
+    def testAWGDev(self):
+        awgDev = AWGDev(self.dev)
+        awgDev.generateNewWaveform()
+        self.assertEqual(sorted(self.simulator.waveforms.keys()), ['Waveform1', 'Waveform2'])
+        self.assertEqual(self.simulator.assignments, {1: ('Waveform', 'Waveform1'), 2: ('Waveform', 'Waveform2')})
+        self.assertEqual(len(self.simulator.waveforms['Waveform1']['Data']), 1200 * 250)
+        waveform1 = self.simulator.waveforms['Waveform1']
+        transfers = self.simulator.transfers
+        awgDev.configure('delayPM', 1.2)
+        awgDev.generateNewWaveform()
+        self.assertIs(self.simulator.waveforms['Waveform1'], waveform1)
+        self.assertGreater(self.simulator.transfers, transfers)
+        self.assertEqual(self.simulator.waveforms['Waveform2']['Data'].tolist(),
+                         (awgDev.waveforms['PM'] / 128.0 - 1).astype(np.float32).tolist())
+
+    def tearDown(self):
+        pass
+
+    @classmethod
+    def tearDownClass(cls):
+        pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+__author__ = 'Hwaipy'
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from Services.WaveformGenerator import WaveformBundle
+from Services.WaveformGenerator.AWGWaveformCreator import AWGWaveformCreator
+
+
+class WaveformBundleTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        pass
+
+    def setUp(self):
+        self.testSpace = tempfile.mkdtemp()
+
+    def testSaveAndLoad(self):
+        path = os.path.join(self.testSpace, 'waveforms.wfb')
+        waveforms = {'A': np.arange(0, 1000, dtype=np.uint8), 'B': np.linspace(-1, 1, 333, dtype=np.float32),
+                     'C': np.arange(0, 7, dtype='>i8'), 'Empty': np.zeros(0, dtype=np.float64)}
+        WaveformBundle.saveBundle(path, waveforms, 25e9, {'delays': {'A': -1.2e-9}, 'mode': True},
+                                  ['B', 'A', 'C', 'Empty'])
+        with WaveformBundle.loadBundle(path) as bundle:
+            self.assertEqual(bundle.channelNames, ['B', 'A', 'C', 'Empty'])
+            self.assertEqual(bundle.sampleRate, 25e9)
+            self.assertEqual(bundle.parameters, {'delays': {'A': -1.2e-9}, 'mode': True})
+            for name in waveforms.keys():
+                self.assertEqual(bundle[name].dtype, waveforms[name].dtype)
+                self.assertTrue(np.array_equal(bundle[name], waveforms[name]))
+                self.assertEqual(bundle[name].ctypes.data % WaveformBundle.Alignment, 0)
+            self.assertFalse(bundle['A'].flags.writeable)
+
+    def testNotBundle(self):
+        path = os.path.join(self.testSpace, 'test.wave')
+        with open(path, 'wb') as file:
+            file.write(b'\0' * 600)
+        self.assertRaises(RuntimeError, WaveformBundle.loadBundle, path)
+
+    def testCreator(self):
+        creator = AWGWaveformCreator()
+        waveforms = creator.createWaveforms([0, 1, 2, 3, 8, 9, 10, 11, 12, 13, 14, 15] * 10)
+        path = os.path.join(self.testSpace, 'waveforms.wfb')
+        creator.saveBundle(path, waveforms)
+        legacyPath = os.path.join(self.testSpace, 'test.wave')
+        creator.saveToFile(legacyPath, waveforms)
+        legacy = WaveformBundle.loadLegacyWave(legacyPath)
+        with WaveformBundle.loadBundle(path) as bundle:
+            self.assertEqual(bundle.channelNames, AWGWaveformCreator.ChannelNames)
+            self.assertEqual(bundle.parameters['pulseWidth'], creator.pulseWidth)
+            for name in AWGWaveformCreator.ChannelNames:
+                self.assertTrue(np.array_equal(bundle[name], waveforms[name]))
+                self.assertTrue(np.array_equal(legacy[name], waveforms[name]))
+
+    def tearDown(self):
+        shutil.rmtree(self.testSpace)
+
+    @classmethod
+    def tearDownClass(cls):
+        pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -28,6 +28,7 @@ class Storage(val basePath: Path) {
   private val elementCache = new WeakHashMap[String, StorageElement]()
   private val rootElement = doGetStorageElement("/", false)
   private var permission: Permission = _
+  private val contentMonitor = new Object
   elementCache.put("/", rootElement)
   if (!rootElement.exists) throw new IOException("BasePath [" + basePath.toString() + "] not exists.");
 
@@ -53,6 +54,24 @@ class Storage(val basePath: Path) {
     Files.createTempDirectory(trashSpace, "[" + time + "]")
   }
 
+  def fireContentChanged() = contentMonitor.synchronized {
+    contentMonitor.notifyAll
+  }
+
+  // Blocks until the size of path differs from knownSize, path is deleted, or timeout ms passed. Only size changes are
+  // reported: a write in place that keeps the size does not end the wait. The caller checks the permission to read
+  // path before, as the wait does not use the permission, which other requests change meanwhile.
+  def waitForContentChange(path: String, knownSize: Long, timeout: Long) {
+    val deadline = System.currentTimeMillis + timeout
+    contentMonitor.synchronized {
+      var remaining = timeout
+      while (getStorageElement(path).uncheckedSize == Some(knownSize) && remaining > 0) {
+        contentMonitor.wait(remaining)
+        remaining = deadline - System.currentTimeMillis
+      }
+    }
+  }
+
   //def getStorageElement(path: String, cacheable: Boolean) = doGetStorageElement(path, cacheable)
   def getHipInformation(path: String) = {
     val element = getStorageElement(path)
@@ -65,6 +84,35 @@ class Storage(val basePath: Path) {
     Map("note" -> note, "items" -> items.map(e => e.metaDataMap(true)))
   }
 
+  // Pre-order walk, each level sorted by name. With after (a path returned by an earlier walk), the walk resumes right
+  // after it: the branches before it are skipped without being listed, and elements created or deleted meanwhile are
+  // neither repeated nor skipped.
+  def walk(path: String, depth: Int, after: String = ""): Stream[StorageElement] = {
+    def walkElement(element: StorageElement, level: Int, resume: List[String]): Stream[StorageElement] = {
+      val children = element.listElements.sortBy(se => se.name).toStream
+      (resume match {
+        case Nil => children
+        case name :: _ => children.dropWhile(e => e.name < name)
+      }).flatMap(e => {
+        val resumeInside = resume match {
+          case name :: rest if e.name == name => Some(rest)
+          case _ => None
+        }
+
+        def descendants =
+          if (e.getType == ElementType.Collection && (depth <= 0 || level < depth)) walkElement(e, level + 1, resumeInside.getOrElse(Nil))
+          else Stream.empty[StorageElement]
+
+        if (resumeInside.isDefined) descendants else e #:: descendants
+      })
+    }
+
+    val root = getStorageElement(path)
+    val resume = if (after.isEmpty) Nil
+    else Storage.Splitter.split(after).filterNot(_.isEmpty).toList.drop(Storage.Splitter.split(root.path).count(!_.isEmpty))
+    walkElement(root, 1, resume)
+  }
+
   def HBTFileInitialize(path: String, heads: List[List[String]]) = {
     val element = getStorageElement(path)
     if (!element.exists) element.createFile
@@ -248,6 +296,9 @@ class StorageElement(private val storage: Storage, val path: String) {
     buffer
   }
 
+  // The size without validation and permission checks, None if not content. For waitForContentChange only.
+  private[storage] def uncheckedSize = if (valid && elementType == Content) Some(fileLength) else None
+
   def readAll = {
     validationVerify(getType == Content, "Path [" + path + "] is not content.")
     permissionVerify(this, Read)
@@ -274,6 +325,7 @@ class StorageElement(private val storage: Storage, val path: String) {
     raf.write(data)
     raf.close
     reload()
+    storage.fireContentChanged()
   }
 
   def write(data: Array[Byte], start: Long) {
@@ -284,6 +336,7 @@ class StorageElement(private val storage: Storage, val path: String) {
     raf.write(data)
     raf.close
     reload()
+    storage.fireContentChanged()
   }
 
   def clear {
@@ -293,6 +346,7 @@ class StorageElement(private val storage: Storage, val path: String) {
     raf.setLength(0)
     raf.close
     reload()
+    storage.fireContentChanged()
   }
 
   def delete {
@@ -310,6 +364,7 @@ class StorageElement(private val storage: Storage, val path: String) {
     if (!Files.exists(trashSpot, LinkOption.NOFOLLOW_LINKS)) Files.createDirectories(trashSpot)
     Files.move(absolutePath, trashSpot.resolve(absolutePath.getFileName()))
     reload()
+    storage.fireContentChanged()
   }
 
   def getCreationTime = creationTime
@@ -84,6 +84,33 @@ class StorageService(basePath: Path, clientName: String, descriptionFile: String
     element.metaDataMap(withTime)
   }
 
+  def walk(user: String, path: String, depth: Int = -1, withMetaData: Boolean = false, after: String = "", count: Int = 1000) = {
+    storage.updatePermission(new Permission(user))
+    val page = storage.walk(path, depth, after).take(count + 1).toList
+    val elements = page.take(count)
+    storage.clearPermission
+    Map("Elements" -> elements.map(e => if (withMetaData) e.metaDataMap(true) else e.path), "HasMore" -> (page.size > count),
+      "Next" -> elements.lastOption.map(e => e.path).getOrElse(after))
+  }
+
+  def metaDataMany(user: String, paths: List[String], withTime: Boolean = false) = {
+    storage.updatePermission(new Permission(user))
+    val metaData = paths.map(path => storage.getStorageElement(path).metaDataMap(withTime))
+    storage.clearPermission
+    metaData
+  }
+
+  def waitForUpdate(user: String, path: String, knownSize: Long, timeout: Long = 10000) = {
+    storage.updatePermission(new Permission(user))
+    storage.getStorageElement(path).size
+    storage.clearPermission
+    storage.waitForContentChange(path, knownSize, timeout)
+    storage.updatePermission(new Permission(user))
+    val metaData = storage.getStorageElement(path).metaDataMap(false)
+    storage.clearPermission
+    metaData
+  }
+
   def read(user: String, path: String, start: Long, length: Int) = {
     storage.updatePermission(new Permission(user))
     val data = storage.getStorageElement(path).read(start, length)
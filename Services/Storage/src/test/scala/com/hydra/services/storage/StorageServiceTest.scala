@@ -128,6 +128,29 @@ class StorageServiceTest extends FunSuite with BeforeAndAfter with BeforeAndAfte
     assert(service.listElements("", "/a2") == List("NewDir", "NewFile"))
   }
 
+  test("Test walk") {
+    val service = new StorageService(testSpace, "Test-StorageService", "")
+    assert(service.walk("", "/") == Map("Elements" -> List("/NewFile", "/_A1", "/a2", "/a2/NewDir", "/a2/NewFile", "/a3", "/a4", "/a5"), "HasMore" -> false, "Next" -> "/a5"))
+    assert(service.walk("", "/", 1) == Map("Elements" -> List("/NewFile", "/_A1", "/a2", "/a3", "/a4", "/a5"), "HasMore" -> false, "Next" -> "/a5"))
+    assert(service.walk("", "/", -1, false, "/_A1", 3) == Map("Elements" -> List("/a2", "/a2/NewDir", "/a2/NewFile"), "HasMore" -> true, "Next" -> "/a2/NewFile"))
+    assert(service.walk("", "/", -1, false, "/a2", 2) == Map("Elements" -> List("/a2/NewDir", "/a2/NewFile"), "HasMore" -> true, "Next" -> "/a2/NewFile"))
+    assert(service.walk("", "/", 1, false, "/a2/NewDir", 10) == Map("Elements" -> List("/a3", "/a4", "/a5"), "HasMore" -> false, "Next" -> "/a5"))
+    assert(service.walk("", "/", -1, false, "/a5", 10) == Map("Elements" -> List(), "HasMore" -> false, "Next" -> "/a5"))
+    assert(service.walk("", "/a2", -1, false, "/a2/NewDir", 10)("Elements") == List("/a2/NewFile"))
+    // Resumed after a path that is deleted meanwhile.
+    assert(service.walk("", "/", -1, false, "/a2/NewDir2", 10)("Elements") == List("/a2/NewFile", "/a3", "/a4", "/a5"))
+    val elements = service.walk("", "/a2", -1, true)("Elements").asInstanceOf[List[Map[String, _]]]
+    assert(elements.map(e => List(e("Name"), e("Path"), e("Type"))) == List(List("NewDir", "/a2/NewDir", "Collection"), List("NewFile", "/a2/NewFile", "Content")))
+  }
+
+  test("Test metaDataMany") {
+    val service = new StorageService(testSpace, "Test-StorageService", "")
+    assert(service.metaDataMany("", List("/a3", "/_A1", "/_")) == List(
+      Map("Name" -> "a3", "Path" -> "/a3", "Type" -> "Collection"),
+      Map("Name" -> "_A1", "Path" -> "/_A1", "Type" -> "Content", "Size" -> 45),
+      Map("Name" -> "_", "Path" -> "/_", "Type" -> "NotExist")))
+  }
+
   test("Test HBTFile.") {
     val service = new StorageService(testSpace, "Test-StorageService", "")
     service.HBTFileInitialize("", "/HBTFileTest.hbt", List("Column 1", "Byte") :: List("Column 2", "Short") ::
@@ -171,6 +194,30 @@ class StorageServiceTest extends FunSuite with BeforeAndAfter with BeforeAndAfte
     allFrames.zip((List(frames(0)) ::: frames)).foreach(z => assert(z._1.toList == z._2.toList))
   }
 
+  test("Test waitForUpdate.") {
+    val service = new StorageService(testSpace, "Test-StorageService", "")
+    service.createFile("", "/FollowTest")
+    assert(service.waitForUpdate("", "/FollowTest", 0, 100)("Size") == 0)
+    new Thread(new Runnable {
+      override def run {
+        Thread.sleep(200)
+        service.append("", "/FollowTest", new String("ABCDE").getBytes)
+      }
+    }).start
+    val startTime = System.currentTimeMillis
+    assert(service.waitForUpdate("", "/FollowTest", 0, 10000)("Size") == 5)
+    assert(System.currentTimeMillis - startTime < 5000)
+    new Thread(new Runnable {
+      override def run {
+        Thread.sleep(200)
+        service.delete("", "/FollowTest")
+      }
+    }).start
+    val deleteTime = System.currentTimeMillis
+    assert(service.waitForUpdate("", "/FollowTest", 5, 10000)("Type") == "NotExist")
+    assert(System.currentTimeMillis - deleteTime < 5000)
+  }
+
   after {
   }
 